@@ -8,8 +8,10 @@ import trimesh
 from .step1x3d_texture.pipelines.step1x_3d_texture_synthesis_pipeline import (
     Step1X3DTexturePipeline,
 )
+from .step1x3d_texture.differentiable_renderer.mesh_utils import export_textured_glb
 from .step1x3d_geometry.models.pipelines.pipeline_utils import reduce_face, remove_degenerate_face
 from .step1x3d_geometry.models.pipelines.pipeline import Step1X3DGeometryPipeline
+from .step1x3d_geometry.models.pipelines.mesh_export import export_quantized_glb
 
 
 class LoadStep1X3DGeometryModel:
@@ -233,7 +235,10 @@ class SaveUntexturedMesh:
             "required": {
                 "untextured_mesh": ("UNTEXTUREDMESH",),
                 "save_glb_path": ("STRING", {"default": "untexture_mesh.glb"}),
-            }
+            },
+            "optional": {
+                "export_mode": (["default", "quantized"], {"default": "default"}),
+            },
         }
 
     RETURN_TYPES = ("MESH",)
@@ -241,8 +246,11 @@ class SaveUntexturedMesh:
     FUNCTION = "save_untextured_mesh"
     CATEGORY = "Step1X-3D"
 
-    def save_untextured_mesh(self, untextured_mesh, save_glb_path):
-        untextured_mesh.mesh[0].export(save_glb_path)
+    def save_untextured_mesh(self, untextured_mesh, save_glb_path, export_mode="default"):
+        if export_mode == "quantized":
+            export_quantized_glb(untextured_mesh.mesh[0], save_glb_path)
+        else:
+            untextured_mesh.mesh[0].export(save_glb_path)
         untexture_mesh_path = save_glb_path
         
         return (untexture_mesh_path,)     
@@ -255,15 +263,33 @@ class SaveTexturedMesh:
             "required": {
                 "textured_mesh": ("TESTUREDMESH",),
                 "save_glb_path": ("STRING", {"default": "textured_mesh.glb"}),
-            }
+            },
+            "optional": {
+                "texture_format": (["png", "jpeg", "webp"], {"default": "png"}),
+                "texture_quality": ("INT", {"default": 95, "min": 1, "max": 100}),
+                "png_compress_level": ("INT", {"default": 6, "min": 0, "max": 9}),
+            },
         }
 
     RETURN_TYPES = ()
     FUNCTION = "save_textured_mesh"
     CATEGORY = "Step1X-3D"
 
-    def save_textured_mesh(self, textured_mesh, save_glb_path):
-        textured_mesh.export(save_glb_path)
+    def save_textured_mesh(
+        self,
+        textured_mesh,
+        save_glb_path,
+        texture_format="png",
+        texture_quality=95,
+        png_compress_level=6,
+    ):
+        export_textured_glb(
+            textured_mesh,
+            save_glb_path,
+            texture_format=texture_format,
+            quality=texture_quality,
+            compress_level=png_compress_level,
+        )
         
         return ()     
 
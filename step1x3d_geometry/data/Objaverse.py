@@ -15,6 +15,7 @@ from ..utils.config import parse_structured
 
 from streaming import StreamingDataLoader
 from .base import BaseDataModuleConfig, BaseDataset
+from .dataloader import build_dataloader
 
 
 @dataclass
@@ -48,11 +49,15 @@ class ObjaverseDataModule(pl.LightningDataModule):
     def general_loader(
         self, dataset, batch_size, collate_fn=None, num_workers=0
     ) -> DataLoader:
-        return DataLoader(
+        return build_dataloader(
             dataset,
             batch_size=batch_size,
             collate_fn=collate_fn,
             num_workers=num_workers,
+            pin_memory=self.cfg.pin_memory,
+            persistent_workers=self.cfg.persistent_workers,
+            prefetch_factor=self.cfg.prefetch_factor,
+            seed=self.cfg.seed,
         )
 
     def train_dataloader(self) -> DataLoader:
@@ -15,6 +15,7 @@ from torch.utils.data import DataLoader, Dataset
 from PIL import Image
 
 from ..utils.typing import *
+from .shards import ShardReader, gather_rows, shape_latent_key
 
 
 @dataclass
@@ -22,6 +23,10 @@ class BaseDataModuleConfig:
     root_dir: str = None
     batch_size: int = 4
     num_workers: int = 8
+    pin_memory: bool = True  # pinned batches are copied to the GPU asynchronously
+    persistent_workers: bool = True  # keep the workers alive across epochs
+    prefetch_factor: Optional[int] = None  # batches loaded ahead by each worker
+    seed: Optional[int] = None  # seed of the shuffling and the worker seeds
 
     ################################# General argumentation #################################
     random_flip: bool = (
@@ -30,6 +35,9 @@ class BaseDataModuleConfig:
 
     ################################# Geometry part #################################
     load_geometry: bool = True  # whether to load geometry data
+    surface_shard_dir: Optional[str] = (
+        None  # memory-mapped surface shards from data/shards.py, instead of surfaces/*.npz
+    )
     with_sharp_data: bool = False
     geo_data_type: str = "sdf"  # occupancy, sdf
     # for occupancy or sdf supervision
@@ -38,12 +46,21 @@ class BaseDataModuleConfig:
     sampling_strategy: Optional[str] = (
         "random"  # sampling strategy for input point cloud
     )
+    fps_index_dir: Optional[str] = (
+        None  # precomputed FPS index banks from data/fps_indices.py, for "fps" sampling
+    )
     scale: float = 1.0  # scale of the input point cloud and target supervision
     noise_sigma: float = 0.0  # noise level of the input point cloud
     rotate_points: bool = (
         False  # whether to rotate the input point cloud and the supervision, for VAE aug.
     )
     load_geometry_supervision: bool = False  # whether to load supervision
+    latent_shard_dir: Optional[str] = (
+        None  # precomputed shape latents from systems/latent_cache.py, replaces geometry
+    )
+    embedding_shard_dir: Optional[str] = (
+        None  # precomputed DINO/T5 embeddings from systems/embedding_cache.py
+    )
     supervision_type: str = "sdf"  # occupancy, sdf, tsdf, tsdf_w_surface
     n_supervision: int = 10000  # number of points in supervision
     tsdf_threshold: float = (
@@ -86,6 +103,29 @@ class BaseDataset(Dataset):
         self.uids = json.load(open(f"{cfg.root_dir}/{split}.json"))
         print(f"Loaded {len(self.uids)} {split} uids")
 
+        self.surface_shards = None
+        if self.cfg.surface_shard_dir is not None:
+            self.surface_shards = ShardReader(self.cfg.surface_shard_dir)
+        self.latent_shards = None
+        if self.cfg.latent_shard_dir is not None:
+            self.latent_shards = ShardReader(self.cfg.latent_shard_dir)
+        self.embedding_shards = None
+        if self.cfg.embedding_shard_dir is not None:
+            self.embedding_shards = ShardReader(self.cfg.embedding_shard_dir)
+            if self.cfg.random_flip and not self.embedding_shards.meta["with_flip"]:
+                raise ValueError(
+                    "random_flip needs embeddings precomputed with --with_flip"
+                )
+            if (
+                self.cfg.random_color_jitter
+                or self.cfg.random_rotate
+                or self.cfg.background_color is None
+            ):
+                raise ValueError(
+                    "Random color jitter, rotation and backgrounds are not supported "
+                    "with embedding_shard_dir"
+                )
+
         # add ColorJitter transforms for input images
         if self.cfg.random_color_jitter:
             self.color_jitter = transforms.ColorJitter(
@@ -101,9 +141,38 @@ class BaseDataset(Dataset):
     def __len__(self):
         return len(self.uids)
 
-    def _load_shape_from_occupancy_or_sdf(self, index: int) -> Dict[str, Any]:
+    def _load_surface_data(self, index: int) -> Dict[str, np.ndarray]:
+        # opened once per sample, and shared by shape and supervision loading
+        if self.surface_shards is not None:
+            return self.surface_shards.load(self.uids[index])
+        return np.load(f"{self.cfg.root_dir}/surfaces/{self.uids[index]}.npz")
+
+    def _get_fps_indices(
+        self, index: int, key: str, points: np.ndarray
+    ) -> np.ndarray:
+        # pick one of the precomputed index sets if available, fall back to
+        # running FPS on the full point cloud
+        if self.cfg.fps_index_dir is not None:
+            fps_path = f"{self.cfg.fps_index_dir}/{self.uids[index]}.npz"
+            if os.path.exists(fps_path):
+                banks = np.load(fps_path)
+                bank = banks[key] if key in banks.files else None
+                if bank is not None and bank.shape[1] >= self.cfg.n_samples:
+                    sel = np.random.default_rng().integers(bank.shape[0])
+                    return bank[sel, : self.cfg.n_samples].astype(np.int64)
+
+        import fpsample
+
+        return fpsample.bucket_fps_kdline_sampling(
+            points[:, :3], self.cfg.n_samples, h=5
+        )
+
+    def _load_shape_from_occupancy_or_sdf(
+        self, index: int, data: Optional[Dict[str, np.ndarray]] = None
+    ) -> Dict[str, Any]:
         if self.cfg.geo_data_type == "sdf":
-            data = np.load(f"{self.cfg.root_dir}/surfaces/{self.uids[index]}.npz")
+            if data is None:
+                data = self._load_surface_data(index)
             # for input point cloud
             surface = data["surface"]
             if self.cfg.with_sharp_data:
@@ -125,17 +194,11 @@ class BaseDataset(Dataset):
             if self.cfg.with_sharp_data:
                 sharp_surface = sharp_surface[ind]
         elif self.cfg.sampling_strategy == "fps":
-            import fpsample
-
-            kdline_fps_samples_idx = fpsample.bucket_fps_kdline_sampling(
-                surface[:, :3], self.cfg.n_samples, h=5
-            )
-            surface = surface[kdline_fps_samples_idx]
+            surface = surface[self._get_fps_indices(index, "surface", surface)]
             if self.cfg.with_sharp_data:
-                kdline_fps_samples_idx = fpsample.bucket_fps_kdline_sampling(
-                    sharp_surface[:, :3], self.cfg.n_samples, h=5
-                )
-                sharp_surface = sharp_surface[kdline_fps_samples_idx]
+                sharp_surface = sharp_surface[
+                    self._get_fps_indices(index, "sharp_surface", sharp_surface)
+                ]
         else:
             raise NotImplementedError(
                 f"sampling strategy {self.cfg.sampling_strategy} not implemented"
@@ -158,38 +221,39 @@ class BaseDataset(Dataset):
 
         return ret
 
-    def _load_shape_supervision_occupancy_or_sdf(self, index: int) -> Dict[str, Any]:
+    def _load_shape_supervision_occupancy_or_sdf(
+        self, index: int, data: Optional[Dict[str, np.ndarray]] = None
+    ) -> Dict[str, Any]:
         # for supervision
         ret = {}
         if self.cfg.geo_data_type == "sdf":
-            data = np.load(f"{self.cfg.root_dir}/surfaces/{self.uids[index]}.npz")
-            data = np.concatenate(
-                [data["volume_rand_points"], data["near_surface_points"]], axis=0
-            )
-            rand_points, sdfs = data[:, :3], data[:, 3:]
+            if data is None:
+                data = self._load_surface_data(index)
+            points = [data["volume_rand_points"], data["near_surface_points"]]
         else:
             raise NotImplementedError(
                 f"Data type {self.cfg.geo_data_type} not implemented"
             )
 
-        # random sampling
+        # random sampling, only the selected rows are read
         rng = np.random.default_rng()
-        ind = rng.choice(rand_points.shape[0], self.cfg.n_supervision, replace=False)
-        rand_points = rand_points[ind]
+        num_points = sum(p.shape[0] for p in points)
+        ind = rng.choice(num_points, self.cfg.n_supervision, replace=False)
+        data = gather_rows(points, ind)
+        rand_points, sdfs = data[:, :3], data[:, 3:]
         rand_points = rand_points * self.cfg.scale
         ret["rand_points"] = rand_points.astype(np.float32)
 
         if self.cfg.geo_data_type == "sdf":
             if self.cfg.supervision_type == "sdf":
-                ret["sdf"] = sdfs[ind].flatten().astype(np.float32)
+                ret["sdf"] = sdfs.flatten().astype(np.float32)
             elif self.cfg.supervision_type == "occupancy":
-                ret["occupancies"] = np.where(sdfs[ind].flatten() < 1e-3, 0, 1).astype(
+                ret["occupancies"] = np.where(sdfs.flatten() < 1e-3, 0, 1).astype(
                     np.float32
                 )
             elif self.cfg.supervision_type == "tsdf":
                 ret["sdf"] = (
-                    sdfs[ind]
-                    .flatten()
+                    sdfs.flatten()
                     .astype(np.float32)
                     .clip(-self.cfg.tsdf_threshold, self.cfg.tsdf_threshold)
                     / self.cfg.tsdf_threshold
@@ -201,7 +265,31 @@ class BaseDataset(Dataset):
 
         return ret
 
-    def _load_image(self, index: int) -> Dict[str, Any]:
+    def _load_shape_latents(self, index: int, variant: int) -> Dict[str, Any]:
+        latents = self.latent_shards.load(shape_latent_key(self.uids[index], variant))
+        return {
+            "uid": self.uids[index].split("/")[-1],
+            "latent_mean": np.array(latents["mean"], dtype=np.float32),
+            "latent_logvar": np.array(latents["logvar"], dtype=np.float32),
+        }
+
+    def _load_image_embeds(self, index: int, flip: bool = False) -> Dict[str, Any]:
+        embeds = self.embedding_shards.load(self.uids[index])
+        sel_idx = random.choice(self.cfg.idx)
+        view = int(np.nonzero(embeds["view_idx"] == sel_idx)[0][0])
+        image_embeds = embeds["dino_flip" if flip else "dino"][view]
+        return {
+            "sel_image_idx": sel_idx,
+            "image_embeds": torch.from_numpy(np.array(image_embeds, dtype=np.float32)),
+        }
+
+    def _load_caption_embeds(self, index: int) -> Dict[str, Any]:
+        embeds = self.embedding_shards.load(self.uids[index])
+        return {
+            "caption_embeds": torch.from_numpy(np.array(embeds["t5"], dtype=np.float32))
+        }
+
+    def _load_image(self, index: int, sel_idx: Optional[int] = None) -> Dict[str, Any]:
         def _process_img(image, background_color=(255, 255, 255), foreground_ratio=0.9):
             alpha = image.getchannel("A")
             background = Image.new("RGBA", image.size, (*background_color, 255))
@@ -233,7 +321,8 @@ class BaseDataset(Dataset):
             assert (
                 self.cfg.n_views == 1
             ), "Only single view is supported for single image"
-            sel_idx = random.choice(self.cfg.idx)
+            if sel_idx is None:
+                sel_idx = random.choice(self.cfg.idx)
             ret["sel_image_idx"] = sel_idx
             if self.cfg.image_type == "rgb":
                 img_path = (
@@ -288,14 +377,29 @@ class BaseDataset(Dataset):
         # random flip
         flip = np.random.rand() < 0.5 if self.cfg.random_flip else False
 
+        # load cached shape latents, the variant decides the flip
+        if self.latent_shards is not None:
+            num_variants = self.latent_shards.meta["num_variants"]
+            flips = self.latent_shards.meta["flips"]
+            if self.cfg.random_flip:
+                variant = np.random.randint(num_variants)
+            else:
+                unflipped = [k for k in range(num_variants) if not flips[k]]
+                variant = np.random.choice(unflipped)
+            flip = flips[variant]
+            ret = self._load_shape_latents(index, variant)
+
         # load geometry
-        if self.cfg.load_geometry:
+        elif self.cfg.load_geometry:
             if self.cfg.geo_data_type == "occupancy" or self.cfg.geo_data_type == "sdf":
+                data = self._load_surface_data(index)
                 # load shape
-                ret = self._load_shape_from_occupancy_or_sdf(index)
+                ret = self._load_shape_from_occupancy_or_sdf(index, data)
                 # load supervision for shape
                 if self.cfg.load_geometry_supervision:
-                    ret.update(self._load_shape_supervision_occupancy_or_sdf(index))
+                    ret.update(
+                        self._load_shape_supervision_occupancy_or_sdf(index, data)
+                    )
             else:
                 raise NotImplementedError(
                     f"Geo data type {self.cfg.geo_data_type} not implemented"
@@ -310,7 +414,9 @@ class BaseDataset(Dataset):
                         ret[key][:, 0] = -ret[key][:, 0]
 
         # load image
-        if self.cfg.load_image:
+        if self.cfg.load_image and self.embedding_shards is not None:
+            ret.update(self._load_image_embeds(index, flip))
+        elif self.cfg.load_image:
             ret.update(self._load_image(index))
             if flip:  # random flip the input image
                 for key in ret.keys():
@@ -325,6 +431,8 @@ class BaseDataset(Dataset):
             with open(f"{self.cfg.root_dir}/metas/{self.uids[index]}.json", "r") as f:
                 meta = json.load(f)
             ret.update({"caption": meta["caption"]})
+            if self.embedding_shards is not None:
+                ret.update(self._load_caption_embeds(index))
 
         # load label
         if self.cfg.load_label:
@@ -0,0 +1,218 @@
+import argparse
+import random
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, RandomSampler
+
+from .. import find
+from ..utils.config import load_config
+from ..utils.misc import get_rank
+from ..utils.typing import *
+
+
+def seed_worker(worker_id: int) -> None:
+    # torch seeds every worker differently, numpy and random are forked as is
+    seed = torch.initial_seed() % 2**32
+    np.random.seed(seed)
+    random.seed(seed)
+
+
+def build_dataloader(
+    dataset,
+    batch_size: int,
+    num_workers: int = 0,
+    shuffle: bool = False,
+    collate_fn: Optional[Callable] = None,
+    pin_memory: bool = True,
+    persistent_workers: bool = True,
+    prefetch_factor: Optional[int] = None,
+    seed: Optional[int] = None,
+    drop_last: bool = False,
+) -> DataLoader:
+    """
+    DataLoader shared by the geometry and texture datamodules. Batches are
+    pinned so that the copies to the GPU are asynchronous, workers are kept
+    alive across epochs, and every worker seeds numpy and random from its own
+    torch seed. With a seed, the shuffling and the worker seeds are
+    reproducible, and differ per rank.
+    """
+    kwargs = {}
+    if num_workers > 0:
+        kwargs["persistent_workers"] = persistent_workers
+        if prefetch_factor is not None:
+            kwargs["prefetch_factor"] = prefetch_factor
+    generator = None
+    if seed is not None:
+        generator = torch.Generator()
+        generator.manual_seed(seed + get_rank())
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=shuffle,
+        num_workers=num_workers,
+        collate_fn=collate_fn,
+        pin_memory=pin_memory and torch.cuda.is_available(),
+        drop_last=drop_last,
+        worker_init_fn=seed_worker,
+        generator=generator,
+        **kwargs,
+    )
+
+
+def move_to_device(data, device, non_blocking: bool = True):
+    if isinstance(data, torch.Tensor):
+        return data.to(device, non_blocking=non_blocking)
+    elif isinstance(data, (list, tuple)):
+        return type(data)(move_to_device(d, device, non_blocking) for d in data)
+    elif isinstance(data, dict):
+        return {k: move_to_device(v, device, non_blocking) for k, v in data.items()}
+    return data
+
+
+class DevicePrefetcher:
+    """
+    Iterates over a loader and copies the next batch to the device on a side
+    CUDA stream while the current batch is in use. Batches should be pinned,
+    see build_dataloader, for the copies to overlap with compute. Lightning
+    already moves pinned batches with non_blocking copies, this is meant for
+    the loops that iterate over a loader themselves.
+    """
+
+    def __init__(self, loader: Iterable, device: Union[str, torch.device]) -> None:
+        self.loader = loader
+        self.device = torch.device(device)
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        if self.device.type != "cuda":
+            for batch in self.loader:
+                yield move_to_device(batch, self.device)
+            return
+
+        stream = torch.cuda.Stream(self.device)
+        iterator = iter(self.loader)
+
+        def preload():
+            batch = next(iterator, None)
+            if batch is not None:
+                with torch.cuda.stream(stream):
+                    batch = move_to_device(batch, self.device)
+            return batch
+
+        next_batch = preload()
+        while next_batch is not None:
+            torch.cuda.current_stream(self.device).wait_stream(stream)
+            batch = next_batch
+            # the memory of the batch now belongs to the compute stream
+            for tensor in _iter_tensors(batch):
+                tensor.record_stream(torch.cuda.current_stream(self.device))
+            next_batch = preload()
+            yield batch
+
+
+def _iter_tensors(data):
+    if isinstance(data, torch.Tensor):
+        yield data
+    elif isinstance(data, (list, tuple)):
+        for d in data:
+            yield from _iter_tensors(d)
+    elif isinstance(data, dict):
+        for d in data.values():
+            yield from _iter_tensors(d)
+
+
+def benchmark_dataloader(
+    loader: Iterable,
+    num_batches: int = 100,
+    num_warmup: int = 10,
+    device: Optional[str] = None,
+) -> Dict[str, float]:
+    """
+    Samples per second of a loader, with the batches moved to the device but no
+    model in the loop, i.e. an upper bound of the training throughput, and the
+    time to the first batch, which includes spawning the workers.
+    """
+    sync = device is not None and torch.device(device).type == "cuda"
+    if device is not None:
+        loader = DevicePrefetcher(loader, device)
+    num_samples, start = 0, None
+    first_batch_start = time.perf_counter()
+    for i, batch in enumerate(loader):
+        if i == 0:
+            first_batch_seconds = time.perf_counter() - first_batch_start
+        if i == num_warmup:
+            if sync:
+                torch.cuda.synchronize(device)
+            num_samples, start = 0, time.perf_counter()
+        if i >= num_warmup + num_batches:
+            break
+        num_samples += _batch_size(batch)
+    if start is None:
+        raise ValueError(f"Loader has less than {num_warmup + 1} batches")
+    if sync:
+        torch.cuda.synchronize(device)
+    return {
+        "samples_per_second": num_samples / (time.perf_counter() - start),
+        "first_batch_seconds": first_batch_seconds,
+    }
+
+
+def _batch_size(batch) -> int:
+    for tensor in _iter_tensors(batch):
+        return tensor.shape[0]
+    return 1
+
+
+if __name__ == "__main__":
+    # python -m <package>.step1x3d_geometry.data.dataloader --config <config>.yaml
+    # python -m <package>.step1x3d_geometry.data.dataloader --texture \
+    #     --config <ig2mv config>.yaml
+    # compares the configured loader with the plain one it replaces
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, required=True)
+    parser.add_argument("--texture", action="store_true")
+    parser.add_argument("--num_batches", type=int, default=100)
+    parser.add_argument("--epochs", type=int, default=2)
+    parser.add_argument("--device", type=str, default="cuda")
+    args, extras = parser.parse_known_args()
+
+    if args.texture:
+        from ...step1x3d_texture.data.multiview import MultiviewDataModule
+        from ...step1x3d_texture.utils.config import (
+            load_config as load_texture_config,
+        )
+
+        cfg = load_texture_config(args.config, cli_args=extras, makedirs=False)
+        datamodule = MultiviewDataModule(cfg.data)
+    else:
+        cfg = load_config(args.config, cli_args=extras)
+        datamodule = find(cfg.data_type)(cfg.data)
+    datamodule.setup("fit")
+    dataset = datamodule.train_dataset
+    data_cfg = datamodule.cfg
+
+    configured = datamodule.train_dataloader()
+    loaders = {
+        "plain": DataLoader(
+            dataset,
+            batch_size=data_cfg.batch_size,
+            num_workers=data_cfg.num_workers,
+            shuffle=isinstance(configured.sampler, RandomSampler),
+            collate_fn=dataset.collate,
+        ),
+        "configured": configured,
+    }
+    for name, loader in loaders.items():
+        # later epochs show the cost of respawning the workers
+        for epoch in range(args.epochs):
+            stats = benchmark_dataloader(
+                loader, num_batches=args.num_batches, device=args.device
+            )
+            print(
+                f"{name} epoch {epoch}: {stats['samples_per_second']:.1f} samples/s, "
+                f"first batch after {stats['first_batch_seconds']:.2f}s"
+            )
@@ -0,0 +1,106 @@
+import argparse
+import json
+import os
+from functools import partial
+from multiprocessing import Pool
+
+import numpy as np
+
+from ..utils.typing import *
+
+
+def compute_fps_indices(
+    points: np.ndarray, n_samples: int, num_sets: int, h: int = 5, seed: int = 0
+) -> np.ndarray:
+    """
+    num_sets farthest point samplings of points, each from a random start point.
+    Returns a [num_sets, n_samples] index bank.
+    """
+    import fpsample
+
+    rng = np.random.default_rng(seed)
+    start_indices = rng.choice(points.shape[0], num_sets, replace=False)
+    return np.stack(
+        [
+            fpsample.bucket_fps_kdline_sampling(
+                points[:, :3], n_samples, h=h, start_idx=int(start_idx)
+            )
+            for start_idx in start_indices
+        ],
+        axis=0,
+    ).astype(np.uint32)
+
+
+def _precompute_uid(uid, root_dir, out_dir, n_samples, num_sets, h):
+    out_path = f"{out_dir}/{uid}.npz"
+    if os.path.exists(out_path):
+        return
+    try:
+        data = np.load(f"{root_dir}/surfaces/{uid}.npz")
+        seed = int.from_bytes(uid.encode("utf-8")[-8:], "little")
+        banks = {
+            key: compute_fps_indices(data[key], n_samples, num_sets, h, seed)
+            for key in ["surface", "sharp_surface"]
+            if key in data.files
+        }
+    except Exception as e:
+        print(f"Error in {uid}: {e}")
+        return
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    np.savez(out_path, **banks)
+
+
+def precompute_fps_indices(
+    root_dir: str,
+    uids: List[str],
+    out_dir: str,
+    n_samples: int,
+    num_sets: int = 8,
+    h: int = 5,
+    num_workers: int = 8,
+) -> None:
+    """
+    Write {out_dir}/{uid}.npz with banks of FPS indices for the surface and the
+    sharp surface of every uid. Since FPS is greedy, the first n indices of a
+    set are a valid FPS of n points, so one bank serves any n <= n_samples.
+    """
+    job = partial(
+        _precompute_uid,
+        root_dir=root_dir,
+        out_dir=out_dir,
+        n_samples=n_samples,
+        num_sets=num_sets,
+        h=h,
+    )
+    with Pool(num_workers) as pool:
+        for i, _ in enumerate(pool.imap_unordered(job, uids, chunksize=16)):
+            if (i + 1) % 1000 == 0:
+                print(f"Processed {i + 1}/{len(uids)} uids")
+
+
+if __name__ == "__main__":
+    # python -m <package>.step1x3d_geometry.data.fps_indices \
+    #     --root_dir <data> --n_samples 32768
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root_dir", type=str, required=True)
+    parser.add_argument("--out_dir", type=str, default=None)
+    parser.add_argument("--splits", type=str, nargs="+", default=["train", "val"])
+    parser.add_argument("--n_samples", type=int, required=True)
+    parser.add_argument("--num_sets", type=int, default=8)
+    parser.add_argument("--h", type=int, default=5)
+    parser.add_argument("--num_workers", type=int, default=8)
+    args = parser.parse_args()
+
+    out_dir = args.out_dir or f"{args.root_dir}/fps_indices"
+    for split in args.splits:
+        uids = json.load(open(f"{args.root_dir}/{split}.json"))
+        print(f"Computing FPS indices of {len(uids)} {split} uids into {out_dir}")
+        precompute_fps_indices(
+            args.root_dir,
+            uids,
+            out_dir,
+            args.n_samples,
+            num_sets=args.num_sets,
+            h=args.h,
+            num_workers=args.num_workers,
+        )
@@ -0,0 +1,181 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+from ..utils.typing import *
+
+SURFACE_KEYS = ["surface", "sharp_surface", "volume_rand_points", "near_surface_points"]
+SHARD_ALIGNMENT = 64
+
+
+class ShardWriter:
+    """
+    Appends named arrays per key into large uncompressed shard files, with an
+    index.json holding the offset, shape and dtype of every array. An existing
+    index is extended, so a store can be filled in several runs.
+    """
+
+    def __init__(self, shard_dir: str, max_shard_bytes: int = 4 << 30) -> None:
+        self.shard_dir = shard_dir
+        self.max_shard_bytes = max_shard_bytes
+        os.makedirs(shard_dir, exist_ok=True)
+        self.index_path = os.path.join(shard_dir, "index.json")
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                self.index = json.load(f)
+        else:
+            self.index = {"shards": [], "items": {}, "meta": {}}
+        self.shard_file, self.shard_bytes = None, max_shard_bytes
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index["items"]
+
+    @property
+    def meta(self) -> Dict[str, Any]:
+        return self.index.setdefault("meta", {})
+
+    def add(self, key: str, arrays: Dict[str, np.ndarray]) -> None:
+        # start a new shard instead of splitting an item across two
+        item_bytes = sum(a.nbytes + SHARD_ALIGNMENT for a in arrays.values())
+        shard_full = self.shard_bytes + item_bytes > self.max_shard_bytes
+        if shard_full and self.shard_bytes > 0:
+            if self.shard_file is not None:
+                self.shard_file.close()
+            shard_name = f"shard_{len(self.index['shards']):05d}.bin"
+            self.index["shards"].append(shard_name)
+            self.shard_file = open(os.path.join(self.shard_dir, shard_name), "wb")
+            self.shard_bytes = 0
+
+        item = {"shard": len(self.index["shards"]) - 1, "arrays": {}}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            padding = -self.shard_bytes % SHARD_ALIGNMENT
+            self.shard_file.write(bytes(padding))
+            self.shard_bytes += padding
+            item["arrays"][name] = [
+                self.shard_bytes,
+                list(array.shape),
+                array.dtype.str,
+            ]
+            self.shard_file.write(array.tobytes())
+            self.shard_bytes += array.nbytes
+        self.index["items"][key] = item
+
+    def close(self) -> None:
+        if self.shard_file is not None:
+            self.shard_file.close()
+            self.shard_file = None
+        with open(self.index_path, "w") as f:
+            json.dump(self.index, f)
+
+
+def pack_surface_shards(
+    root_dir: str,
+    uids: List[str],
+    shard_dir: str,
+    keys: List[str] = SURFACE_KEYS,
+    max_shard_bytes: int = 4 << 30,
+) -> None:
+    """
+    Pack {root_dir}/surfaces/{uid}.npz into memory-mappable shards.
+    """
+    writer = ShardWriter(shard_dir, max_shard_bytes)
+    for i, uid in enumerate(uids):
+        if uid in writer:
+            continue
+        try:
+            data = np.load(f"{root_dir}/surfaces/{uid}.npz")
+            arrays = {key: data[key] for key in keys if key in data.files}
+        except Exception as e:
+            print(f"Error in {uid}: {e}")
+            continue
+        writer.add(uid, arrays)
+
+        if (i + 1) % 1000 == 0:
+            print(f"Packed {i + 1}/{len(uids)} uids")
+    writer.close()
+
+
+class ShardReader:
+    """
+    Read-only view of the shards written by ShardWriter. Arrays are returned as
+    np.memmap views, so indexing them only reads the selected rows.
+    """
+
+    def __init__(self, shard_dir: str) -> None:
+        self.shard_dir = shard_dir
+        with open(os.path.join(shard_dir, "index.json"), "r") as f:
+            index = json.load(f)
+        self.shards = index["shards"]
+        self.items = index["items"]
+        self.meta = index.get("meta", {})
+        self._maps = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.items
+
+    def _get_map(self, shard: int) -> np.memmap:
+        # opened lazily, so every dataloader worker maps the files itself
+        if shard not in self._maps:
+            self._maps[shard] = np.memmap(
+                os.path.join(self.shard_dir, self.shards[shard]),
+                dtype=np.uint8,
+                mode="r",
+            )
+        return self._maps[shard]
+
+    def load(self, key: str) -> Dict[str, np.ndarray]:
+        item = self.items[key]
+        shard_map = self._get_map(item["shard"])
+        arrays = {}
+        for name, (offset, shape, dtype) in item["arrays"].items():
+            dtype = np.dtype(dtype)
+            count = int(np.prod(shape))
+            arrays[name] = np.frombuffer(
+                shard_map, dtype=dtype, count=count, offset=offset
+            ).reshape(shape)
+        return arrays
+
+
+def shape_latent_key(uid: str, variant: int) -> str:
+    return f"{uid}#{variant}"
+
+
+def gather_rows(arrays: List[np.ndarray], ind: np.ndarray) -> np.ndarray:
+    """
+    Equivalent of np.concatenate(arrays)[ind] that only reads the selected rows,
+    in file order.
+    """
+    order = np.argsort(ind, kind="stable")
+    sorted_ind = ind[order]
+    ret = np.empty((len(ind),) + arrays[0].shape[1:], dtype=arrays[0].dtype)
+    start = 0
+    for array in arrays:
+        end = start + array.shape[0]
+        lo, hi = np.searchsorted(sorted_ind, [start, end])
+        ret[order[lo:hi]] = array[sorted_ind[lo:hi] - start]
+        start = end
+    return ret
+
+
+if __name__ == "__main__":
+    # python -m <package>.step1x3d_geometry.data.shards --root_dir <data>
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root_dir", type=str, required=True)
+    parser.add_argument("--shard_dir", type=str, default=None)
+    parser.add_argument("--splits", type=str, nargs="+", default=["train", "val"])
+    parser.add_argument("--max_shard_gb", type=float, default=4.0)
+    args = parser.parse_args()
+
+    shard_dir = args.shard_dir or f"{args.root_dir}/surface_shards"
+    for split in args.splits:
+        uids = json.load(open(f"{args.root_dir}/{split}.json"))
+        print(f"Packing {len(uids)} {split} uids into {shard_dir}")
+        pack_surface_shards(
+            args.root_dir,
+            uids,
+            shard_dir,
+            max_shard_bytes=int(args.max_shard_gb * (1 << 30)),
+        )
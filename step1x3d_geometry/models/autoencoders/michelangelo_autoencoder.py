@@ -736,15 +736,19 @@ class MichelangeloAutoencoder(BaseModule):
         return shape_latents, latents, posterior, meshes
 
     def extract_geometry(self, latents: torch.FloatTensor, **kwargs):
+        grid_logits = self.decode_grid_logits(latents, **kwargs)
+        return self.extract_surfaces(grid_logits, **kwargs)
 
+    def decode_grid_logits(self, latents: torch.FloatTensor, **kwargs):
         grid_logits_list = []
         for i in range(latents.shape[0]):
             grid_logits = self.volume_decoder(
                 latents[i].unsqueeze(0), self.query, **kwargs
             )
             grid_logits_list.append(grid_logits)
-        grid_logits = torch.cat(grid_logits_list, dim=0)
+        return torch.cat(grid_logits_list, dim=0)
 
+    def extract_surfaces(self, grid_logits: torch.FloatTensor, **kwargs):
         # extract mesh
         surface_extractor_type = (
             kwargs["surface_extractor_type"]
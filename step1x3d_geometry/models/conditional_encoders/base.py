@@ -97,9 +97,11 @@ class BaseVisualEncoder(BaseModule):
 
     def forward(self, batch):
         assert (
-            "image" in batch or "mvimages" in batch
-        ), "image or mvimages is required for visual embeds"
-        if batch["image"].dim() == 5:
+            "image" in batch or "mvimages" in batch or "image_embeds" in batch
+        ), "image, mvimages or image_embeds is required for visual embeds"
+        if "image_embeds" in batch:  # precomputed, see systems/embedding_cache.py
+            bs = batch["image_embeds"].shape[0]
+        elif batch["image"].dim() == 5:
             bs = batch["image"].shape[0] * batch["image"].shape[1]
         else:
             bs = batch["image"].shape[0]
@@ -111,7 +113,9 @@ class BaseVisualEncoder(BaseModule):
                 visual_embeds = self.empty_image_embeds.unsqueeze(1).repeat(bs, 1, 1, 1)
         else:
             # for visual inputs
-            if "image" in batch:
+            if "image_embeds" in batch:
+                visual_embeds = batch["image_embeds"]
+            elif "image" in batch:
                 if self.cfg.encode_camera:
                     visual_embeds = self.encode_image(
                         batch["image"], cameras=batch["c2w"]
@@ -160,6 +164,8 @@ class BaseCaptionEncoder(BaseModule):
         bs = len(batch["label"])
         if random.random() < self.cfg.empty_embeds_ratio:
             caption_embeds = self.empty_text_embeds.repeat(bs, 1, 1)
+        elif "caption_embeds" in batch:  # precomputed, see systems/embedding_cache.py
+            caption_embeds = batch["caption_embeds"]
         else:
             caption_embeds = self.encode_text(batch["caption"])
 
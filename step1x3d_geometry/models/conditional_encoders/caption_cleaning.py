@@ -0,0 +1,175 @@
+import argparse
+import html
+import re
+import time
+import urllib.parse as ul
+from functools import lru_cache
+
+from bs4 import BeautifulSoup
+
+try:
+    import ftfy
+except ImportError:
+    ftfy = None
+
+# Caption cleaning of the T5 training stage, as in diffusers' DeepFloyd IF and
+# PixArt pipelines, with every pattern compiled once at import.
+
+bad_punct_regex = re.compile(
+    r"["
+    + "#®•©™&@·º½¾¿¡§~"
+    + "\)"
+    + "\("
+    + "\]"
+    + "\["
+    + "\}"
+    + "\{"
+    + "\|"
+    + "\\"
+    + "\/"
+    + "\*"
+    + r"]{1,}"
+)  # noqa
+
+PERSON_REGEX = re.compile(r"<person>")
+URL_REGEXES = [
+    re.compile(
+        r"\b((?:https?:(?:\/{1,3}|[a-zA-Z0-9%])|[a-zA-Z0-9.\-]+[.](?:com|co|ru|net|org|edu|gov|it)[\w/-]*\b\/?(?!@)))"  # noqa
+    ),
+    re.compile(
+        r"\b((?:www:(?:\/{1,3}|[a-zA-Z0-9%])|[a-zA-Z0-9.\-]+[.](?:com|co|ru|net|org|edu|gov|it)[\w/-]*\b\/?(?!@)))"  # noqa
+    ),
+]
+NICKNAME_REGEX = re.compile(r"@[\w\d]+\b")
+# 31C0—31EF CJK Strokes
+# 31F0—31FF Katakana Phonetic Extensions
+# 3200—32FF Enclosed CJK Letters and Months
+# 3300—33FF CJK Compatibility
+# 3400—4DBF CJK Unified Ideographs Extension A
+# 4DC0—4DFF Yijing Hexagram Symbols
+# 4E00—9FFF CJK Unified Ideographs
+CJK_REGEXES = [
+    re.compile(r"[\u31c0-\u31ef]+"),
+    re.compile(r"[\u31f0-\u31ff]+"),
+    re.compile(r"[\u3200-\u32ff]+"),
+    re.compile(r"[\u3300-\u33ff]+"),
+    re.compile(r"[\u3400-\u4dbf]+"),
+    re.compile(r"[\u4dc0-\u4dff]+"),
+    re.compile(r"[\u4e00-\u9fff]+"),
+]
+# все виды тире / all types of dash --> "-"
+DASH_REGEX = re.compile(
+    r"[\u002D\u058A\u05BE\u1400\u1806\u2010-\u2015\u2E17\u2E1A\u2E3A\u2E3B\u2E40\u301C\u3030\u30A0\uFE31\uFE32\uFE58\uFE63\uFF0D]+"  # noqa
+)
+# кавычки к одному стандарту
+DOUBLE_QUOTE_REGEX = re.compile(r"[`´«»“”¨]")
+SINGLE_QUOTE_REGEX = re.compile(r"[‘’]")
+
+# (pattern, replacement) applied in order after the html parsing
+PRE_BASIC_CLEAN_SUBS = [
+    (re.compile(r"&quot;?"), ""),  # &quot;
+    (re.compile(r"&amp"), ""),  # &amp
+    (re.compile(r"\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}"), " "),  # ip adresses
+    (re.compile(r"\d:\d\d\s+$"), ""),  # article ids
+    (re.compile(r"\\n"), " "),  # \n
+    (re.compile(r"#\d{1,3}\b"), ""),  # "#123"
+    (re.compile(r"#\d{5,}\b"), ""),  # "#12345.."
+    (re.compile(r"\b\d{6,}\b"), ""),  # "123456.."
+    (re.compile(r"[\S]+\.(?:png|jpg|jpeg|bmp|webp|eps|pdf|apk|mp4)"), ""),  # files
+    (re.compile(r"[\"\']{2,}"), r'"'),  # """AUSVERKAUFT"""
+    (re.compile(r"[\.]{2,}"), r" "),  # """AUSVERKAUFT"""
+    (bad_punct_regex, r" "),  # ***AUSVERKAUFT***, #AUSVERKAUFT
+    (re.compile(r"\s+\.\s+"), r" "),  # " . "
+]
+# this-is-my-cute-cat / this_is_my_cute_cat
+DASH_OR_UNDERSCORE_REGEX = re.compile(r"(?:\-|\_)")
+POST_BASIC_CLEAN_SUBS = [
+    (re.compile(r"\b[a-zA-Z]{1,3}\d{3,15}\b"), ""),  # jc6640
+    (re.compile(r"\b[a-zA-Z]+\d+[a-zA-Z]+\b"), ""),  # jc6640vc
+    (re.compile(r"\b\d+[a-zA-Z]+\d+\b"), ""),  # 6640vc231
+    (re.compile(r"(worldwide\s+)?(free\s+)?shipping"), ""),
+    (re.compile(r"(free\s)?download(\sfree)?"), ""),
+    (re.compile(r"\bclick\b\s(?:for|on)\s\w+"), ""),
+    (re.compile(r"\b(?:png|jpg|jpeg|bmp|webp|eps|pdf|apk|mp4)(\simage[s]?)?"), ""),
+    (re.compile(r"\bpage\s+\d+\b"), ""),
+    (re.compile(r"\b\d*[a-zA-Z]+\d+[a-zA-Z]+\d+[a-zA-Z\d]*\b"), r" "),  # j2d1a2a...
+    (re.compile(r"\b\d+\.?\d*[xх×]\d+\.?\d*\b"), ""),
+    (re.compile(r"\b\s+\:\s+"), r": "),
+    (re.compile(r"(\D[,\./])\b"), r"\1 "),
+    (re.compile(r"\s+"), " "),
+    (re.compile(r"^[\"\']([\w\W]+)[\"\']$"), r"\1"),
+    (re.compile(r"^[\'\_,\-\:;]"), r""),
+    (re.compile(r"[\'\_,\-\:\-\+]$"), r""),
+    (re.compile(r"^\.\S+$"), ""),
+]
+
+
+def basic_clean(text: str) -> str:
+    if ftfy is not None:
+        text = ftfy.fix_text(text)
+    text = html.unescape(html.unescape(text))
+    return text.strip()
+
+
+def clean_caption(caption) -> str:
+    caption = str(caption)
+    caption = ul.unquote_plus(caption)
+    caption = caption.strip().lower()
+    caption = PERSON_REGEX.sub("person", caption)
+    # urls:
+    for regex in URL_REGEXES:
+        caption = regex.sub("", caption)
+    # html:
+    caption = BeautifulSoup(caption, features="html.parser").text
+
+    # @<nickname>
+    caption = NICKNAME_REGEX.sub("", caption)
+    for regex in CJK_REGEXES:
+        caption = regex.sub("", caption)
+    caption = DASH_REGEX.sub("-", caption)
+    caption = DOUBLE_QUOTE_REGEX.sub('"', caption)
+    caption = SINGLE_QUOTE_REGEX.sub("'", caption)
+
+    for regex, replacement in PRE_BASIC_CLEAN_SUBS:
+        caption = regex.sub(replacement, caption)
+    if len(DASH_OR_UNDERSCORE_REGEX.findall(caption)) > 3:
+        caption = DASH_OR_UNDERSCORE_REGEX.sub(" ", caption)
+
+    caption = basic_clean(caption)
+
+    for regex, replacement in POST_BASIC_CLEAN_SUBS:
+        caption = regex.sub(replacement, caption)
+    return caption.strip()
+
+
+@lru_cache(maxsize=65536)
+def clean_caption_cached(caption: str) -> str:
+    """
+    clean_caption of the captions seen before is a dictionary lookup, captions
+    repeat across epochs.
+    """
+    return clean_caption(caption)
+
+
+if __name__ == "__main__":
+    # python -m <package>.step1x3d_geometry.models.conditional_encoders.caption_cleaning
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_captions", type=int, default=2000)
+    parser.add_argument("--epochs", type=int, default=3)
+    args = parser.parse_args()
+
+    captions = [
+        f"A 3D model of a low-poly_red_wooden_chair #{i} with &quot;curved&quot; "
+        f"legs, see https://example.com/model{i}.png — free download"
+        for i in range(args.num_captions)
+    ]
+    for name, fn in [
+        ("clean_caption", clean_caption),
+        ("cached", clean_caption_cached),
+    ]:
+        for epoch in range(args.epochs):
+            start = time.perf_counter()
+            for caption in captions:
+                fn(caption)
+            captions_per_second = len(captions) / (time.perf_counter() - start)
+            print(f"{name} epoch {epoch}: {captions_per_second:.0f} captions/s")
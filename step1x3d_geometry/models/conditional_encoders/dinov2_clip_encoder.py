@@ -19,6 +19,7 @@ from ...utils.typing import *
 from .clip.modeling_clip import CLIPModel
 from .clip.modeling_conditional_clip import ConditionalCLIPModel
 from .base import BaseVisualEncoder, ImageType
+from .image_processing import preprocess_images
 from .dinov2.modeling_dinov2 import Dinov2Model
 from .dinov2.modeling_conditional_dinov2 import ConditionalDinov2Model
 from .dinov2_with_registers.modeling_dinov2_with_registers import (
@@ -337,14 +338,14 @@ class Dinov2CLIPEncoder(BaseVisualEncoder, ModelMixin):
                         .to(self.clip_model.device)
                     )
                 camera_embeds = self.encode_camera(cameras)
-            pixel_values = self.image_preprocess_clip.preprocess(
+            pixel_values = preprocess_images(
                 images,
-                return_tensors="pt",
-                do_rescale=True,
-                do_resize=True,
-                size=CLIP_IMAGE_SIZE,
-                crop_size=CLIP_IMAGE_SIZE,
-            ).pixel_values
+                CLIP_IMAGE_SIZE,
+                CLIP_IMAGE_SIZE,
+                self.image_preprocess_clip.image_mean,
+                self.image_preprocess_clip.image_std,
+                device=self.clip_model.device,
+            )
 
         if force_none_camera_embeds:
             camera_embeds = None
@@ -412,14 +413,14 @@ class Dinov2CLIPEncoder(BaseVisualEncoder, ModelMixin):
                         .to(self.dino_model.device)
                     )
                 camera_embeds = self.encode_camera(cameras)
-            pixel_values = self.image_preprocess_dino.preprocess(
+            pixel_values = preprocess_images(
                 images,
-                return_tensors="pt",
-                do_rescale=True,
-                do_resize=True,
-                size=self.cfg.image_size,
-                crop_size=self.cfg.image_size,
-            ).pixel_values
+                self.cfg.image_size,
+                self.cfg.image_size,
+                self.image_preprocess_dino.image_mean,
+                self.image_preprocess_dino.image_std,
+                device=self.dino_model.device,
+            )
 
         if force_none_camera_embeds:
             camera_embeds = None
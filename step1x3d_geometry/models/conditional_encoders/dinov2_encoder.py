@@ -15,6 +15,7 @@ from typing import Iterable, Optional, Union, List
 from .... import step1x3d_geometry
 from ...utils.typing import *
 from .base import BaseVisualEncoder, ImageType
+from .image_processing import preprocess_images
 from .dinov2.modeling_dinov2 import Dinov2Model
 from .dinov2.modeling_conditional_dinov2 import ConditionalDinov2Model
 from .dinov2_with_registers.modeling_dinov2_with_registers import (
@@ -233,14 +234,14 @@ class Dinov2Encoder(BaseVisualEncoder, ModelMixin):
                         .to(self.dino_model.device)
                     )
                 camera_embeds = self.encode_camera(cameras)
-            pixel_values = self.image_preprocess_dino.preprocess(
+            pixel_values = preprocess_images(
                 images,
-                return_tensors="pt",
-                do_rescale=True,
-                do_resize=True,
-                size=self.cfg.image_size,
-                crop_size=self.cfg.image_size,
-            ).pixel_values
+                self.cfg.image_size,
+                self.cfg.image_size,
+                self.image_preprocess_dino.image_mean,
+                self.image_preprocess_dino.image_std,
+                device=self.dino_model.device,
+            )
 
         if force_none_camera_embeds:
             camera_embeds = None
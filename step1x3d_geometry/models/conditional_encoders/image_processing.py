@@ -0,0 +1,171 @@
+import argparse
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+from ...utils.typing import *
+
+# Tensor version of the resize, center crop, rescale and normalize of the
+# HuggingFace BitImageProcessor / CLIPImageProcessor, batched on the device of
+# the encoder instead of per image with PIL on the CPU.
+
+
+def images_to_tensor(
+    images: Union[Image.Image, np.ndarray, torch.Tensor, List],
+    device: Optional[Union[str, torch.device]] = None,
+) -> List[Tuple[List[int], Float[Tensor, "B 3 H W"]]]:
+    """
+    uint8 images (PIL, or arrays/tensors [H, W, C] or [B, H, W, C]) as float
+    tensors in [0, 255] on device, one batch per image resolution, with the
+    indices of its images in the input.
+    """
+    if isinstance(images, (Image.Image, np.ndarray, torch.Tensor)):
+        images = [images]
+    batches, indices, num_images = {}, {}, 0
+    for image in images:
+        if isinstance(image, Image.Image):
+            # as do_convert_rgb, the alpha channel is dropped
+            image = np.asarray(image.convert("RGB"))
+        image = torch.as_tensor(image)
+        if image.ndim == 3:
+            image = image[None]
+        if image.shape[-1] == 4:
+            image = image[..., :3]
+        key = tuple(image.shape[1:3])
+        batches.setdefault(key, []).append(image)
+        indices.setdefault(key, []).extend(
+            range(num_images, num_images + image.shape[0])
+        )
+        num_images += image.shape[0]
+    return [
+        (
+            indices[key],
+            torch.cat(batch, dim=0).to(device).permute(0, 3, 1, 2),
+        )
+        for key, batch in batches.items()
+    ]
+
+
+def get_resize_size(height: int, width: int, size: int) -> Tuple[int, int]:
+    # the shortest edge to size, as get_resize_output_image_size
+    short, long = min(height, width), max(height, width)
+    new_short, new_long = size, int(size * long / short)
+    return (new_short, new_long) if height <= width else (new_long, new_short)
+
+
+def resize_center_crop(
+    pixel_values: Float[Tensor, "B C H W"],
+    size: int,
+    crop_size: int,
+    quantize: bool = False,
+) -> Float[Tensor, "B C Hc Wc"]:
+    """
+    Bicubic antialiased resize of the shortest edge to size, then a center crop
+    of crop_size. With quantize, pixel_values are in [0, 255] and the resized
+    pixels are rounded as PIL does for uint8 images.
+    """
+    height, width = pixel_values.shape[-2:]
+    new_size = get_resize_size(height, width, size)
+    if new_size != (height, width):
+        pixel_values = F.interpolate(
+            pixel_values.float(),
+            size=new_size,
+            mode="bicubic",
+            align_corners=False,
+            antialias=True,
+        )
+        if quantize:
+            pixel_values = pixel_values.round().clamp(0, 255)
+    top = (new_size[0] - crop_size) // 2
+    left = (new_size[1] - crop_size) // 2
+    return pixel_values[..., top : top + crop_size, left : left + crop_size]
+
+
+def preprocess_images(
+    images: Union[Image.Image, np.ndarray, torch.Tensor, List],
+    size: int,
+    crop_size: int,
+    image_mean: List[float],
+    image_std: List[float],
+    device: Optional[Union[str, torch.device]] = None,
+) -> Float[Tensor, "B 3 Hc Wc"]:
+    """
+    Same pixel_values as processor.preprocess(images, return_tensors="pt",
+    do_rescale=True, do_resize=True, size=size, crop_size=crop_size), for
+    uint8 images, up to the rounding of the bicubic filter.
+    """
+    batches = images_to_tensor(images, device)
+    if len(batches) == 1:
+        pixel_values = resize_center_crop(
+            batches[0][1].float(), size, crop_size, quantize=True
+        )
+    else:
+        # images of different resolutions, back in the input order
+        num_images = sum(len(indices) for indices, _ in batches)
+        pixel_values = batches[0][1].new_empty(
+            (num_images, 3, crop_size, crop_size), dtype=torch.float32
+        )
+        for indices, batch in batches:
+            pixel_values[indices] = resize_center_crop(
+                batch.float(), size, crop_size, quantize=True
+            )
+    mean = torch.as_tensor(image_mean, device=pixel_values.device)
+    std = torch.as_tensor(image_std, device=pixel_values.device)
+    return (pixel_values / 255.0 - mean[:, None, None]) / std[:, None, None]
+
+
+if __name__ == "__main__":
+    # python -m <package>.step1x3d_geometry.models.conditional_encoders.image_processing
+    # parity with, and speed against, the HuggingFace processor
+    from transformers import AutoImageProcessor
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processor", type=str, default="facebook/dinov2-base")
+    parser.add_argument("--image_size", type=int, default=224)
+    parser.add_argument("--num_images", type=int, default=32)
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--atol", type=float, default=2.0 / 255 / 0.224)
+    args = parser.parse_args()
+
+    processor = AutoImageProcessor.from_pretrained(args.processor)
+    rng = np.random.default_rng(0)
+    image_sizes = [(518, 518), (600, 400), (333, 517), (64, 97)]
+    images = []
+    for i in range(args.num_images):
+        height, width = image_sizes[i % len(image_sizes)]
+        channels = 4 if i % 2 else 3  # RGBA and RGB
+        array = rng.integers(0, 256, (height, width, channels), dtype=np.uint8)
+        images.append(Image.fromarray(array))
+
+    timings = {}
+    start = time.perf_counter()
+    expected = processor.preprocess(
+        images,
+        return_tensors="pt",
+        do_rescale=True,
+        do_resize=True,
+        size=args.image_size,
+        crop_size=args.image_size,
+    ).pixel_values
+    timings["processor"] = time.perf_counter() - start
+    start = time.perf_counter()
+    pixel_values = preprocess_images(
+        images,
+        args.image_size,
+        args.image_size,
+        processor.image_mean,
+        processor.image_std,
+        device=args.device,
+    )
+    if torch.device(args.device).type == "cuda":
+        torch.cuda.synchronize(args.device)
+    timings["tensor"] = time.perf_counter() - start
+
+    diff = (pixel_values.cpu() - expected).abs()
+    print(f"max abs diff {diff.max():.5f}, mean abs diff {diff.mean():.6f}")
+    for name, seconds in timings.items():
+        print(f"{name}: {args.num_images / seconds:.1f} images/s")
+    assert diff.max() <= args.atol, "Tensor preprocessing differs from the processor"
@@ -64,14 +64,16 @@ class LabelEncoder(BaseLabelEncoder, ModelMixin):
                 NUM_GEOMETRY_QUALITY_CLASSES + 1, self.cfg.hidden_size
             )
 
+        self._embedding_table, self._embedding_table_key = None, None
+        # a buffer, so that it follows the device of the encoder
         if self.cfg.zero_uncond_embeds:
-            self.empty_label_embeds = torch.zeros((1, 3, self.cfg.hidden_size)).detach()
+            empty_label_embeds = torch.zeros((1, 3, self.cfg.hidden_size))
         else:
-            self.empty_label_embeds = (
-                self.encode_label(  # the last class label is for the uncond
-                    [{"pose": "", "symetry": "", "geometry_type": ""}]
-                ).detach()
-            )
+            # the last class label is for the uncond
+            empty_label_embeds = self.encode_label(
+                [{"pose": "", "symetry": "", "geometry_type": ""}]
+            ).detach()
+        self.register_buffer("empty_label_embeds", empty_label_embeds, persistent=False)
 
         # load pretrained_model_name_or_path
         if self.cfg.pretrained_model_name_or_path is not None:
@@ -85,83 +87,87 @@ class LabelEncoder(BaseLabelEncoder, ModelMixin):
                     pretrained_model_ckpt[k.replace("label_condition.", "")] = v
             self.load_state_dict(pretrained_model_ckpt, strict=True)
 
-    def encode_label(self, labels: List[dict]) -> torch.FloatTensor:
-        tpose_label_embeds = []
-        symmetry_type_label_embeds = []
-        geometry_quality_label_embeds = []
-
-        for label in labels:
-            if "pose" in label.keys():
-                if label["pose"] is None or label["pose"] == "":
-                    tpose_label_embeds.append(
-                        torch.zeros(self.cfg.hidden_size).detach().to(get_device())
-                    )
-                else:
-                    tpose_label_embeds.append(
-                        self.embedding_table_symmetry_type(
-                            torch.tensor(POSE_MAPPING[label["pose"][0]]).to(
-                                get_device()
-                            )
-                        )
-                    )
-            else:
-                tpose_label_embeds.append(
-                    self.embedding_table_tpose(
-                        torch.tensor(DEFAULT_POSE).to(get_device())
-                    )
+    def get_embedding_table(self) -> torch.FloatTensor:
+        """
+        The rows of all the embedding tables after a zero row, so that a batch of
+        labels is encoded with a single gather. Outside of training the table is
+        cached until the weights change.
+        """
+        weights = [
+            self.embedding_table_tpose.weight,
+            self.embedding_table_symmetry_type.weight,
+            self.embedding_table_geometry_quality.weight,
+        ]
+        if torch.is_grad_enabled() and any(w.requires_grad for w in weights):
+            return torch.cat([weights[0].new_zeros(1, weights[0].shape[1]), *weights])
+
+        key = tuple((w.data_ptr(), w._version) for w in weights)
+        if key != self._embedding_table_key:
+            self._embedding_table = torch.cat(
+                [weights[0].new_zeros(1, weights[0].shape[1]), *weights]
+            ).detach()
+            self._embedding_table_key = key
+        return self._embedding_table
+
+    def get_label_rows(self, label: dict) -> List[int]:
+        """
+        Rows of the pose, symmetry and geometry quality embeddings of a label in
+        get_embedding_table. Empty values map to the zero row.
+        """
+        num_tpose = self.embedding_table_tpose.num_embeddings
+        num_symmetry = self.embedding_table_symmetry_type.num_embeddings
+        num_quality = self.embedding_table_geometry_quality.num_embeddings
+        tpose_offset = 1
+        symmetry_offset = tpose_offset + num_tpose
+        quality_offset = symmetry_offset + num_symmetry
+
+        def row(offset, num_embeddings, index):
+            if index >= num_embeddings:
+                raise IndexError(f"Label index {index} out of range")
+            return offset + index
+
+        if "pose" in label.keys():
+            if label["pose"] is None or label["pose"] == "":
+                tpose_row = 0
+            else:  # poses are embedded with the symmetry table
+                tpose_row = row(
+                    symmetry_offset, num_symmetry, POSE_MAPPING[label["pose"][0]]
                 )
+        else:
+            tpose_row = row(tpose_offset, num_tpose, DEFAULT_POSE)
 
-            if "symmetry" in label.keys():
-                if label["symmetry"] is None or label["symmetry"] == "":
-                    symmetry_type_label_embeds.append(
-                        torch.zeros(self.cfg.hidden_size).detach().to(get_device())
-                    )
-                else:
-                    symmetry_type_label_embeds.append(
-                        self.embedding_table_symmetry_type(
-                            torch.tensor(
-                                SYMMETRY_TYPE_MAPPING[label["symmetry"]]
-                            ).to(get_device())
-                        )
-                    )
+        if "symmetry" in label.keys():
+            if label["symmetry"] is None or label["symmetry"] == "":
+                symmetry_row = 0
             else:
-                symmetry_type_label_embeds.append(
-                    self.embedding_table_symmetry_type(
-                        torch.tensor(DEFAULT_SYMMETRY_TYPE).to(get_device())
-                    )
+                symmetry_row = row(
+                    symmetry_offset,
+                    num_symmetry,
+                    SYMMETRY_TYPE_MAPPING[label["symmetry"]],
                 )
+        else:
+            symmetry_row = row(symmetry_offset, num_symmetry, DEFAULT_SYMMETRY_TYPE)
 
-            if "geometry_type" in label.keys():
-                if label["geometry_type"] is None or label["geometry_type"] == "":
-                    geometry_quality_label_embeds.append(
-                        torch.zeros(self.cfg.hidden_size).detach().to(get_device())
-                    )
-                else:
-                    geometry_quality_label_embeds.append(
-                        self.embedding_table_geometry_quality(
-                            torch.tensor(
-                                GEOMETRY_QUALITY_MAPPING[label["geometry_type"][0]]
-                            ).to(get_device())
-                        )
-                    )
+        if "geometry_type" in label.keys():
+            if label["geometry_type"] is None or label["geometry_type"] == "":
+                quality_row = 0
             else:
-                geometry_quality_label_embeds.append(
-                    self.embedding_table_geometry_quality(
-                        torch.tensor(DEFAULT_GEOMETRY_QUALITY).to(get_device())
-                    )
+                quality_row = row(
+                    quality_offset,
+                    num_quality,
+                    GEOMETRY_QUALITY_MAPPING[label["geometry_type"][0]],
                 )
+        else:
+            quality_row = row(quality_offset, num_quality, DEFAULT_GEOMETRY_QUALITY)
 
-        tpose_label_embeds = torch.stack(tpose_label_embeds)
-        symmetry_type_label_embeds = torch.stack(symmetry_type_label_embeds)
-        geometry_quality_label_embeds = torch.stack(geometry_quality_label_embeds)
-
-        label_embeds = torch.stack(
-            [
-                tpose_label_embeds,
-                symmetry_type_label_embeds,
-                geometry_quality_label_embeds,
-            ],
-            dim=1,
-        ).to(self.dtype)
+        return [tpose_row, symmetry_row, quality_row]
 
-        return label_embeds
+    def encode_label(self, labels: List[dict]) -> torch.FloatTensor:
+        table = self.get_embedding_table()
+        rows = torch.tensor(
+            [self.get_label_rows(label) for label in labels],
+            dtype=torch.long,
+            device=table.device,
+        )
+        label_embeds = table[rows]  # B 3 hidden_size
+        return label_embeds.to(self.dtype)
@@ -1,10 +1,9 @@
 import random
+from collections import OrderedDict
+
 import torch
 from torch import nn
 import numpy as np
-import re
-import urllib.parse as ul
-from bs4 import BeautifulSoup
 from einops import rearrange
 from dataclasses import dataclass
 from torchvision import transforms
@@ -19,22 +18,7 @@ from .... import step1x3d_geometry
 from ...utils.typing import *
 
 from .base import BaseCaptionEncoder
-
-bad_punct_regex = re.compile(
-    r"["
-    + "#®•©™&@·º½¾¿¡§~"
-    + "\)"
-    + "\("
-    + "\]"
-    + "\["
-    + "\}"
-    + "\{"
-    + "\|"
-    + "\\"
-    + "\/"
-    + "\*"
-    + r"]{1,}"
-)  # noqa
+from .caption_cleaning import clean_caption, clean_caption_cached
 
 
 @step1x3d_geometry.register("t5-encoder")
@@ -51,6 +35,7 @@ class T5Encoder(BaseCaptionEncoder, ModelMixin):
         preprocessing_text: bool = False
         text_max_length: int = 77
         t5_type: Optional[str] = None
+        embedding_cache_size: int = 8192  # LRU of caption embeddings on CPU, 0 disables
 
     cfg: Config
 
@@ -95,6 +80,9 @@ class T5Encoder(BaseCaptionEncoder, ModelMixin):
                 )
             self.tokenizer = T5Tokenizer.from_pretrained(self.cfg.t5_type)
 
+        self._embedding_cache = OrderedDict()
+        self._embedding_cache_key = None
+
         # Set the empty image/text embeds
         if self.cfg.zero_uncond_embeds:
             self.empty_text_embeds = torch.zeros(
@@ -116,137 +104,44 @@ class T5Encoder(BaseCaptionEncoder, ModelMixin):
             self.load_state_dict(pretrained_model_ckpt, strict=True)
 
     def clean_caption(self, caption):
-        caption = str(caption)
-        caption = ul.unquote_plus(caption)
-        caption = caption.strip().lower()
-        caption = re.sub("<person>", "person", caption)
-        # urls:
-        caption = re.sub(
-            r"\b((?:https?:(?:\/{1,3}|[a-zA-Z0-9%])|[a-zA-Z0-9.\-]+[.](?:com|co|ru|net|org|edu|gov|it)[\w/-]*\b\/?(?!@)))",  # noqa
-            "",
-            caption,
-        )  # regex for urls
-        caption = re.sub(
-            r"\b((?:www:(?:\/{1,3}|[a-zA-Z0-9%])|[a-zA-Z0-9.\-]+[.](?:com|co|ru|net|org|edu|gov|it)[\w/-]*\b\/?(?!@)))",  # noqa
-            "",
-            caption,
-        )  # regex for urls
-        # html:
-        caption = BeautifulSoup(caption, features="html.parser").text
-
-        # @<nickname>
-        caption = re.sub(r"@[\w\d]+\b", "", caption)
-
-        # 31C0—31EF CJK Strokes
-        # 31F0—31FF Katakana Phonetic Extensions
-        # 3200—32FF Enclosed CJK Letters and Months
-        # 3300—33FF CJK Compatibility
-        # 3400—4DBF CJK Unified Ideographs Extension A
-        # 4DC0—4DFF Yijing Hexagram Symbols
-        # 4E00—9FFF CJK Unified Ideographs
-        caption = re.sub(r"[\u31c0-\u31ef]+", "", caption)
-        caption = re.sub(r"[\u31f0-\u31ff]+", "", caption)
-        caption = re.sub(r"[\u3200-\u32ff]+", "", caption)
-        caption = re.sub(r"[\u3300-\u33ff]+", "", caption)
-        caption = re.sub(r"[\u3400-\u4dbf]+", "", caption)
-        caption = re.sub(r"[\u4dc0-\u4dff]+", "", caption)
-        caption = re.sub(r"[\u4e00-\u9fff]+", "", caption)
-        #######################################################
-
-        # все виды тире / all types of dash --> "-"
-        caption = re.sub(
-            r"[\u002D\u058A\u05BE\u1400\u1806\u2010-\u2015\u2E17\u2E1A\u2E3A\u2E3B\u2E40\u301C\u3030\u30A0\uFE31\uFE32\uFE58\uFE63\uFF0D]+",  # noqa
-            "-",
-            caption,
-        )
-
-        # кавычки к одному стандарту
-        caption = re.sub(r"[`´«»“”¨]", '"', caption)
-        caption = re.sub(r"[‘’]", "'", caption)
-
-        # &quot;
-        caption = re.sub(r"&quot;?", "", caption)
-        # &amp
-        caption = re.sub(r"&amp", "", caption)
-
-        # ip adresses:
-        caption = re.sub(r"\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}", " ", caption)
-
-        # article ids:
-        caption = re.sub(r"\d:\d\d\s+$", "", caption)
-
-        # \n
-        caption = re.sub(r"\\n", " ", caption)
-
-        # "#123"
-        caption = re.sub(r"#\d{1,3}\b", "", caption)
-        # "#12345.."
-        caption = re.sub(r"#\d{5,}\b", "", caption)
-        # "123456.."
-        caption = re.sub(r"\b\d{6,}\b", "", caption)
-        # filenames:
-        caption = re.sub(
-            r"[\S]+\.(?:png|jpg|jpeg|bmp|webp|eps|pdf|apk|mp4)", "", caption
-        )
-
-        #
-        caption = re.sub(r"[\"\']{2,}", r'"', caption)  # """AUSVERKAUFT"""
-        caption = re.sub(r"[\.]{2,}", r" ", caption)  # """AUSVERKAUFT"""
-
-        caption = re.sub(
-            bad_punct_regex, r" ", caption
-        )  # ***AUSVERKAUFT***, #AUSVERKAUFT
-        caption = re.sub(r"\s+\.\s+", r" ", caption)  # " . "
-
-        # this-is-my-cute-cat / this_is_my_cute_cat
-        regex2 = re.compile(r"(?:\-|\_)")
-        if len(re.findall(regex2, caption)) > 3:
-            caption = re.sub(regex2, " ", caption)
-
-        caption = self.basic_clean(caption)
-
-        caption = re.sub(r"\b[a-zA-Z]{1,3}\d{3,15}\b", "", caption)  # jc6640
-        caption = re.sub(r"\b[a-zA-Z]+\d+[a-zA-Z]+\b", "", caption)  # jc6640vc
-        caption = re.sub(r"\b\d+[a-zA-Z]+\d+\b", "", caption)  # 6640vc231
-
-        caption = re.sub(r"(worldwide\s+)?(free\s+)?shipping", "", caption)
-        caption = re.sub(r"(free\s)?download(\sfree)?", "", caption)
-        caption = re.sub(r"\bclick\b\s(?:for|on)\s\w+", "", caption)
-        caption = re.sub(
-            r"\b(?:png|jpg|jpeg|bmp|webp|eps|pdf|apk|mp4)(\simage[s]?)?", "", caption
-        )
-        caption = re.sub(r"\bpage\s+\d+\b", "", caption)
-
-        caption = re.sub(
-            r"\b\d*[a-zA-Z]+\d+[a-zA-Z]+\d+[a-zA-Z\d]*\b", r" ", caption
-        )  # j2d1a2a...
-
-        caption = re.sub(r"\b\d+\.?\d*[xх×]\d+\.?\d*\b", "", caption)
-
-        caption = re.sub(r"\b\s+\:\s+", r": ", caption)
-        caption = re.sub(r"(\D[,\./])\b", r"\1 ", caption)
-        caption = re.sub(r"\s+", " ", caption)
-
-        caption.strip()
-
-        caption = re.sub(r"^[\"\']([\w\W]+)[\"\']$", r"\1", caption)
-        caption = re.sub(r"^[\'\_,\-\:;]", r"", caption)
-        caption = re.sub(r"[\'\_,\-\:\-\+]$", r"", caption)
-        caption = re.sub(r"^\.\S+$", "", caption)
-
-        return caption.strip()
+        return clean_caption(caption)
 
     def text_preprocessing(self, text):
         if self.cfg.preprocessing_text:
             # The exact text cleaning as was in the training stage:
-            text = self.clean_caption(text)
-            return text
+            return clean_caption_cached(text)
         else:
             return text.lower().strip()
 
     def encode_text(self, texts: List[str]) -> torch.FloatTensor:
         texts = [self.text_preprocessing(text) for text in texts]
+        if self.cfg.embedding_cache_size <= 0:
+            return self._encode_text(texts)
+
+        # T5 is frozen, the cache only has to follow loaded weights
+        weight = next(self.text_model.parameters())
+        key = (weight.data_ptr(), weight._version)
+        if key != self._embedding_cache_key:
+            self._embedding_cache.clear()
+            self._embedding_cache_key = key
+
+        embeds = {}
+        for text in dict.fromkeys(texts):
+            if text in self._embedding_cache:
+                self._embedding_cache.move_to_end(text)
+                embeds[text] = self._embedding_cache[text]
+        missing = [text for text in dict.fromkeys(texts) if text not in embeds]
+        if len(missing) > 0:
+            for text, embed in zip(missing, self._encode_text(missing).cpu()):
+                embeds[text] = embed.clone()  # not a view of the whole batch
+                self._embedding_cache[text] = embeds[text]
+            while len(self._embedding_cache) > self.cfg.embedding_cache_size:
+                self._embedding_cache.popitem(last=False)
+        return torch.stack([embeds[text] for text in texts]).to(
+            self.text_model.device
+        )
 
+    def _encode_text(self, texts: List[str]) -> torch.FloatTensor:
         text_tokens_and_mask = self.tokenizer(
             texts,
             max_length=self.cfg.text_max_length,
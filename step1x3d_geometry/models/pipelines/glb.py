@@ -0,0 +1,116 @@
+import json
+import struct
+
+import numpy as np
+
+# glTF constants
+GL_UNSIGNED_BYTE = 5121
+GL_UNSIGNED_SHORT = 5123
+GL_UNSIGNED_INT = 5125
+GL_FLOAT = 5126
+GL_ARRAY_BUFFER = 34962
+GL_ELEMENT_ARRAY_BUFFER = 34963
+
+COMPONENT_TYPES = {
+    np.dtype(np.int8): 5120,
+    np.dtype(np.uint8): GL_UNSIGNED_BYTE,
+    np.dtype(np.int16): 5122,
+    np.dtype(np.uint16): GL_UNSIGNED_SHORT,
+    np.dtype(np.uint32): GL_UNSIGNED_INT,
+    np.dtype(np.float32): GL_FLOAT,
+}
+ACCESSOR_TYPES = {1: "SCALAR", 2: "VEC2", 3: "VEC3", 4: "VEC4"}
+
+
+class GLBBuilder:
+    """
+    Collects glTF json and binary buffer views, and writes them as a single GLB
+    without concatenating the binary chunk in memory.
+    """
+
+    def __init__(self):
+        self.gltf = {
+            "asset": {"version": "2.0", "generator": "Step1X-3D"},
+            "scene": 0,
+            "scenes": [{"nodes": [0]}],
+            "nodes": [{"mesh": 0}],
+            "buffers": [],
+            "bufferViews": [],
+            "accessors": [],
+        }
+        self.chunks = []
+        self.byte_length = 0
+
+    def add_buffer_view(self, data, target=None, byte_stride=None):
+        if self.byte_length % 4 != 0:
+            padding = 4 - self.byte_length % 4
+            self.chunks.append(bytes(padding))
+            self.byte_length += padding
+        data = memoryview(data).cast("B")
+        buffer_view = {
+            "buffer": 0,
+            "byteOffset": self.byte_length,
+            "byteLength": data.nbytes,
+        }
+        if target is not None:
+            buffer_view["target"] = target
+        if byte_stride is not None:
+            buffer_view["byteStride"] = byte_stride
+        self.chunks.append(data)
+        self.byte_length += data.nbytes
+        self.gltf["bufferViews"].append(buffer_view)
+        return len(self.gltf["bufferViews"]) - 1
+
+    def add_accessor(
+        self,
+        array,
+        target=None,
+        normalized=False,
+        with_bounds=False,
+        num_components=None,
+    ):
+        # num_components below the array width leaves the trailing columns as
+        # padding, to keep quantized vertex attributes 4-byte aligned
+        array = np.ascontiguousarray(array)
+        width = 1 if array.ndim == 1 else array.shape[1]
+        if num_components is None:
+            num_components = width
+        byte_stride = array.strides[0] if num_components < width else None
+        accessor = {
+            "bufferView": self.add_buffer_view(array, target, byte_stride),
+            "componentType": COMPONENT_TYPES[array.dtype],
+            "count": len(array),
+            "type": ACCESSOR_TYPES[num_components],
+        }
+        if normalized:
+            accessor["normalized"] = True
+        if with_bounds:
+            bounds = array if array.ndim == 1 else array[:, :num_components]
+            accessor["min"] = np.atleast_1d(bounds.min(0)).tolist()
+            accessor["max"] = np.atleast_1d(bounds.max(0)).tolist()
+        self.gltf["accessors"].append(accessor)
+        return len(self.gltf["accessors"]) - 1
+
+    def add_extension(self, name, required=False):
+        if name not in self.gltf.setdefault("extensionsUsed", []):
+            self.gltf["extensionsUsed"].append(name)
+        if required and name not in self.gltf.setdefault("extensionsRequired", []):
+            self.gltf["extensionsRequired"].append(name)
+
+    def write(self, path):
+        self.gltf["buffers"] = [{"byteLength": self.byte_length}]
+        json_chunk = json.dumps(self.gltf, separators=(",", ":")).encode("utf-8")
+        json_chunk += b" " * (-len(json_chunk) % 4)
+        bin_padding = bytes(-self.byte_length % 4)
+        bin_length = self.byte_length + len(bin_padding)
+        total_length = 12 + 8 + len(json_chunk) + 8 + bin_length
+
+        with open(path, "wb") as f:
+            f.write(struct.pack("<4sII", b"glTF", 2, total_length))
+            f.write(struct.pack("<I4s", len(json_chunk), b"JSON"))
+            f.write(json_chunk)
+            f.write(struct.pack("<I4s", bin_length, b"BIN\x00"))
+            for chunk in self.chunks:
+                f.write(chunk)
+            f.write(bin_padding)
+        return path
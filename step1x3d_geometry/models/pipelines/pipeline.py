@@ -175,13 +175,11 @@ class Step1X3DGeometryPipeline(
         return caption_embeds, uncond_caption_embeds
 
     def encode_label(self, label, device, num_meshes_per_prompt):
-        dtype = next(self.label_encoder.parameters()).dtype
-
-        label_embeds = self.label_encoder.encode_label([label])
-        label_embeds = label_embeds.repeat_interleave(num_meshes_per_prompt, dim=0)
+        # a single gather from the cached label embedding table
+        label_embeds = self.label_encoder.encode_label([label] * num_meshes_per_prompt)
 
-        uncond_label_embeds = self.label_encoder.empty_label_embeds.repeat(
-            label_embeds.shape[0], 1, 1
+        uncond_label_embeds = self.label_encoder.empty_label_embeds.expand(
+            label_embeds.shape[0], -1, -1
         ).to(label_embeds)
 
         return label_embeds, uncond_label_embeds
@@ -1,5 +1,6 @@
 from typing import Callable, List, Optional, Union, Dict, Any
 import os
+import numpy as np
 from diffusers.utils import logging
 import PIL.Image
 import torch
@@ -119,6 +120,58 @@ def preprocess_image(
     return preprocessed_images
 
 
+def flatten_scene(scene: trimesh.Scene) -> trimesh.Trimesh:
+    """
+    Bake node transforms into the geometries of a scene and concatenate them,
+    allocating the vertex, face and attribute buffers once.
+    """
+    instances = []
+    for node_name in scene.graph.nodes_geometry:
+        transform, geometry_name = scene.graph[node_name]
+        geometry = scene.geometry[geometry_name]
+        if isinstance(geometry, trimesh.Trimesh) and len(geometry.faces) > 0:
+            instances.append((np.asarray(transform, dtype=np.float64), geometry))
+    if len(instances) == 0:
+        return trimesh.Trimesh()
+
+    num_vertices = sum(len(geometry.vertices) for _, geometry in instances)
+    num_faces = sum(len(geometry.faces) for _, geometry in instances)
+    vertices = np.empty((num_vertices, 3), dtype=np.float64)
+    faces = np.empty((num_faces, 3), dtype=np.int64)
+
+    # per-vertex attributes are kept only if every geometry carries them
+    has_uv = all(
+        getattr(geometry.visual, "uv", None) is not None for _, geometry in instances
+    )
+    has_colors = all(geometry.visual.kind == "vertex" for _, geometry in instances)
+    uv = np.empty((num_vertices, 2), dtype=np.float64) if has_uv else None
+    colors = np.empty((num_vertices, 4), dtype=np.uint8) if has_colors else None
+
+    v_start, f_start = 0, 0
+    for transform, geometry in instances:
+        v_end = v_start + len(geometry.vertices)
+        f_end = f_start + len(geometry.faces)
+        np.dot(geometry.vertices, transform[:3, :3].T, out=vertices[v_start:v_end])
+        vertices[v_start:v_end] += transform[:3, 3]
+        if np.linalg.det(transform[:3, :3]) < 0:
+            # mirrored instances flip the winding, as trimesh.apply_transform does
+            faces[f_start:f_end] = geometry.faces[:, ::-1] + v_start
+        else:
+            faces[f_start:f_end] = geometry.faces + v_start
+        if has_uv:
+            uv[v_start:v_end] = geometry.visual.uv
+        if has_colors:
+            colors[v_start:v_end] = geometry.visual.vertex_colors
+        v_start, f_start = v_end, f_end
+
+    mesh = trimesh.Trimesh(
+        vertices=vertices, faces=faces, vertex_colors=colors, process=False
+    )
+    if has_uv:
+        mesh.visual = trimesh.visual.TextureVisuals(uv=uv)
+    return mesh
+
+
 def load_mesh(path):
     if path.endswith(".glb"):
         mesh = trimesh.load(path)
@@ -131,12 +184,7 @@ def load_mesh(path):
 def trimesh2pymeshlab(mesh: trimesh.Trimesh):
     with tempfile.NamedTemporaryFile(suffix=".ply", delete=False) as temp_file:
         if isinstance(mesh, trimesh.scene.Scene):
-            for idx, obj in enumerate(mesh.geometry.values()):
-                if idx == 0:
-                    temp_mesh = obj
-                else:
-                    temp_mesh = temp_mesh + obj
-            mesh = temp_mesh
+            mesh = flatten_scene(mesh)
         mesh.export(temp_file.name)
         mesh = pymeshlab.MeshSet()
         mesh.load_new_mesh(temp_file.name)
@@ -148,10 +196,7 @@ def pymeshlab2trimesh(mesh: pymeshlab.MeshSet):
         mesh.save_current_mesh(temp_file.name)
         mesh = trimesh.load(temp_file.name)
     if isinstance(mesh, trimesh.Scene):
-        combined_mesh = trimesh.Trimesh()
-        for geom in mesh.geometry.values():
-            combined_mesh = trimesh.util.concatenate([combined_mesh, geom])
-        mesh = combined_mesh
+        mesh = flatten_scene(mesh)
     return mesh
 
 
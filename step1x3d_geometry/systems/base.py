@@ -28,6 +28,8 @@ class BaseSystem(pl.LightningModule, Updateable, SaverMixin):
         weights_ignore_modules: Optional[List[str]] = None
         cleanup_after_validation_step: bool = False
         cleanup_after_test_step: bool = False
+        save_workers: int = 2  # background save_* workers, 0 saves synchronously
+        save_queue_size: int = 32
 
         pretrained_model_path: Optional[str] = None
         strict_load: bool = True
@@ -107,6 +109,15 @@ class BaseSystem(pl.LightningModule, Updateable, SaverMixin):
             )
         return ret
 
+    def setup(self, stage: str) -> None:
+        self.start_async_saving(self.cfg.save_workers, self.cfg.save_queue_size)
+
+    def on_validation_end(self) -> None:
+        self.flush_saves()
+
+    def teardown(self, stage: str) -> None:
+        self.stop_async_saving()
+
     def training_step(self, batch, batch_idx):
         raise NotImplementedError
 
@@ -178,6 +189,9 @@ class BaseSystem(pl.LightningModule, Updateable, SaverMixin):
         self.dataset = self.trainer.train_dataloader.dataset
         update_if_possible(self.dataset, self.true_current_epoch, self.true_global_step)
         self.do_update_step(self.true_current_epoch, self.true_global_step)
+        # backpressure of the background saving
+        for name, value in self.get_save_stats().items():
+            self.log(f"saver/{name}", float(value))
 
     def on_validation_batch_start(self, batch, batch_idx, dataloader_idx=0):
         self.preprocess_data(batch, "validation")
@@ -0,0 +1,147 @@
+import argparse
+import json
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+from tqdm import tqdm
+
+from ... import step1x3d_geometry
+from ..data.shards import ShardWriter
+from ..utils.config import load_config
+from ..utils.typing import *
+
+
+class ConditionInputDataset(Dataset):
+    """
+    All views and the caption of every object of a geometry dataset, prepared
+    exactly as BaseDataset does for training.
+    """
+
+    def __init__(self, dataset, load_image: bool, load_caption: bool) -> None:
+        self.dataset = dataset
+        self.load_image = load_image
+        self.load_caption = load_caption
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        uid = self.dataset.uids[index]
+        ret = {"index": index}
+        try:
+            if self.load_image:
+                ret["image"] = torch.stack(
+                    [
+                        self.dataset._load_image(index, sel_idx)["image"].float()
+                        for sel_idx in self.dataset.cfg.idx
+                    ],
+                    dim=0,
+                )
+            if self.load_caption:
+                with open(f"{self.dataset.cfg.root_dir}/metas/{uid}.json", "r") as f:
+                    ret["caption"] = json.load(f)["caption"]
+        except Exception as e:
+            print(f"Error in {uid}: {e}")
+            return None
+        return ret
+
+
+@torch.no_grad()
+def precompute_condition_embeddings(
+    dataset,
+    shard_dir: str,
+    visual_condition=None,
+    caption_condition=None,
+    with_flip: bool = False,
+    num_workers: int = 8,
+    dtype=np.float16,
+) -> None:
+    """
+    Store the DINO tokens of every view (and of the flipped views, matching
+    BaseDataset's random_flip) and the T5 embedding of the caption per uid.
+    """
+    writer = ShardWriter(shard_dir)
+    writer.meta["with_flip"] = with_flip
+    loader = DataLoader(
+        ConditionInputDataset(
+            dataset, visual_condition is not None, caption_condition is not None
+        ),
+        batch_size=None,
+        num_workers=num_workers,
+    )
+    for item in tqdm(loader, desc="Encoding conditions"):
+        if item is None:
+            continue
+        arrays = {}
+        if visual_condition is not None:
+            images = item["image"]
+            arrays["view_idx"] = np.asarray(dataset.cfg.idx, dtype=np.int64)
+            arrays["dino"] = visual_condition.encode_image(images).float().cpu().numpy()
+            if with_flip:  # same flip of the width as BaseDataset._get_data
+                arrays["dino_flip"] = (
+                    visual_condition.encode_image(torch.flip(images, [2]))
+                    .float()
+                    .cpu()
+                    .numpy()
+                )
+        if caption_condition is not None:
+            arrays["t5"] = caption_condition.encode_text([item["caption"]])[0]
+            arrays["t5"] = arrays["t5"].float().cpu().numpy()
+        writer.add(
+            dataset.uids[item["index"]],
+            {
+                key: value.astype(dtype) if value.dtype.kind == "f" else value
+                for key, value in arrays.items()
+            },
+        )
+    writer.close()
+
+
+if __name__ == "__main__":
+    # python -m <package>.step1x3d_geometry.systems.embedding_cache \
+    #     --config <diffusion config>.yaml --shard_dir <data>/embedding_shards
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, required=True)
+    parser.add_argument("--shard_dir", type=str, required=True)
+    parser.add_argument("--splits", type=str, nargs="+", default=["train", "val"])
+    parser.add_argument("--with_flip", action="store_true")
+    parser.add_argument("--device", type=str, default="cuda")
+    args, extras = parser.parse_known_args()
+
+    cfg = load_config(args.config, cli_args=extras)
+    visual_condition, caption_condition = None, None
+    if cfg.system.get("visual_condition_type") is not None:
+        visual_condition = step1x3d_geometry.find(cfg.system.visual_condition_type)(
+            cfg.system.visual_condition
+        )
+        visual_condition.to(args.device).eval()
+    if cfg.system.get("caption_condition_type") is not None:
+        caption_condition = step1x3d_geometry.find(
+            cfg.system.caption_condition_type
+        )(cfg.system.caption_condition)
+        caption_condition.to(args.device).eval()
+
+    datamodule = step1x3d_geometry.find(cfg.data_type)(cfg.data)
+    # the cached embeddings are reused every epoch, so augmentations other than
+    # the flip (stored with --with_flip) would be frozen into them
+    datamodule.cfg.random_color_jitter = False
+    datamodule.cfg.random_rotate = False
+    if datamodule.cfg.background_color is None:
+        datamodule.cfg.background_color = (255, 255, 255)
+    datamodule.cfg.embedding_shard_dir = None
+    datamodule.setup("fit")
+    if "test" in args.splits:
+        datamodule.setup("test")
+    # every split reads the embeddings from embedding_shard_dir
+    for split in args.splits:
+        dataset = getattr(datamodule, f"{split}_dataset")
+        print(f"Encoding {len(dataset)} {split} uids into {args.shard_dir}")
+        precompute_condition_embeddings(
+            dataset,
+            args.shard_dir,
+            visual_condition=visual_condition,
+            caption_condition=caption_condition,
+            with_flip=args.with_flip,
+            num_workers=datamodule.cfg.num_workers,
+        )
@@ -0,0 +1,138 @@
+import argparse
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+from tqdm import tqdm
+
+from ... import step1x3d_geometry
+from ..data.shards import ShardWriter, shape_latent_key
+from ..utils.config import load_config
+from ..utils.typing import *
+
+
+class ShapeSurfaceDataset(Dataset):
+    """
+    Surfaces of a geometry dataset, keyed by index, without the error
+    fallback of BaseDataset.__getitem__ so latents never land on the wrong uid.
+    """
+
+    def __init__(self, dataset, flip: bool = False) -> None:
+        self.dataset = dataset
+        self.flip = flip
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        try:
+            data = self.dataset._load_shape_from_occupancy_or_sdf(index)
+        except Exception as e:
+            print(f"Error in {self.dataset.uids[index]}: {e}")
+            return None
+        ret = {"index": index}
+        for key in ["surface", "sharp_surface"]:
+            if key in data:
+                if self.flip:  # same flip as BaseDataset._get_data
+                    data[key][:, 0] = -data[key][:, 0]
+                    data[key][:, 3] = -data[key][:, 3]
+                ret[key] = data[key]
+        return ret
+
+    @staticmethod
+    def collate(batch):
+        batch = [b for b in batch if b is not None]
+        if len(batch) == 0:
+            return None
+        return torch.utils.data.default_collate(batch)
+
+
+@torch.no_grad()
+def precompute_shape_latents(
+    shape_model,
+    dataset,
+    shard_dir: str,
+    num_variants: int = 1,
+    flip_variants: bool = False,
+    batch_size: int = 16,
+    num_workers: int = 8,
+    device: str = "cuda",
+) -> None:
+    """
+    Encode every object of the dataset num_variants times, each with a fresh
+    surface sampling, and store the posterior mean and logvar in shards.
+    With flip_variants, odd variants are encoded from the flipped surface, so
+    that random_flip still works when training from the cache.
+    """
+    writer = ShardWriter(shard_dir)
+    writer.meta["num_variants"] = num_variants
+    writer.meta["flips"] = [flip_variants and k % 2 == 1 for k in range(num_variants)]
+    point_feats = shape_model.cfg.point_feats
+
+    for variant, flip in enumerate(writer.meta["flips"]):
+        loader = DataLoader(
+            ShapeSurfaceDataset(dataset, flip),
+            batch_size=batch_size,
+            num_workers=num_workers,
+            collate_fn=ShapeSurfaceDataset.collate,
+        )
+        for batch in tqdm(loader, desc=f"Encoding variant {variant}"):
+            if batch is None:
+                continue
+            surface = batch["surface"][..., : 3 + point_feats].to(device)
+            sharp_surface = None
+            if "sharp_surface" in batch:
+                sharp_surface = batch["sharp_surface"][..., : 3 + point_feats]
+                sharp_surface = sharp_surface.to(device)
+            _, _, posterior = shape_model.encode(
+                surface, sample_posterior=False, sharp_surface=sharp_surface
+            )
+            mean = posterior.mean.float().cpu().numpy()
+            logvar = posterior.logvar.float().cpu().numpy()
+            for i, index in enumerate(batch["index"].tolist()):
+                writer.add(
+                    shape_latent_key(dataset.uids[index], variant),
+                    {"mean": mean[i], "logvar": logvar[i]},
+                )
+    writer.close()
+
+
+if __name__ == "__main__":
+    # python -m <package>.step1x3d_geometry.systems.latent_cache \
+    #     --config <rectified flow config>.yaml --shard_dir <data>/latent_shards
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, required=True)
+    parser.add_argument("--shard_dir", type=str, required=True)
+    parser.add_argument("--splits", type=str, nargs="+", default=["train", "val"])
+    parser.add_argument("--num_variants", type=int, default=1)
+    parser.add_argument("--flip_variants", action="store_true")
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--device", type=str, default="cuda")
+    args, extras = parser.parse_known_args()
+
+    cfg = load_config(args.config, cli_args=extras)
+    shape_model = step1x3d_geometry.find(cfg.system.shape_model_type)(
+        cfg.system.shape_model
+    )
+    shape_model.to(args.device).eval().requires_grad_(False)
+
+    datamodule = step1x3d_geometry.find(cfg.data_type)(cfg.data)
+    datamodule.cfg.random_flip = False
+    datamodule.cfg.latent_shard_dir = None
+    datamodule.setup("fit")
+    if "test" in args.splits:
+        datamodule.setup("test")
+    # every split reads the latents from latent_shard_dir
+    for split in args.splits:
+        dataset = getattr(datamodule, f"{split}_dataset")
+        print(f"Encoding {len(dataset)} {split} uids into {args.shard_dir}")
+        precompute_shape_latents(
+            shape_model,
+            dataset,
+            args.shard_dir,
+            num_variants=args.num_variants,
+            flip_variants=args.flip_variants,
+            batch_size=args.batch_size,
+            num_workers=datamodule.cfg.num_workers,
+            device=args.device,
+        )
@@ -27,7 +27,8 @@ from .base import BaseSystem
 from ..utils.misc import get_rank
 from ..utils.typing import *
 from diffusers import DDIMScheduler
-from .utils import read_image, ddim_sample
+from .utils import read_image, preprocess_image, ddim_sample
+from .validation import ValidationSampler
 
 
 # DEBUG = True
@@ -39,6 +40,7 @@ class DiffusionSystem(BaseSystem):
         bounds: float = 1.05
         mc_level: float = 0.0
         octree_resolution: int = 256
+        val_num_workers: int = 2  # background mesh extraction and saving
         skip_validation: bool = True
 
         # diffusion config
@@ -110,6 +112,12 @@ class DiffusionSystem(BaseSystem):
             self.cfg.denoise_scheduler_type
         )(**self.cfg.denoise_scheduler)
 
+        self.val_sampler = ValidationSampler(
+            self.cfg.val_samples_json,
+            preprocess_image,
+            num_workers=self.cfg.val_num_workers,
+        )
+
     def forward(self, batch: Dict[str, Any], skip_noise=False) -> Dict[str, Any]:
         # 1. encode shape latents
         if "sharp_surface" in batch.keys():
@@ -266,77 +274,15 @@ class DiffusionSystem(BaseSystem):
             return {}
         self.eval()
 
-        if get_rank() == 0:
-            sample_inputs = json.loads(
-                open(self.cfg.val_samples_json).read()
-            )  # condition
-            sample_inputs_ = copy.deepcopy(sample_inputs)
-            sample_outputs = self.sample(sample_inputs)  # list
-            for i, latents in enumerate(sample_outputs["latents"]):
-                meshes = self.shape_model.extract_geometry(
-                    latents,
-                    bounds=self.cfg.bounds,
-                    mc_level=self.cfg.mc_level,
-                    octree_resolution=self.cfg.octree_resolution,
-                    enable_pbar=False,
-                )
-
-                for j in range(len(meshes)):
-                    name = ""
-                    if "image" in sample_inputs_:
-                        name += (
-                            sample_inputs_["image"][j]
-                            .split("/")[-1]
-                            .replace(".png", "")
-                        )
-                    elif "mvimages" in sample_inputs_:
-                        name += (
-                            sample_inputs_["mvimages"][j][0]
-                            .split("/")[-2]
-                            .replace(".png", "")
-                        )
-
-                    if "caption" in sample_inputs_:
-                        name += "_" + sample_inputs_["caption"][j].replace(" ", "_")
-
-                    if "label" in sample_inputs_:
-                        name += (
-                            "_"
-                            + sample_inputs_["label"][j]["symmetry"]
-                            + sample_inputs_["label"][j]["edge_type"]
-                        )
-
-                    if (
-                        meshes[j].verts is not None
-                        and meshes[j].verts.shape[0] > 0
-                        and meshes[j].faces is not None
-                        and meshes[j].faces.shape[0] > 0
-                    ):
-                        self.save_mesh(
-                            f"it{self.true_global_step}/{name}_{i}.obj",
-                            meshes[j].verts,
-                            meshes[j].faces,
-                        )
-                        torch.cuda.empty_cache()
-
         out = self(batch)
         if self.global_step == 0:
             latents = self.shape_model.decode(out["latents"])
-            meshes = self.shape_model.extract_geometry(
+            self.val_sampler.save_meshes(
+                self,
                 latents,
-                bounds=self.cfg.bounds,
-                mc_level=self.cfg.mc_level,
-                octree_resolution=self.cfg.octree_resolution,
-                enable_pbar=False,
+                [f"it{self.true_global_step}/{uid}.obj" for uid in batch["uid"]],
             )
 
-            for i, mesh in enumerate(meshes):
-                self.save_mesh(
-                    f"it{self.true_global_step}/{batch['uid'][i]}.obj",
-                    mesh.verts,
-                    mesh.faces,
-                )
-
         return {"val/loss": out["loss_diffusion"]}
 
     @torch.no_grad()
@@ -348,6 +294,7 @@ class DiffusionSystem(BaseSystem):
         guidance_scale: Optional[float] = None,
         eta: float = 0.0,
         seed: Optional[int] = None,
+        preprocess: bool = True,
         **kwargs,
     ):
 
@@ -360,13 +307,14 @@ class DiffusionSystem(BaseSystem):
         # conditional encode
         visal_cond = None
         if "image" in sample_inputs:
-            sample_inputs["image"] = [
-                Image.open(img) if type(img) == str else img
-                for img in sample_inputs["image"]
-            ]
-            sample_inputs["image"] = Step1X3DGeometryPipeline.preprocess_image(
-                sample_inputs["image"], **kwargs
-            )
+            if preprocess:
+                sample_inputs["image"] = [
+                    Image.open(img) if type(img) == str else img
+                    for img in sample_inputs["image"]
+                ]
+                sample_inputs["image"] = preprocess_image(
+                    sample_inputs["image"], **kwargs
+                )
             cond = self.visual_condition.encode_image(sample_inputs["image"])
             if do_classifier_free_guidance:
                 un_cond = self.visual_condition.empty_image_embeds.repeat(
@@ -418,8 +366,23 @@ class DiffusionSystem(BaseSystem):
 
         return {"latents": latents_list, "inputs": sample_inputs}
 
+    @torch.no_grad()
     def on_validation_epoch_end(self):
-        pass
+        if self.cfg.skip_validation or get_rank() != 0:
+            return
+        # meshes of the previous validation are done before new ones are queued
+        self.val_sampler.wait()
+        sample_outputs = self.sample(self.val_sampler.get_inputs(), preprocess=False)
+        names = self.val_sampler.names
+        for i, latents in enumerate(sample_outputs["latents"]):
+            self.val_sampler.save_meshes(
+                self,
+                latents,
+                [f"it{self.true_global_step}/{name}_{i}.obj" for name in names],
+            )
+
+    def on_fit_end(self):
+        self.val_sampler.shutdown()
 
     def test_step(self, batch, batch_idx):
         return
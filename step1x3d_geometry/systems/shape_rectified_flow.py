@@ -25,9 +25,11 @@ from diffusers.training_utils import (
 )
 from ... import step1x3d_geometry
 from .base import BaseSystem
+from ..models.autoencoders.michelangelo_autoencoder import DiagonalGaussianDistribution
 from ..utils.misc import get_rank
 from ..utils.typing import *
 from .utils import read_image, preprocess_image, flow_sample
+from .validation import ValidationSampler
 
 
 def get_sigmas(noise_scheduler, timesteps, n_dim=4, dtype=torch.float32):
@@ -50,6 +52,7 @@ class RectifiedFlowSystem(BaseSystem):
         bounds: float = 1.05
         mc_level: float = 0.0
         octree_resolution: int = 256
+        val_num_workers: int = 2  # background mesh extraction and saving
 
         # diffusion config
         guidance_scale: float = 7.5
@@ -138,6 +141,12 @@ class RectifiedFlowSystem(BaseSystem):
             self.cfg.denoise_scheduler_type
         )(**self.cfg.denoise_scheduler)
 
+        self.val_sampler = ValidationSampler(
+            self.cfg.val_samples_json,
+            preprocess_image,
+            num_workers=self.cfg.val_num_workers,
+        )
+
         if self.cfg.use_lora:
             from peft import LoraConfig, set_peft_model_state_dict
 
@@ -169,23 +178,31 @@ class RectifiedFlowSystem(BaseSystem):
                 self.denoiser_model.dit_model.add_adapter(self.transformer_lora_config)
 
     def forward(self, batch: Dict[str, Any], skip_noise=False) -> Dict[str, Any]:
-        # 1. encode shape latents
-        if "sharp_surface" in batch.keys():
-            sharp_surface = batch["sharp_surface"][
-                ..., : 3 + self.cfg.shape_model.point_feats
-            ]
+        # 1. encode shape latents, or sample them from the cached posterior
+        if "latent_mean" in batch.keys():
+            posterior = DiagonalGaussianDistribution(
+                [batch["latent_mean"], batch["latent_logvar"]], feat_dim=-1
+            )
+            latents = posterior.sample() * self.shape_model.cfg.z_scale_factor
         else:
-            sharp_surface = None
-        shape_embeds, latents, _ = self.shape_model.encode(
-            batch["surface"][..., : 3 + self.cfg.shape_model.point_feats],
-            sample_posterior=True,
-            sharp_surface=sharp_surface,
-        )
+            if "sharp_surface" in batch.keys():
+                sharp_surface = batch["sharp_surface"][
+                    ..., : 3 + self.cfg.shape_model.point_feats
+                ]
+            else:
+                sharp_surface = None
+            shape_embeds, latents, _ = self.shape_model.encode(
+                batch["surface"][..., : 3 + self.cfg.shape_model.point_feats],
+                sample_posterior=True,
+                sharp_surface=sharp_surface,
+            )
 
         # 2. gain visual condition
         visual_cond = None
         if self.cfg.visual_condition_type is not None:
-            assert "image" in batch.keys(), "image is required for label encoder"
+            assert (
+                "image" in batch.keys() or "image_embeds" in batch.keys()
+            ), "image or image_embeds is required for visual encoder"
             if "image" in batch and batch["image"].dim() == 5:
                 if self.training:
                     bs, n_images = batch["image"].shape[:2]
@@ -314,80 +331,15 @@ class RectifiedFlowSystem(BaseSystem):
             return {}
         self.eval()
 
-        if get_rank() == 0:
-            sample_inputs = json.loads(
-                open(self.cfg.val_samples_json).read()
-            )  # condition
-            sample_inputs_ = copy.deepcopy(sample_inputs)
-            sample_outputs = self.sample(sample_inputs)  # list
-            for i, latents in enumerate(sample_outputs["latents"]):
-                meshes = self.shape_model.extract_geometry(
-                    latents,
-                    bounds=self.cfg.bounds,
-                    mc_level=self.cfg.mc_level,
-                    octree_resolution=self.cfg.octree_resolution,
-                    enable_pbar=False,
-                )
-
-                for j in range(len(meshes)):
-                    name = ""
-                    if "image" in sample_inputs_:
-                        name += (
-                            sample_inputs_["image"][j]
-                            .split("/")[-1]
-                            .replace(".png", "")
-                        )
-
-                    elif "mvimages" in sample_inputs_:
-                        name += (
-                            sample_inputs_["mvimages"][j][0]
-                            .split("/")[-2]
-                            .replace(".png", "")
-                        )
-
-                    if "caption" in sample_inputs_:
-                        name += "_" + sample_inputs_["caption"][j].replace(
-                            " ", "_"
-                        ).replace(".", "")
-
-                    if "label" in sample_inputs_:
-                        name += (
-                            "_"
-                            + sample_inputs_["label"][j]["symmetry"]
-                            + sample_inputs_["label"][j]["edge_type"]
-                        )
-
-                    if (
-                        meshes[j].verts is not None
-                        and meshes[j].verts.shape[0] > 0
-                        and meshes[j].faces is not None
-                        and meshes[j].faces.shape[0] > 0
-                    ):
-                        self.save_mesh(
-                            f"it{self.true_global_step}/{name}_{i}.obj",
-                            meshes[j].verts,
-                            meshes[j].faces,
-                        )
-                        torch.cuda.empty_cache()
-
         out = self(batch)
         if self.global_step == 0:
             latents = self.shape_model.decode(out["latents"])
-            meshes = self.shape_model.extract_geometry(
+            self.val_sampler.save_meshes(
+                self,
                 latents,
-                bounds=self.cfg.bounds,
-                mc_level=self.cfg.mc_level,
-                octree_resolution=self.cfg.octree_resolution,
-                enable_pbar=False,
+                [f"it{self.true_global_step}/{uid}.obj" for uid in batch["uid"]],
             )
 
-            for i, mesh in enumerate(meshes):
-                self.save_mesh(
-                    f"it{self.true_global_step}/{batch['uid'][i]}.obj",
-                    mesh.verts,
-                    mesh.faces,
-                )
-
         return {"val/loss": out["loss_diffusion"]}
 
     @torch.no_grad()
@@ -399,6 +351,7 @@ class RectifiedFlowSystem(BaseSystem):
         guidance_scale: Optional[float] = None,
         eta: float = 0.0,
         seed: Optional[int] = None,
+        preprocess: bool = True,
         **kwargs,
     ):
 
@@ -411,11 +364,14 @@ class RectifiedFlowSystem(BaseSystem):
         # conditional encode
         visal_cond = None
         if "image" in sample_inputs:
-            sample_inputs["image"] = [
-                Image.open(img) if type(img) == str else img
-                for img in sample_inputs["image"]
-            ]
-            sample_inputs["image"] = preprocess_image(sample_inputs["image"], **kwargs)
+            if preprocess:
+                sample_inputs["image"] = [
+                    Image.open(img) if type(img) == str else img
+                    for img in sample_inputs["image"]
+                ]
+                sample_inputs["image"] = preprocess_image(
+                    sample_inputs["image"], **kwargs
+                )
             cond = self.visual_condition.encode_image(sample_inputs["image"])
             if do_classifier_free_guidance:
                 un_cond = self.visual_condition.empty_image_embeds.repeat(
@@ -467,8 +423,23 @@ class RectifiedFlowSystem(BaseSystem):
 
         return {"latents": latents_list, "inputs": sample_inputs}
 
+    @torch.no_grad()
     def on_validation_epoch_end(self):
-        pass
+        if self.cfg.skip_validation or get_rank() != 0:
+            return
+        # meshes of the previous validation are done before new ones are queued
+        self.val_sampler.wait()
+        sample_outputs = self.sample(self.val_sampler.get_inputs(), preprocess=False)
+        names = self.val_sampler.names
+        for i, latents in enumerate(sample_outputs["latents"]):
+            self.val_sampler.save_meshes(
+                self,
+                latents,
+                [f"it{self.true_global_step}/{name}_{i}.obj" for name in names],
+            )
+
+    def on_fit_end(self):
+        self.val_sampler.shutdown()
 
     def test_step(self, batch, batch_idx):
         return
@@ -0,0 +1,130 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from PIL import Image
+
+from ..utils.typing import *
+
+
+def get_sample_names(sample_inputs: Dict[str, Any]) -> List[str]:
+    num_samples = max(len(v) for v in sample_inputs.values())
+    names = [""] * num_samples
+    for j in range(num_samples):
+        if "image" in sample_inputs:
+            names[j] += sample_inputs["image"][j].split("/")[-1].replace(".png", "")
+        elif "mvimages" in sample_inputs:
+            names[j] += (
+                sample_inputs["mvimages"][j][0].split("/")[-2].replace(".png", "")
+            )
+        if "caption" in sample_inputs:
+            names[j] += "_" + sample_inputs["caption"][j].replace(" ", "_").replace(
+                ".", ""
+            )
+        if "label" in sample_inputs:
+            names[j] += (
+                "_"
+                + sample_inputs["label"][j]["symmetry"]
+                + sample_inputs["label"][j]["edge_type"]
+            )
+    return names
+
+
+class ValidationSampler:
+    """
+    Validation conditions of val_samples_json, read and preprocessed once, and
+    a worker pool that extracts and saves the sampled meshes in the background.
+    Grid logits are decoded on the GPU by the caller, so the workers only run
+    the surface extraction and the mesh export.
+    """
+
+    def __init__(
+        self,
+        val_samples_json: str,
+        preprocess_image: Callable,
+        num_workers: int = 2,
+    ) -> None:
+        self.val_samples_json = val_samples_json
+        self.preprocess_image = preprocess_image
+        self.num_workers = num_workers
+        self._inputs = None
+        self._names = None
+        self._executor = None
+        self._futures = []
+
+    def get_inputs(self) -> Dict[str, Any]:
+        """
+        Conditions for sample(..., preprocess=False), images already preprocessed.
+        """
+        if self._inputs is None:
+            with open(self.val_samples_json, "r") as f:
+                inputs = json.load(f)
+            self._names = get_sample_names(inputs)
+            if "image" in inputs:
+                inputs["image"] = self.preprocess_image(
+                    [Image.open(img) for img in inputs["image"]]
+                )
+            self._inputs = inputs
+        return dict(self._inputs)
+
+    @property
+    def names(self) -> List[str]:
+        self.get_inputs()
+        return self._names
+
+    @torch.no_grad()
+    def save_meshes(self, system, latents: torch.FloatTensor, filenames: List[str]):
+        """
+        Decode the grid logits of latents and extract and save one mesh per
+        latent as filenames[i] in the background. Empty meshes are skipped.
+        """
+        shape_model = system.shape_model
+        kwargs = dict(
+            bounds=system.cfg.bounds,
+            mc_level=system.cfg.mc_level,
+            octree_resolution=system.cfg.octree_resolution,
+            enable_pbar=False,
+        )
+        grid_logits = shape_model.decode_grid_logits(latents, **kwargs)
+        if shape_model.cfg.surface_extractor_type == "mc":
+            # marching cubes runs on numpy, free the GPU right away
+            grid_logits = grid_logits.cpu()
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.num_workers)
+        self._futures = [f for f in self._futures if not f.done()]
+        for i, filename in enumerate(filenames):
+            self._futures.append(
+                self._executor.submit(
+                    self._extract_and_save,
+                    system,
+                    grid_logits[i : i + 1],
+                    filename,
+                    kwargs,
+                )
+            )
+
+    @staticmethod
+    def _extract_and_save(system, grid_logits, filename, kwargs):
+        try:
+            mesh = system.shape_model.extract_surfaces(grid_logits, **kwargs)[0]
+            if (
+                mesh.verts is not None
+                and mesh.verts.shape[0] > 0
+                and mesh.faces is not None
+                and mesh.faces.shape[0] > 0
+            ):
+                system.save_mesh(filename, mesh.verts, mesh.faces)
+        except Exception as e:
+            print(f"Error in {filename}: {e}")
+
+    def wait(self) -> None:
+        for future in self._futures:
+            future.result()
+        self._futures = []
+
+    def shutdown(self) -> None:
+        self.wait()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
@@ -6,6 +6,7 @@ import torch
 import os
 import os.path
 import warnings
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import pytorch_lightning as pl
 from torch import Tensor
@@ -17,12 +18,18 @@ from pytorch_lightning.utilities.types import STEP_OUTPUT
 
 from typing import Any, Dict, List, Optional
 
-try:
-    import amp_C
 
-    apex_available = True
-except Exception:
-    apex_available = False
+def ema_update_(
+    ema_weights: List[torch.Tensor], model_weights: List[torch.Tensor], decay: float
+) -> None:
+    """
+    ema = decay * ema + (1 - decay) * model, fused over lists of float tensors.
+    """
+    if hasattr(torch, "_foreach_lerp_"):
+        torch._foreach_lerp_(ema_weights, model_weights, 1.0 - decay)
+    else:
+        torch._foreach_mul_(ema_weights, decay)
+        torch._foreach_add_(ema_weights, model_weights, alpha=1.0 - decay)
 
 
 class EMA(Callback):
@@ -38,6 +45,8 @@ class EMA(Callback):
         save_ema_weights_in_callback_state: Enable saving EMA weights in callback state.
         evaluate_ema_weights_instead: Validate the EMA weights instead of the original weights.
             Note this means that when saving the model, the validation metrics are calculated with the EMA weights.
+        cpu_offload: Keep the EMA weights in pinned CPU memory. The weights are copied asynchronously
+            after each update and averaged in a background thread, so training is not blocked.
 
     Adapted from: https://github.com/NVIDIA/NeMo/blob/main/nemo/collections/common/callbacks/ema.py
     """
@@ -50,21 +59,24 @@ class EMA(Callback):
         # else .ckpt will save a model weights copy in key 'callback'
         save_ema_weights_in_callback_state: bool = False,
         evaluate_ema_weights_instead: bool = True,
+        cpu_offload: bool = False,
     ):
-        if not apex_available:
-            rank_zero_warn(
-                "EMA has better performance when Apex is installed: https://github.com/NVIDIA/apex#installation."
-            )
         if not (0 <= decay <= 1):
             raise MisconfigurationException("EMA decay value must be between 0 and 1")
         self._ema_model_weights: Optional[List[torch.Tensor]] = None
-        self._overflow_buf: Optional[torch.Tensor] = None
+        # float tensors of the model and their EMA / staging copies, collected once
+        self._model_float_weights: Optional[List[torch.Tensor]] = None
+        self._ema_float_weights: Optional[List[torch.Tensor]] = None
+        self._staging_weights: Optional[List[torch.Tensor]] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending_update: Optional[Future] = None
         self._cur_step: Optional[int] = None
         self._weights_buffer: Optional[List[torch.Tensor]] = None
         self.apply_ema_every_n_steps = apply_ema_every_n_steps
         self.start_step = start_step
         self.save_ema_weights_in_callback_state = save_ema_weights_in_callback_state
         self.evaluate_ema_weights_instead = evaluate_ema_weights_instead
+        self.cpu_offload = cpu_offload
         self.decay = decay
 
     def on_train_start(
@@ -76,39 +88,71 @@ class EMA(Callback):
                 p.detach().clone() for p in pl_module.state_dict().values()
             ]
         # ensure that all the weights are on the correct device
+        pin_memory = self.cpu_offload and pl_module.device.type == "cuda"
         self._ema_model_weights = [
-            p.to(pl_module.device) for p in self._ema_model_weights
+            p.to("cpu" if self.cpu_offload else pl_module.device)
+            for p in self._ema_model_weights
         ]
-        self._overflow_buf = torch.IntTensor([0]).to(pl_module.device)
+        if pin_memory:
+            self._ema_model_weights = [p.pin_memory() for p in self._ema_model_weights]
+        self.cache_weights(pl_module, pin_memory)
+
+    def cache_weights(
+        self, pl_module: "pl.LightningModule", pin_memory: bool = False
+    ) -> None:
+        # state_dict tensors share storage with the parameters and buffers, which the
+        # optimizer updates in place, so the lists stay valid for the whole training
+        model_weights = list(pl_module.state_dict().values())
+        float_ids = [
+            i
+            for i, (orig_weight, ema_weight) in enumerate(
+                zip(model_weights, self._ema_model_weights)
+            )
+            # ensure that non-float buffers (e.g., step counters) are not averaged
+            if orig_weight.is_floating_point() and ema_weight.is_floating_point()
+        ]
+        self._model_float_weights = [model_weights[i] for i in float_ids]
+        self._ema_float_weights = [self._ema_model_weights[i] for i in float_ids]
+        if self.cpu_offload:
+            self._staging_weights = [
+                torch.empty(p.shape, dtype=p.dtype, pin_memory=pin_memory)
+                for p in self._ema_float_weights
+            ]
 
     def ema(self, pl_module: "pl.LightningModule") -> None:
-        if apex_available and pl_module.device.type == "cuda":
-            return self.apply_multi_tensor_ema(pl_module)
+        if self.cpu_offload:
+            return self.apply_offloaded_ema(pl_module)
         return self.apply_ema(pl_module)
 
-    def apply_multi_tensor_ema(self, pl_module: "pl.LightningModule") -> None:
-        model_weights = list(pl_module.state_dict().values())
-        amp_C.multi_tensor_axpby(
-            65536,
-            self._overflow_buf,
-            [self._ema_model_weights, model_weights, self._ema_model_weights],
-            self.decay,
-            1 - self.decay,
-            -1,
-        )
-
     def apply_ema(self, pl_module: "pl.LightningModule") -> None:
-        for orig_weight, ema_weight in zip(
-            list(pl_module.state_dict().values()), self._ema_model_weights
+        ema_update_(self._ema_float_weights, self._model_float_weights, self.decay)
+
+    def apply_offloaded_ema(self, pl_module: "pl.LightningModule") -> None:
+        # the staging buffers are reused, so the previous update has to be done
+        self.wait_for_ema()
+        for staging_weight, orig_weight in zip(
+            self._staging_weights, self._model_float_weights
         ):
-            if (
-                ema_weight.data.dtype != torch.long
-                and orig_weight.data.dtype != torch.long
-            ):
-                # ensure that non-trainable parameters (e.g., feature distributions) are not included in EMA weight averaging
-                diff = ema_weight.data - orig_weight.data
-                diff.mul_(1.0 - self.decay)
-                ema_weight.sub_(diff)
+            staging_weight.copy_(orig_weight, non_blocking=True)
+        copy_done = None
+        if pl_module.device.type == "cuda":
+            copy_done = torch.cuda.Event()
+            copy_done.record()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending_update = self._executor.submit(
+            self._update_from_staging, copy_done
+        )
+
+    def _update_from_staging(self, copy_done: Optional[torch.cuda.Event]) -> None:
+        if copy_done is not None:
+            copy_done.synchronize()
+        ema_update_(self._ema_float_weights, self._staging_weights, self.decay)
+
+    def wait_for_ema(self) -> None:
+        if self._pending_update is not None:
+            self._pending_update.result()
+            self._pending_update = None
 
     def should_apply_ema(self, step: int) -> bool:
         return (
@@ -129,8 +173,14 @@ class EMA(Callback):
             self._cur_step = trainer.global_step
             self.ema(pl_module)
 
+    def on_train_end(
+        self, trainer: "pl.Trainer", pl_module: "pl.LightningModule"
+    ) -> None:
+        self.wait_for_ema()
+
     def state_dict(self) -> Dict[str, Any]:
         if self.save_ema_weights_in_callback_state:
+            self.wait_for_ema()
             return dict(cur_step=self._cur_step, ema_weights=self._ema_model_weights)
         return dict(cur_step=self._cur_step)
 
@@ -173,6 +223,7 @@ class EMA(Callback):
                 )
 
     def replace_model_weights(self, pl_module: "pl.LightningModule") -> None:
+        self.wait_for_ema()
         self._weights_buffer = [
             p.detach().clone().to("cpu") for p in pl_module.state_dict().values()
         ]
@@ -303,3 +354,45 @@ class EMAModelCheckpoint(ModelCheckpoint):
                 trainer,
                 del_filepath.replace(self.FILE_EXTENSION, f"-EMA{self.FILE_EXTENSION}"),
             )
+
+
+if __name__ == "__main__":
+    # throughput of the fused update against the per-tensor loop it replaces:
+    # python -m <package>.step1x3d_geometry.utils.ema --num_tensors 800
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_tensors", type=int, default=800)
+    parser.add_argument("--tensor_size", type=int, default=1 << 20)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--device", type=str, default="cuda")
+    args = parser.parse_args()
+
+    decay = 0.999
+    model_weights = [
+        torch.randn(args.tensor_size, device=args.device)
+        for _ in range(args.num_tensors)
+    ]
+    ema_weights = [w.clone() for w in model_weights]
+
+    def loop_update():
+        for orig_weight, ema_weight in zip(model_weights, ema_weights):
+            diff = ema_weight.data - orig_weight.data
+            diff.mul_(1.0 - decay)
+            ema_weight.sub_(diff)
+
+    def foreach_update():
+        ema_update_(ema_weights, model_weights, decay)
+
+    for name, update in [("loop", loop_update), ("foreach", foreach_update)]:
+        update()
+        if args.device.startswith("cuda"):
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            update()
+        if args.device.startswith("cuda"):
+            torch.cuda.synchronize()
+        elapsed = (time.perf_counter() - start) / args.steps
+        print(f"{name}: {elapsed * 1000:.2f} ms/update")
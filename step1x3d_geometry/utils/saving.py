@@ -16,10 +16,11 @@ from matplotlib.colors import LinearSegmentedColormap
 from PIL import Image, ImageDraw
 from pytorch_lightning.loggers import WandbLogger
 
+from .async_saving import AsyncSaverMixin
 from .typing import *
 
 
-class SaverMixin:
+class SaverMixin(AsyncSaverMixin):
     _save_dir: Optional[str] = None
     _wandb_logger: Optional[WandbLogger] = None
 
@@ -139,7 +140,9 @@ class SaverMixin:
         step: Optional[int] = None,
     ) -> str:
         save_path = self.get_save_path(filename)
-        self._save_rgb_image(save_path, img, data_format, data_range, name, step)
+        self._submit_save(
+            self._save_rgb_image, save_path, img, data_format, data_range, name, step
+        )
         return save_path
 
     def get_uv_image_(self, img, data_format, data_range, cmap):
@@ -174,9 +177,14 @@ class SaverMixin:
         cmap=DEFAULT_UV_KWARGS["cmap"],
     ) -> str:
         save_path = self.get_save_path(filename)
+        self._submit_save(
+            self._save_uv_image, save_path, img, data_format, data_range, cmap
+        )
+        return save_path
+
+    def _save_uv_image(self, save_path, img, data_format, data_range, cmap):
         img = self.get_uv_image_(img, data_format, data_range, cmap)
         cv2.imwrite(save_path, img)
-        return save_path
 
     def get_grayscale_image_(self, img, data_range, cmap):
         img = self.convert_data(img)
@@ -251,7 +259,9 @@ class SaverMixin:
         step: Optional[int] = None,
     ) -> str:
         save_path = self.get_save_path(filename)
-        self._save_grayscale_image(save_path, img, data_range, cmap, name, step)
+        self._submit_save(
+            self._save_grayscale_image, save_path, img, data_range, cmap, name, step
+        )
         return save_path
 
     def get_image_grid_(self, imgs, align):
@@ -310,6 +320,12 @@ class SaverMixin:
         texts: Optional[List[float]] = None,
     ):
         save_path = self.get_save_path(filename)
+        self._submit_save(
+            self._save_image_grid, save_path, imgs, align, name, step, texts
+        )
+        return save_path
+
+    def _save_image_grid(self, save_path, imgs, align, name, step, texts):
         img = self.get_image_grid_(imgs, align=align)
 
         if texts is not None:
@@ -327,10 +343,13 @@ class SaverMixin:
         cv2.imwrite(save_path, img)
         if name and self._wandb_logger:
             wandb.log({name: wandb.Image(save_path), "trainer/global_step": step})
-        return save_path
 
     def save_image(self, filename, img) -> str:
         save_path = self.get_save_path(filename)
+        self._submit_save(self._save_image, save_path, img)
+        return save_path
+
+    def _save_image(self, save_path, img):
         img = self.convert_data(img)
         assert img.dtype == np.uint8 or img.dtype == np.uint16
         if img.ndim == 3 and img.shape[-1] == 3:
@@ -338,7 +357,6 @@ class SaverMixin:
         elif img.ndim == 3 and img.shape[-1] == 4:
             img = cv2.cvtColor(img, cv2.COLOR_RGBA2BGRA)
         cv2.imwrite(save_path, img)
-        return save_path
 
     def save_image_vutils(self, filename, img) -> str:
         save_path = self.get_save_path(filename)
@@ -347,6 +365,10 @@ class SaverMixin:
 
     def save_cubemap(self, filename, img, data_range=(0, 1), rgba=False) -> str:
         save_path = self.get_save_path(filename)
+        self._submit_save(self._save_cubemap, save_path, img, data_range, rgba)
+        return save_path
+
+    def _save_cubemap(self, save_path, img, data_range, rgba):
         img = self.convert_data(img)
         assert img.ndim == 4 and img.shape[0] == 6 and img.shape[1] == img.shape[2]
 
@@ -378,27 +400,33 @@ class SaverMixin:
 
         imgs_full = np.concatenate(imgs_full, axis=1)
         cv2.imwrite(save_path, imgs_full)
-        return save_path
 
     def save_data(self, filename, data) -> str:
-        data = self.convert_data(data)
         if isinstance(data, dict):
             if not filename.endswith(".npz"):
                 filename += ".npz"
-            save_path = self.get_save_path(filename)
-            np.savez(save_path, **data)
         else:
             if not filename.endswith(".npy"):
                 filename += ".npy"
-            save_path = self.get_save_path(filename)
-            np.save(save_path, data)
+        save_path = self.get_save_path(filename)
+        self._submit_save(self._save_data, save_path, data)
         return save_path
 
+    def _save_data(self, save_path, data):
+        data = self.convert_data(data)
+        if isinstance(data, dict):
+            np.savez(save_path, **data)
+        else:
+            np.save(save_path, data)
+
     def save_state_dict(self, filename, data) -> str:
         save_path = self.get_save_path(filename)
-        torch.save(data, save_path)
+        self._submit_save(self._save_state_dict, save_path, data)
         return save_path
 
+    def _save_state_dict(self, save_path, data):
+        torch.save(data, save_path)
+
     def save_img_sequence(
         self,
         filename,
@@ -413,6 +441,7 @@ class SaverMixin:
         if not filename.endswith(save_format):
             filename += f".{save_format}"
         save_path = self.get_save_path(filename)
+        self.flush_saves()
         matcher = re.compile(matcher)
         img_dir = os.path.join(self.get_save_dir(), img_dir)
         imgs = []
@@ -439,11 +468,14 @@ class SaverMixin:
 
     def save_mesh(self, filename, v_pos, t_pos_idx, v_tex=None, t_tex_idx=None) -> str:
         save_path = self.get_save_path(filename)
+        self._submit_save(self._save_mesh, save_path, v_pos, t_pos_idx)
+        return save_path
+
+    def _save_mesh(self, save_path, v_pos, t_pos_idx):
         v_pos = self.convert_data(v_pos)
         t_pos_idx = self.convert_data(t_pos_idx)
         mesh = trimesh.Trimesh(vertices=v_pos, faces=t_pos_idx)
         mesh.export(save_path)
-        return save_path
 
     def save_file(self, filename, src_path) -> str:
         save_path = self.get_save_path(filename)
@@ -452,12 +484,18 @@ class SaverMixin:
 
     def save_txt(self, filename, comment) -> str:
         save_path = self.get_save_path(filename)
+        self._submit_save(self._save_txt, save_path, comment)
+        return save_path
+
+    def _save_txt(self, save_path, comment):
         with open(save_path, "w") as f:
             f.write(comment)
-        return save_path
 
     def save_json(self, filename, payload) -> str:
         save_path = self.get_save_path(filename)
+        self._submit_save(self._save_json, save_path, payload)
+        return save_path
+
+    def _save_json(self, save_path, payload):
         with open(save_path, "w") as f:
             f.write(json.dumps(payload))
-        return save_path
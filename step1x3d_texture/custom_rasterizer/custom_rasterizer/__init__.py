@@ -19,4 +19,5 @@ from .render import rasterize, interpolate
 """
 from .io_glb import *
 from .io_obj import *
+from .io_fast import *
 from .render import *
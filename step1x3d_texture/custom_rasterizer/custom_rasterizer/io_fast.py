@@ -0,0 +1,397 @@
+# Hunyuan 3D is licensed under the TENCENT HUNYUAN NON-COMMERCIAL LICENSE AGREEMENT
+# except for the third-party components listed below.
+# Hunyuan 3D does not impose any additional limitations beyond what is outlined
+# in the repsective licenses of these third-party components.
+# Users must comply with all terms and conditions of original licenses of these third-party
+# components and must ensure that the usage of the third party components adheres to
+# all relevant laws and regulations.
+
+# For avoidance of doubts, Hunyuan 3D means the large language models and
+# their software and algorithms, including trained model weights, parameters (including
+# optimizer states), machine-learning model code, inference-enabling code, training-enabling code,
+# fine-tuning enabling code and other elements of the foregoing made publicly available
+# by Tencent in accordance with TENCENT HUNYUAN COMMUNITY LICENSE AGREEMENT.
+
+# Vectorized counterparts of io_obj.LoadObj / LoadObjWithTexture and io_glb.LoadGlb
+# with the same return values. OBJ records are converted block-wise with NumPy,
+# GLB accessors are zero-copy views over the memory-mapped file and textures are
+# only decoded when they are accessed.
+
+import base64
+import io
+import json
+import os
+import struct
+from collections.abc import Mapping
+
+import cv2
+import numpy as np
+from PIL import Image as PILImage
+from scipy.spatial.transform import Rotation as R
+
+
+def _obj_records(fn, prefixes):
+    with open(fn, "rb") as f:
+        lines = f.read().split(b"\n")
+    records = {prefix: [] for prefix in prefixes}
+    for l in lines:
+        l = l.strip()
+        head = l[:3]
+        for prefix in prefixes:
+            if head.startswith(prefix + b" "):
+                records[prefix].append(l[len(prefix) + 1 :])
+                break
+    return records
+
+
+def _parse_block(records, dtype, num_columns=None):
+    # one conversion per group of records sharing the same number of components,
+    # rows keep the order of the file. With num_columns, only the first
+    # components of every record are kept, as io_obj.LoadObj does, otherwise
+    # all records must have the same number of components.
+    if len(records) == 0:
+        return np.zeros((0, num_columns or 0), dtype=dtype)
+    num_tokens = np.array([len(r.split()) for r in records], dtype=np.int64)
+    counts = np.unique(num_tokens)
+    if num_columns is None:
+        if len(counts) > 1:
+            raise ValueError(
+                f"Records with different numbers of components {counts.tolist()}"
+            )
+        num_columns = counts[0]
+    if counts[0] < num_columns:
+        raise ValueError(f"Records with less than {num_columns} components")
+    if len(counts) == 1:
+        values = np.fromstring(b" ".join(records), dtype=dtype, sep=" ")
+        return values.reshape(len(records), -1)[:, :num_columns]
+    values = np.zeros((len(records), num_columns), dtype=dtype)
+    for k in counts:
+        lines = np.nonzero(num_tokens == k)[0]
+        block = b" ".join(records[i] for i in lines)
+        block = np.fromstring(block, dtype=dtype, sep=" ")
+        values[lines] = block.reshape(len(lines), k)[:, :num_columns]
+    return values
+
+
+def _corner_fields(face_records, components):
+    # the first components indices of every face corner, split on "/" so that
+    # the empty texture index of "v//vn" is not read as the normal index
+    fields = [
+        corner.split(b"/")[:components]
+        for record in face_records
+        for corner in record.split()
+    ]
+    if any(len(field) < components or not all(field) for field in fields):
+        raise ValueError(f"Face corners with less than {components} indices")
+    return np.fromstring(
+        b" ".join(b" ".join(field) for field in fields), dtype=np.int64, sep=" "
+    )
+
+
+def _fan_triangulate(face_records, components):
+    # polygons are split into fans, faces keep the order of the file
+    num_corners = np.array([len(r.split()) for r in face_records], dtype=np.int64)
+    num_triangles = np.maximum(num_corners - 2, 0)
+    offsets = np.concatenate([[0], np.cumsum(num_triangles)[:-1]])
+    triangles = np.zeros((num_triangles.sum(), 3, components), dtype=np.int64)
+    for k in np.unique(num_corners):
+        if k < 3:
+            continue
+        lines = np.nonzero(num_corners == k)[0]
+        corners = _corner_fields([face_records[i] for i in lines], components)
+        corners = corners.reshape(len(lines), k, components)
+        i = np.arange(2, k)
+        fan = np.stack(
+            [np.zeros_like(i), i - 1, i], axis=-1
+        )  # [k - 2, 3] corner ids of the fan
+        rows = offsets[lines][:, None] + np.arange(k - 2)[None]
+        triangles[rows.reshape(-1)] = corners[:, fan].reshape(-1, 3, components)
+    return triangles - 1
+
+
+def LoadObjFast(fn):
+    records = _obj_records(fn, [b"v", b"f"])
+    vertices = _parse_block(records[b"v"], np.float32, 3)
+    # only the vertex index of "v/vt/vn" corners
+    face_records = [
+        b" ".join(corner.split(b"/", 1)[0] for corner in record.split())
+        for record in records[b"f"]
+    ]
+    faces = _parse_block(face_records, np.int64, 3) - 1
+    return vertices.astype("float32"), faces.astype("int32")
+
+
+def LoadObjWithTextureFast(fn, tex_fn, load_texture=True):
+    records = _obj_records(fn, [b"vt", b"v", b"f"])
+    vertices = _parse_block(records[b"v"], np.float32)
+    vertex_textures = _parse_block(records[b"vt"], np.float32)
+    triangles = _fan_triangulate(records[b"f"], 2)
+    faces = triangles[..., 0]
+    face_textures = triangles[..., 1]
+
+    tex_image = None
+    if load_texture:
+        tex_image = cv2.cvtColor(cv2.imread(tex_fn), cv2.COLOR_BGR2RGB)
+    return (
+        vertices.astype("float32"),
+        vertex_textures.astype("float32"),
+        faces.astype("int32"),
+        face_textures.astype("int32"),
+        tex_image,
+    )
+
+
+class LazyImages(Mapping):
+    """
+    image index -> PIL image, decoded on first access
+    """
+
+    def __init__(self):
+        self._sources = {}
+        self._images = {}
+
+    def add(self, image_index, load_fn):
+        self._sources.setdefault(image_index, load_fn)
+
+    def __getitem__(self, image_index):
+        if image_index not in self._images:
+            image_data = self._sources[image_index]()
+            pil_image = PILImage.open(io.BytesIO(image_data))
+            if pil_image.mode != "RGB":
+                pil_image = pil_image.convert("RGB")
+            self._images[image_index] = pil_image
+        return self._images[image_index]
+
+    def __iter__(self):
+        return iter(self._sources)
+
+    def __len__(self):
+        return len(self._sources)
+
+
+class _GlbFile:
+    COMPONENT_TYPES = {
+        5120: np.int8,
+        5121: np.uint8,
+        5122: np.int16,
+        5123: np.uint16,
+        5125: np.uint32,
+        5126: np.float32,
+    }
+    NUM_COMPONENTS = {
+        "SCALAR": 1,
+        "VEC2": 2,
+        "VEC3": 3,
+        "VEC4": 4,
+        "MAT2": 4,
+        "MAT3": 9,
+        "MAT4": 16,
+    }
+
+    def __init__(self, path):
+        self.folder = os.path.dirname(path)
+        self.data = np.memmap(path, dtype=np.uint8, mode="r")
+        magic, version, length = struct.unpack_from("<4sII", self.data, 0)
+        if magic != b"glTF":
+            raise ValueError(f"{path} is not a binary glTF file")
+
+        # chunks: JSON first, optional BIN second
+        self.bin_chunk = None
+        offset = 12
+        while offset < length:
+            chunk_length, chunk_type = struct.unpack_from("<I4s", self.data, offset)
+            chunk = self.data[offset + 8 : offset + 8 + chunk_length]
+            if chunk_type == b"JSON":
+                self.gltf = json.loads(bytes(chunk))
+            elif chunk_type == b"BIN\x00":
+                self.bin_chunk = chunk
+            offset += 8 + chunk_length
+        self.buffers = {}
+
+    def get_buffer(self, buffer_index):
+        if buffer_index not in self.buffers:
+            uri = self.gltf["buffers"][buffer_index].get("uri")
+            if uri is None:
+                buffer = self.bin_chunk
+            elif uri.startswith("data:"):
+                buffer = np.frombuffer(
+                    base64.b64decode(uri.split(",", 1)[1]), dtype=np.uint8
+                )
+            else:
+                fn = uri if os.path.isabs(uri) else self.folder + "/" + uri
+                buffer = np.memmap(fn, dtype=np.uint8, mode="r")
+            self.buffers[buffer_index] = buffer
+        return self.buffers[buffer_index]
+
+    def get_buffer_view(self, buffer_view_index):
+        buffer_view = self.gltf["bufferViews"][buffer_view_index]
+        buffer = self.get_buffer(buffer_view["buffer"])
+        byte_offset = buffer_view.get("byteOffset", 0)
+        return buffer[byte_offset : byte_offset + buffer_view["byteLength"]]
+
+    def get_attribute_data(self, accessor_index):
+        accessor = self.gltf["accessors"][accessor_index]
+        buffer_view = self.gltf["bufferViews"][accessor["bufferView"]]
+        buffer_data = self.get_buffer_view(accessor["bufferView"])
+
+        dtype = np.dtype(self.COMPONENT_TYPES[accessor["componentType"]])
+        num_components = self.NUM_COMPONENTS[accessor["type"]]
+        byte_stride = buffer_view.get("byteStride") or num_components * dtype.itemsize
+
+        # strided view over the mapped bytes, no copy
+        return np.ndarray(
+            shape=(accessor["count"], num_components),
+            dtype=dtype,
+            buffer=buffer_data,
+            offset=accessor.get("byteOffset", 0),
+            strides=(byte_stride, dtype.itemsize),
+        )
+
+    def get_image_data(self, image_index):
+        image = self.gltf["images"][image_index]
+        uri = image.get("uri")
+        if uri:
+            if uri.startswith("data:"):
+                return base64.b64decode(uri.split(",", 1)[1])
+            fn = uri if os.path.isabs(uri) else self.folder + "/" + uri
+            with open(fn, "rb") as f:
+                return f.read()
+        return bytes(self.get_buffer_view(image["bufferView"]))
+
+    def get_node_transform(self, node):
+        if node.get("matrix"):
+            return np.array(node["matrix"]).reshape(4, 4).T
+        T = np.eye(4)
+        if node.get("translation"):
+            T[:3, 3] = node["translation"]
+        if node.get("rotation"):
+            T[:3, :3] = R.from_quat(node["rotation"]).as_matrix()
+        if node.get("scale"):
+            T = T @ np.diag(list(node["scale"]) + [1])
+        return T
+
+    def get_world_transforms(self):
+        nodes = self.gltf.get("nodes", [])
+        parents = [-1 for _ in nodes]
+        for node_index, node in enumerate(nodes):
+            for idx in node.get("children", []):
+                parents[idx] = node_index
+
+        world_transforms = [None for _ in nodes]
+
+        def world_transform(node_index):
+            if world_transforms[node_index] is None:
+                transform = self.get_node_transform(nodes[node_index])
+                if parents[node_index] != -1:
+                    transform = world_transform(parents[node_index]) @ transform
+                world_transforms[node_index] = transform
+            return world_transforms[node_index]
+
+        return [world_transform(i) for i in range(len(nodes))]
+
+
+def _strip_to_triangles(indices):
+    i = np.arange(len(indices) - 2)
+    odd = i % 2 == 1
+    triangles = np.stack([i, i + 1, i + 2], axis=-1)
+    triangles[odd] = triangles[odd][:, [0, 2, 1]]
+    return indices[triangles]
+
+
+def _fan_to_triangles(indices):
+    i = np.arange(1, len(indices) - 1)
+    return indices[np.stack([np.zeros_like(i), i, i + 1], axis=-1)]
+
+
+def LoadGlbFast(path):
+    glb = _GlbFile(path)
+    gltf = glb.gltf
+
+    primitives = []
+    images = LazyImages()
+    world_transforms = glb.get_world_transforms()
+
+    def texture_image_index(texture_info):
+        image_index = gltf["textures"][texture_info["index"]]["source"]
+        images.add(image_index, lambda: glb.get_image_data(image_index))
+        return image_index
+
+    for node_index, node in enumerate(gltf.get("nodes", [])):
+        if node.get("mesh") is None:
+            continue
+        world_transform = world_transforms[node_index]
+        mesh = gltf["meshes"][node["mesh"]]
+        for primitive in mesh["primitives"]:
+            attributes = primitive.get("attributes", {})
+            mode = primitive.get("mode", 4)  # Default to TRIANGLES
+            result = {}
+            if primitive.get("indices") is not None:
+                indices = glb.get_attribute_data(primitive["indices"]).reshape(-1)
+                if mode == 4:  # TRIANGLES
+                    face_indices = indices.reshape(-1, 3)
+                elif mode == 5:  # TRIANGLE_STRIP
+                    face_indices = _strip_to_triangles(indices)
+                elif mode == 6:  # TRIANGLE_FAN
+                    face_indices = _fan_to_triangles(indices)
+                else:
+                    continue
+                result["F"] = face_indices
+
+            if attributes.get("POSITION") is not None:
+                positions = glb.get_attribute_data(attributes["POSITION"])
+                result["V"] = (
+                    positions @ world_transform[:3, :3].T + world_transform[:3, 3]
+                )
+
+            if attributes.get("COLOR_0") is not None:
+                colors = glb.get_attribute_data(attributes["COLOR_0"])
+                result["VC"] = colors[..., :3]
+
+            if attributes.get("TEXCOORD_0") is not None:
+                result["UV"] = glb.get_attribute_data(attributes["TEXCOORD_0"])
+
+            if primitive.get("material") is not None:
+                material = gltf["materials"][primitive["material"]]
+                pbr = material.get("pbrMetallicRoughness")
+                if pbr is not None and pbr.get("baseColorTexture") is not None:
+                    result["TEX"] = texture_image_index(pbr["baseColorTexture"])
+                elif material.get("emissiveTexture") is not None:
+                    result["TEX"] = texture_image_index(material["emissiveTexture"])
+                elif pbr is not None:
+                    result["MC"] = pbr.get("baseColorFactor", [1.0, 1.0, 1.0, 1.0])
+                else:
+                    result["MC"] = np.array([0.8, 0.8, 0.8], dtype=np.float32)
+
+            primitives.append(result)
+
+    return primitives, images
+
+
+if __name__ == "__main__":
+    # compare against the reference loaders:
+    # python -m custom_rasterizer.io_fast mesh.obj|mesh.glb [texture.png]
+    import sys
+    import time
+
+    from .io_glb import LoadGlb
+    from .io_obj import LoadObj, LoadObjWithTexture
+
+    path = sys.argv[1]
+    if path.endswith(".glb"):
+        loaders = [("LoadGlb", LoadGlb, (path,)), ("LoadGlbFast", LoadGlbFast, (path,))]
+    elif len(sys.argv) > 2:
+        loaders = [
+            ("LoadObjWithTexture", LoadObjWithTexture, (path, sys.argv[2])),
+            ("LoadObjWithTextureFast", LoadObjWithTextureFast, (path, sys.argv[2])),
+        ]
+    else:
+        loaders = [("LoadObj", LoadObj, (path,)), ("LoadObjFast", LoadObjFast, (path,))]
+
+    outputs = []
+    for name, loader, args in loaders:
+        start = time.perf_counter()
+        outputs.append(loader(*args))
+        print(f"{name}: {time.perf_counter() - start:.3f}s")
+    if not path.endswith(".glb"):
+        for expected, value in zip(*outputs):
+            assert np.array_equal(expected, value), "OBJ loaders differ"
@@ -12,6 +12,9 @@
 # fine-tuning enabling code and other elements of the foregoing made publicly available
 # by Tencent in accordance with TENCENT HUNYUAN COMMUNITY LICENSE AGREEMENT.
 
+import argparse
+import time
+
 import custom_rasterizer_kernel
 import torch
 
@@ -24,9 +27,82 @@ def rasterize(pos, tri, resolution, clamp_depth=torch.zeros(0), use_depth_prior=
     return findices, barycentric
 
 
+def rasterize_batch(pos, tri, resolution, clamp_depth=torch.zeros(0), use_depth_prior=0):
+    """
+    Rasterize V views of one mesh in a single call.
+    pos: [V, N, 4] clip space positions sharing the triangles tri [F, 3]
+    clamp_depth: [V, H, W] when use_depth_prior is set
+    return: findices [V, H, W], barycentric [V, H, W, 3]
+    """
+    assert pos.device == tri.device
+    findices, barycentric = custom_rasterizer_kernel.rasterize_image_batch(
+        pos, tri, clamp_depth, resolution[1], resolution[0], 1e-6, use_depth_prior
+    )
+    return findices, barycentric
+
+
 def interpolate(col, findices, barycentric, tri):
     f = findices - 1 + (findices == 0)
     vcol = col[0, tri.long()[f.long()]]
     result = barycentric.view(*barycentric.shape, 1) * vcol
     result = torch.sum(result, axis=-2)
     return result.view(1, *result.shape)
+
+
+def random_triangle_soup(num_faces, generator=None):
+    """
+    num_faces random triangles in clip space, sized so that they cover the
+    screen a few times over whatever their number, as [1, 3F, 4] and [F, 3].
+    """
+    size = 4.0 / num_faces**0.5
+    centers = torch.rand(num_faces, 1, 2, generator=generator) * 2 - 1
+    offsets = (torch.rand(num_faces, 3, 2, generator=generator) - 0.5) * size
+    xy = (centers + offsets).view(-1, 2)
+    z = torch.rand(num_faces, 1, 1, generator=generator).expand(-1, 3, 1)
+    pos = torch.cat([xy, z.reshape(-1, 1) * 2 - 1, torch.ones_like(xy[:, :1])], dim=1)
+    tri = torch.arange(3 * num_faces, dtype=torch.int32).view(num_faces, 3)
+    return pos[None].contiguous(), tri
+
+
+if __name__ == "__main__":
+    # python -m <package>.step1x3d_texture.custom_rasterizer.custom_rasterizer.render
+    # parity and faces x resolution scaling of the tiled cpu rasterizer against the
+    # single-threaded one
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--num_faces", type=int, nargs="+", default=[1000, 10000, 100000, 1000000]
+    )
+    parser.add_argument("--resolutions", type=int, nargs="+", default=[512, 1024, 2048])
+    parser.add_argument("--num_iters", type=int, default=3)
+    args = parser.parse_args()
+
+    def best_of(fn):
+        seconds = []
+        for _ in range(args.num_iters):
+            start = time.perf_counter()
+            out = fn()
+            seconds.append(time.perf_counter() - start)
+        return min(seconds), out
+
+    generator = torch.Generator().manual_seed(0)
+    print(f"{torch.get_num_threads()} threads")
+    for num_faces in args.num_faces:
+        pos, tri = random_triangle_soup(num_faces, generator)
+        for resolution in args.resolutions:
+            serial_seconds, (serial_findices, serial_barycentric) = best_of(
+                lambda: custom_rasterizer_kernel.rasterize_image_cpu_serial(
+                    pos[0], tri, torch.zeros(0), resolution, resolution, 1e-6, 0
+                )
+            )
+            tiled_seconds, (findices, barycentric) = best_of(
+                lambda: rasterize(pos, tri, (resolution, resolution))
+            )
+            assert torch.equal(findices, serial_findices), "findices differ"
+            assert torch.equal(barycentric, serial_barycentric), "barycentrics differ"
+            print(
+                f"{num_faces} faces {resolution}x{resolution}: "
+                f"serial {serial_seconds * 1000:.1f} ms, "
+                f"tiled {tiled_seconds * 1000:.1f} ms, "
+                f"{serial_seconds / tiled_seconds:.1f}x"
+            )
+
@@ -1,5 +1,17 @@
 #include "rasterizer.h"
 
+#include <algorithm>
+
+#ifdef _OPENMP
+#include <omp.h>
+#else
+static inline int omp_get_max_threads() { return 1; }
+static inline int omp_get_thread_num() { return 0; }
+#endif
+
+// screen tiles of the parallel cpu rasterizer
+#define RASTER_TILE_SIZE 32
+
 void rasterizeTriangleCPU(int idx, float* vt0, float* vt1, float* vt2, int width, int height, INT64* zbuffer, float* d, float occlusion_truncation) {
     float x_min = std::min(vt0[0], std::min(vt1[0],vt2[0]));
     float x_max = std::max(vt0[0], std::max(vt1[0],vt2[0]));
@@ -78,21 +90,180 @@ void barycentricFromImgcoordCPU(float* V, int* F, int* findices, INT64* zbuffer,
     barycentric_map[pix * 3 + 2] = barycentric[2];
 }
 
+void setupTriangleCPU(float* V, int* F, int width, int height, int f, float* vt)
+{
+    // screen space x, y and depth of the three corners, vt[3 * k + c]
+    for (int k = 0; k < 3; ++k) {
+        float* vt_ptr = V + (F[f * 3 + k] * 4);
+        vt[k * 3] = (vt_ptr[0] / vt_ptr[3] * 0.5f + 0.5f) * (width - 1) + 0.5f;
+        vt[k * 3 + 1] = (0.5f + 0.5f * vt_ptr[1] / vt_ptr[3]) * (height - 1) + 0.5f;
+        vt[k * 3 + 2] = vt_ptr[2] / vt_ptr[3] * 0.49999f + 0.5f;
+    }
+}
+
 void rasterizeImagecoordsKernelCPU(float* V, int* F, float* d, INT64* zbuffer, float occlusion_trunc, int width, int height, int num_vertices, int num_faces, int f)
 {
-    float* vt0_ptr = V + (F[f * 3] * 4);
-    float* vt1_ptr = V + (F[f * 3 + 1] * 4);
-    float* vt2_ptr = V + (F[f * 3 + 2] * 4);
+    float vt[9];
+    setupTriangleCPU(V, F, width, height, f, vt);
+
+    rasterizeTriangleCPU(f, vt, vt + 3, vt + 6, width, height, zbuffer, d, occlusion_trunc);
+}
+
+void rasterizeTriangleTileCPU(int idx, float* vt0, float* vt1, float* vt2, int width, int x0, int y0, int x1, int y1,
+    INT64* tile_zbuffer, float* d, float occlusion_truncation)
+{
+    // same pixel coverage and depth tokens as rasterizeTriangleCPU, restricted to the tile [x0, x1) x [y0, y1)
+    float x_min = std::min(vt0[0], std::min(vt1[0],vt2[0]));
+    float x_max = std::max(vt0[0], std::max(vt1[0],vt2[0]));
+    float y_min = std::min(vt0[1], std::min(vt1[1],vt2[1]));
+    float y_max = std::max(vt0[1], std::max(vt1[1],vt2[1]));
+
+    for (int px = (int)std::max(x_min, (float)x0); px < x_max + 1 && px < x1; ++px) {
+        for (int py = (int)std::max(y_min, (float)y0); py < y_max + 1 && py < y1; ++py) {
+            float vt[2] = {px + 0.5, py + 0.5};
+            float baryCentricCoordinate[3];
+            calculateBarycentricCoordinate(vt0, vt1, vt2, vt, baryCentricCoordinate);
+            if (isBarycentricCoordInBounds(baryCentricCoordinate)) {
+                float depth = baryCentricCoordinate[0] * vt0[2] + baryCentricCoordinate[1] * vt1[2] + baryCentricCoordinate[2] * vt2[2];
+                float depth_thres = 0;
+                if (d) {
+                    depth_thres = d[py * width + px] * 0.49999f + 0.5f + occlusion_truncation;
+                }
+
+                int z_quantize = depth * (2<<17);
+                INT64 token = (INT64)z_quantize * MAXINT + (INT64)(idx + 1);
+                if (depth < depth_thres)
+                    continue;
+                int tile_pixel = (py - y0) * RASTER_TILE_SIZE + (px - x0);
+                tile_zbuffer[tile_pixel] = std::min(tile_zbuffer[tile_pixel], token);
+            }
+        }
+    }
+}
+
+struct TiledRasterWorkspaceCPU {
+    // view independent buffers, reused by every view of a batch
+    std::vector<float> triangles;
+    std::vector<INT64> zbuffer;
+    std::vector<std::vector<std::vector<int>>> thread_bins;
+};
+
+void rasterizeImageTiledCPU(float* V, int* F, float* d, int num_vertices, int num_faces, int width, int height,
+    float occlusion_truncation, int* findices, float* barycentric, TiledRasterWorkspaceCPU& workspace)
+{
+    // Tile-binned parallel rasterization: faces are binned into screen tiles, every
+    // tile resolves its own depth buffer, so no two threads write the same pixel.
+    // The depth min per pixel does not depend on the face order, findices and
+    // barycentrics are identical to rasterize_image_cpu_serial.
+    INT64 maxint = (INT64)MAXINT * (INT64)MAXINT + (MAXINT - 1);
+    int tiles_x = (width + RASTER_TILE_SIZE - 1) / RASTER_TILE_SIZE;
+    int tiles_y = (height + RASTER_TILE_SIZE - 1) / RASTER_TILE_SIZE;
+    int num_tiles = tiles_x * tiles_y;
+    int num_threads = omp_get_max_threads();
+
+    std::vector<float>& triangles = workspace.triangles;
+    std::vector<std::vector<std::vector<int>>>& thread_bins = workspace.thread_bins;
+    triangles.resize((size_t)num_faces * 9);
+    workspace.zbuffer.resize((size_t)width * height);
+    INT64* zbuffer = workspace.zbuffer.data();
+    thread_bins.resize(num_threads);
+    for (auto& bins : thread_bins) {
+        bins.resize(num_tiles);
+        for (auto& bin : bins)
+            bin.clear();
+    }
 
-    float vt0[3] = {(vt0_ptr[0] / vt0_ptr[3] * 0.5f + 0.5f) * (width - 1) + 0.5f, (0.5f + 0.5f * vt0_ptr[1] / vt0_ptr[3]) * (height - 1) + 0.5f, vt0_ptr[2] / vt0_ptr[3] * 0.49999f + 0.5f};
-    float vt1[3] = {(vt1_ptr[0] / vt1_ptr[3] * 0.5f + 0.5f) * (width - 1) + 0.5f, (0.5f + 0.5f * vt1_ptr[1] / vt1_ptr[3]) * (height - 1) + 0.5f, vt1_ptr[2] / vt1_ptr[3] * 0.49999f + 0.5f};
-    float vt2[3] = {(vt2_ptr[0] / vt2_ptr[3] * 0.5f + 0.5f) * (width - 1) + 0.5f, (0.5f + 0.5f * vt2_ptr[1] / vt2_ptr[3]) * (height - 1) + 0.5f, vt2_ptr[2] / vt2_ptr[3] * 0.49999f + 0.5f};
+    // triangle setup and binning, every thread fills its own bins
+    #pragma omp parallel
+    {
+        std::vector<std::vector<int>>& bins = thread_bins[omp_get_thread_num()];
+        #pragma omp for schedule(static)
+        for (int f = 0; f < num_faces; ++f) {
+            float* vt = triangles.data() + (size_t)f * 9;
+            setupTriangleCPU(V, F, width, height, f, vt);
+            float x_min = std::min(vt[0], std::min(vt[3], vt[6]));
+            float x_max = std::max(vt[0], std::max(vt[3], vt[6]));
+            float y_min = std::min(vt[1], std::min(vt[4], vt[7]));
+            float y_max = std::max(vt[1], std::max(vt[4], vt[7]));
+            if (!(x_max + 1 > 0 && y_max + 1 > 0 && x_min < width && y_min < height))
+                continue;
+            int px0 = (int)std::max(x_min, 0.0f);
+            int py0 = (int)std::max(y_min, 0.0f);
+            int px1 = (int)std::min(x_max + 1, (float)(width - 1));
+            int py1 = (int)std::min(y_max + 1, (float)(height - 1));
+            for (int ty = py0 / RASTER_TILE_SIZE; ty <= py1 / RASTER_TILE_SIZE; ++ty)
+                for (int tx = px0 / RASTER_TILE_SIZE; tx <= px1 / RASTER_TILE_SIZE; ++tx)
+                    bins[ty * tiles_x + tx].push_back(f);
+        }
+    }
+
+    #pragma omp parallel for schedule(dynamic)
+    for (int t = 0; t < num_tiles; ++t) {
+        int x0 = (t % tiles_x) * RASTER_TILE_SIZE;
+        int y0 = (t / tiles_x) * RASTER_TILE_SIZE;
+        int x1 = std::min(x0 + RASTER_TILE_SIZE, width);
+        int y1 = std::min(y0 + RASTER_TILE_SIZE, height);
+        INT64 tile_zbuffer[RASTER_TILE_SIZE * RASTER_TILE_SIZE];
+        std::fill(tile_zbuffer, tile_zbuffer + RASTER_TILE_SIZE * RASTER_TILE_SIZE, maxint);
+        for (int i = 0; i < num_threads; ++i) {
+            for (int f : thread_bins[i][t]) {
+                float* vt = triangles.data() + (size_t)f * 9;
+                rasterizeTriangleTileCPU(f, vt, vt + 3, vt + 6, width, x0, y0, x1, y1, tile_zbuffer, d, occlusion_truncation);
+            }
+        }
+        for (int py = y0; py < y1; ++py)
+            for (int px = x0; px < x1; ++px)
+                zbuffer[py * width + px] = tile_zbuffer[(py - y0) * RASTER_TILE_SIZE + (px - x0)];
+    }
 
-    rasterizeTriangleCPU(f, vt0, vt1, vt2, width, height, zbuffer, d, occlusion_trunc);
+    #pragma omp parallel for schedule(static)
+    for (int i = 0; i < width * height; ++i)
+        barycentricFromImgcoordCPU(V, F, findices, zbuffer, width, height, num_vertices, num_faces, barycentric, i);
 }
 
 std::vector<torch::Tensor> rasterize_image_cpu(torch::Tensor V, torch::Tensor F, torch::Tensor D,
     int width, int height, float occlusion_truncation, int use_depth_prior)
+{
+    int num_faces = F.size(0);
+    int num_vertices = V.size(0);
+    auto options = torch::TensorOptions().dtype(torch::kInt32).requires_grad(false);
+    auto float_options = torch::TensorOptions().dtype(torch::kFloat32).requires_grad(false);
+    auto findices = torch::zeros({height, width}, options);
+    auto barycentric = torch::zeros({height, width, 3}, float_options);
+
+    TiledRasterWorkspaceCPU workspace;
+    rasterizeImageTiledCPU(V.data_ptr<float>(), F.data_ptr<int>(), use_depth_prior ? D.data_ptr<float>() : 0,
+        num_vertices, num_faces, width, height, occlusion_truncation,
+        findices.data_ptr<int>(), barycentric.data_ptr<float>(), workspace);
+
+    return {findices, barycentric};
+}
+
+std::vector<torch::Tensor> rasterize_image_batch_cpu(torch::Tensor V, torch::Tensor F, torch::Tensor D,
+    int width, int height, float occlusion_truncation, int use_depth_prior)
+{
+    int num_views = V.size(0);
+    int num_vertices = V.size(1);
+    int num_faces = F.size(0);
+    auto options = torch::TensorOptions().dtype(torch::kInt32).requires_grad(false);
+    auto float_options = torch::TensorOptions().dtype(torch::kFloat32).requires_grad(false);
+    auto findices = torch::zeros({num_views, height, width}, options);
+    auto barycentric = torch::zeros({num_views, height, width, 3}, float_options);
+
+    TiledRasterWorkspaceCPU workspace;
+    for (int b = 0; b < num_views; ++b) {
+        rasterizeImageTiledCPU(V.data_ptr<float>() + (size_t)b * num_vertices * 4, F.data_ptr<int>(),
+            use_depth_prior ? D.data_ptr<float>() + (size_t)b * width * height : 0,
+            num_vertices, num_faces, width, height, occlusion_truncation,
+            findices.data_ptr<int>() + (size_t)b * width * height,
+            barycentric.data_ptr<float>() + (size_t)b * width * height * 3, workspace);
+    }
+
+    return {findices, barycentric};
+}
+
+std::vector<torch::Tensor> rasterize_image_cpu_serial(torch::Tensor V, torch::Tensor F, torch::Tensor D,
+    int width, int height, float occlusion_truncation, int use_depth_prior)
 {
     int num_faces = F.size(0);
     int num_vertices = V.size(0);
@@ -132,8 +303,20 @@ std::vector<torch::Tensor> rasterize_image(torch::Tensor V, torch::Tensor F, tor
         return rasterize_image_gpu(V, F, D, width, height, occlusion_truncation, use_depth_prior);
 }
 
+std::vector<torch::Tensor> rasterize_image_batch(torch::Tensor V, torch::Tensor F, torch::Tensor D,
+    int width, int height, float occlusion_truncation, int use_depth_prior)
+{
+    int device_id = V.get_device();
+    if (device_id == -1)
+        return rasterize_image_batch_cpu(V, F, D, width, height, occlusion_truncation, use_depth_prior);
+    else
+        return rasterize_image_batch_gpu(V, F, D, width, height, occlusion_truncation, use_depth_prior);
+}
+
 PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
   m.def("rasterize_image", &rasterize_image, "Custom image rasterization");
+  m.def("rasterize_image_batch", &rasterize_image_batch, "Custom multi-view image rasterization sharing one triangle buffer");
+  m.def("rasterize_image_cpu_serial", &rasterize_image_cpu_serial, "Single-threaded reference cpu rasterization");
   m.def("build_hierarchy", &build_hierarchy, "Custom image rasterization");
   m.def("build_hierarchy_with_feat", &build_hierarchy_with_feat, "Custom image rasterization");
 }
@@ -1,3 +1,5 @@
+import sys
+
 from setuptools import setup, find_packages
 from torch.utils.cpp_extension import BuildExtension, CUDAExtension
 
@@ -5,6 +7,9 @@ from torch.utils.cpp_extension import BuildExtension, CUDAExtension
 # build with `python setup.py install`
 # nvcc is needed
 
+# the cpu rasterizer is parallelized with OpenMP
+openmp_flag = "/openmp" if sys.platform == "win32" else "-fopenmp"
+
 custom_rasterizer_module = CUDAExtension(
     "custom_rasterizer_kernel",
     [
@@ -12,6 +17,8 @@ custom_rasterizer_module = CUDAExtension(
         "lib/custom_rasterizer_kernel/grid_neighbor.cpp",
         "lib/custom_rasterizer_kernel/rasterizer_gpu.cu",
     ],
+    extra_compile_args={"cxx": [openmp_flag], "nvcc": []},
+    extra_link_args=[] if sys.platform == "win32" else [openmp_flag],
 )
 
 setup(
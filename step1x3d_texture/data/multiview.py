@@ -11,6 +11,7 @@ import torch.nn.functional as F
 from PIL import Image
 from torch.utils.data import DataLoader, Dataset
 
+from ...step1x3d_geometry.data.dataloader import build_dataloader
 from ..utils.config import parse_structured
 from ..utils.geometry import (
     get_plucker_embeds_from_cameras,
@@ -19,6 +20,7 @@ from ..utils.geometry import (
     get_position_map_from_depth_ortho,
 )
 from ..utils.typing import *
+from .records import RecordReader
 
 os.environ["OPENCV_IO_ENABLE_OPENEXR"] = "1"
 
@@ -112,6 +114,11 @@ class MultiviewDataModuleConfig:
     reference_augment_resolutions: Optional[List[int]] = None
     reference_mask_aug: bool = False
 
+    # pre-resized views and cameras of every scene, see data/scene_records.py
+    scene_record_dir: Optional[str] = None
+    # VAE latent moments of the target and reference views, used for training
+    latent_record_dir: Optional[str] = None
+
     repeat: int = 1  # for debugging purpose
 
     train_indices: Optional[Tuple[Any, Any]] = None
@@ -125,6 +132,10 @@ class MultiviewDataModuleConfig:
     eval_batch_size: int = 1
 
     num_workers: int = 16
+    pin_memory: bool = True  # pinned batches are copied to the GPU asynchronously
+    persistent_workers: bool = True  # keep the workers alive across epochs
+    prefetch_factor: Optional[int] = None  # batches loaded ahead by each worker
+    seed: Optional[int] = None  # seed of the shuffling and the worker seeds
 
 
 class MultiviewDataset(Dataset):
@@ -167,6 +178,16 @@ class MultiviewDataset(Dataset):
         else:
             self.prompt_db = None
 
+        self.scene_records = None
+        if self.cfg.scene_record_dir is not None:
+            self.scene_records = RecordReader(self.cfg.scene_record_dir)
+            self.check_scene_records()
+
+        self.latent_records = None
+        if self.split == "train" and self.cfg.latent_record_dir is not None:
+            self.latent_records = RecordReader(self.cfg.latent_record_dir)
+            self.check_latent_records()
+
     def __len__(self):
         return len(self.all_scenes)
 
@@ -192,7 +213,7 @@ class MultiviewDataset(Dataset):
 
     def load_image(
         self,
-        image: Union[str, Image.Image],
+        image: Union[str, Image.Image, np.ndarray],
         height: int,
         width: int,
         background_color: torch.Tensor,
@@ -200,10 +221,10 @@ class MultiviewDataset(Dataset):
         mask_aug: bool = False,
     ):
         if isinstance(image, str):
-            image = Image.open(image)
-
-        image = image.resize((width, height))
-        image = torch.from_numpy(np.array(image)).float() / 255.0
+            image = self.read_image(image, height, width)
+        elif isinstance(image, Image.Image):
+            image = np.array(image.resize((width, height)))
+        image = torch.from_numpy(image).float() / 255.0
 
         if mask_aug:
             alpha = image[:, :, 3]  # Extract alpha channel
@@ -233,15 +254,16 @@ class MultiviewDataset(Dataset):
 
     def load_normal_image(
         self,
-        path,
+        image,
         height,
         width,
         background_color,
         camera_space: bool = False,
         c2w: Optional[torch.FloatTensor] = None,
     ):
-        image = Image.open(path).resize((width, height), resample=Image.NEAREST)
-        image = torch.from_numpy(np.array(image)).float() / 255.0
+        if isinstance(image, str):
+            image = self.read_image(image, height, width, resample=Image.NEAREST)
+        image = torch.from_numpy(image).float() / 255.0
         alpha = image[:, :, 3:4]
         image = image[:, :, :3]
         if camera_space:
@@ -254,15 +276,101 @@ class MultiviewDataset(Dataset):
         image = image * alpha + background_color * (1 - alpha)
         return image
 
-    def load_depth(self, path, height, width):
+    def read_image(self, path, height, width, resample=None):
+        image = Image.open(path).resize((width, height), resample=resample)
+        return np.array(image)
+
+    def read_depth(self, path, height, width):
         depth = cv2.imread(path, cv2.IMREAD_UNCHANGED)
         depth = cv2.resize(depth, (width, height), interpolation=cv2.INTER_NEAREST)
-        depth = torch.from_numpy(depth[..., 0:1]).float()
+        return depth[..., 0:1]
+
+    def load_depth(self, depth, height, width):
+        if isinstance(depth, str):
+            depth = self.read_depth(depth, height, width)
+        depth = torch.from_numpy(depth).float()
         mask = torch.ones_like(depth)
         mask[depth > 1000.0] = 0.0  # depth = 65535 is the invalid value
         depth[~(mask > 0.5)] = 0.0
         return depth, mask
 
+    def load_cameras(self, scene_dir):
+        with open(os.path.join(scene_dir, "meta.json")) as f:
+            meta = json.load(f)
+        name2loc = {loc["index"]: loc for loc in meta["locations"]}
+        c2w = [
+            torch.as_tensor(name2loc[name]["transform_matrix"])
+            for name in self.cfg.image_names
+        ]
+        c2w = torch.stack(c2w, dim=0)
+        camera_angle_x = meta.get("camera_angle_x", None) or meta["locations"][0].get(
+            "camera_angle_x"
+        )
+        ortho_scale = meta.get("ortho_scale", None) or meta["locations"][0].get(
+            "ortho_scale"
+        )
+        return c2w, camera_angle_x, ortho_scale
+
+    def check_record_meta(self, records, record_dir, expected):
+        for key, value in expected.items():
+            if records.meta.get(key) != value:
+                raise ValueError(
+                    f"Records in {record_dir} have {key}={records.meta.get(key)}, "
+                    f"expected {value}"
+                )
+
+    def check_scene_records(self):
+        expected = {
+            "image_modality": self.cfg.image_modality,
+            "image_names": list(self.cfg.image_names),
+            "height": self.cfg.height,
+            "width": self.cfg.width,
+            "projection_type": self.cfg.projection_type,
+        }
+        if (
+            "reference_rgba" in self.scene_records.layout
+            and self.reference_scenes is not None
+            and self.cfg.reference_augment_resolutions is None
+        ):
+            expected["reference_image_modality"] = self.cfg.reference_image_modality
+            expected["reference_image_names"] = list(self.cfg.reference_image_names)
+        self.check_record_meta(self.scene_records, self.cfg.scene_record_dir, expected)
+        source_image_modality = self.cfg.source_image_modality
+        if isinstance(source_image_modality, str):
+            source_image_modality = [source_image_modality]
+        for modality in source_image_modality:
+            key = {"position": "depth", "normal": "normal"}.get(modality)
+            if key is not None and key not in self.scene_records.layout:
+                raise ValueError(
+                    f"Records in {self.cfg.scene_record_dir} have no {key} maps"
+                )
+
+    def check_latent_records(self):
+        if (
+            self.cfg.background_color in ["random", "random_gray"]
+            or self.cfg.reference_augment_resolutions is not None
+            or self.cfg.reference_mask_aug
+        ):
+            raise ValueError(
+                "Random backgrounds and reference augmentations are not supported "
+                "with latent_record_dir"
+            )
+        expected = {
+            "image_modality": self.cfg.image_modality,
+            "image_names": list(self.cfg.image_names),
+            "reference_image_names": (
+                list(self.cfg.reference_image_names)
+                if self.reference_scenes is not None
+                else []
+            ),
+            "height": self.cfg.height,
+            "width": self.cfg.width,
+            "background_color": self.get_bg_color(self.cfg.background_color).tolist(),
+        }
+        self.check_record_meta(
+            self.latent_records, self.cfg.latent_record_dir, expected
+        )
+
     def retrieve_prompt(self, scene_dir):
         assert self.prompt_db is not None
         source_id = os.path.basename(scene_dir)
@@ -271,41 +379,46 @@ class MultiviewDataset(Dataset):
     def __getitem__(self, index):
         background_color = torch.as_tensor(self.get_bg_color(self.cfg.background_color))
         scene_dir = self.all_scenes[index]
+        scene_id = os.path.basename(scene_dir)
 
-        with open(os.path.join(scene_dir, "meta.json")) as f:
-            meta = json.load(f)
-        name2loc = {loc["index"]: loc for loc in meta["locations"]}
+        # the whole scene in one read, or None to load the files
+        record = None
+        if self.scene_records is not None and scene_id in self.scene_records:
+            record = self.scene_records.load(scene_id)
 
         # target multi-view images
-        image_paths = [
-            os.path.join(
-                scene_dir, f"{self.cfg.image_modality}_{f}.{self.cfg.image_suffix}"
-            )
-            for f in self.cfg.image_names
-        ]
-        images = [
-            self.load_image(
-                p,
-                height=self.cfg.height,
-                width=self.cfg.width,
-                background_color=background_color,
-            )
-            for p in image_paths
-        ]
-        images = torch.stack(images, dim=0).permute(0, 3, 1, 2)
+        if self.latent_records is not None:
+            latents = self.latent_records.load(scene_id)
+        else:
+            if record is not None:
+                image_inputs = record["rgba"]
+            else:
+                image_inputs = [
+                    os.path.join(
+                        scene_dir,
+                        f"{self.cfg.image_modality}_{f}.{self.cfg.image_suffix}",
+                    )
+                    for f in self.cfg.image_names
+                ]
+            images = [
+                self.load_image(
+                    p,
+                    height=self.cfg.height,
+                    width=self.cfg.width,
+                    background_color=background_color,
+                )
+                for p in image_inputs
+            ]
+            images = torch.stack(images, dim=0).permute(0, 3, 1, 2)
 
         # camera
-        c2w = [
-            torch.as_tensor(name2loc[name]["transform_matrix"])
-            for name in self.cfg.image_names
-        ]
-        c2w = torch.stack(c2w, dim=0)
+        if record is not None:
+            c2w = torch.from_numpy(record["c2w"])
+            camera_angle_x, ortho_scale = record["camera"].tolist()
+        else:
+            c2w, camera_angle_x, ortho_scale = self.load_cameras(scene_dir)
 
         if self.cfg.projection_type == "PERSP":
-            camera_angle_x = (
-                meta.get("camera_angle_x", None)
-                or meta["locations"][0]["camera_angle_x"]
-            )
             focal_length = 0.5 * self.cfg.width / np.tan(0.5 * camera_angle_x)
             intrinsics = (
                 torch.as_tensor(
@@ -319,10 +432,6 @@ class MultiviewDataset(Dataset):
                 .float()
                 .repeat(len(self.cfg.image_names), 1, 1)
             )
-        elif self.cfg.projection_type == "ORTHO":
-            ortho_scale = (
-                meta.get("ortho_scale", None) or meta["locations"][0]["ortho_scale"]
-            )
 
         # source conditions
         source_image_modality = self.cfg.source_image_modality
@@ -331,13 +440,16 @@ class MultiviewDataset(Dataset):
         source_images = []
         for modality in source_image_modality:
             if modality == "position":
+                if record is not None:
+                    depth_inputs = record["depth"]
+                else:
+                    depth_inputs = [
+                        os.path.join(scene_dir, f"depth_{f}.exr")
+                        for f in self.cfg.image_names
+                    ]
                 depth_masks = [
-                    self.load_depth(
-                        os.path.join(scene_dir, f"depth_{f}.exr"),
-                        self.cfg.height,
-                        self.cfg.width,
-                    )
-                    for f in self.cfg.image_names
+                    self.load_depth(d, self.cfg.height, self.cfg.width)
+                    for d in depth_inputs
                 ]
                 depths = torch.stack([d for d, _ in depth_masks])
                 masks = torch.stack([m for _, m in depth_masks])
@@ -365,18 +477,25 @@ class MultiviewDataset(Dataset):
                 ).clamp(0.0, 1.0)
                 source_images.append(position_maps)
             elif modality == "normal":
-                normal_maps = [
-                    self.load_normal_image(
+                if record is not None:
+                    normal_inputs = record["normal"]
+                else:
+                    normal_inputs = [
                         os.path.join(
                             scene_dir, f"{modality}_{f}.{self.cfg.image_suffix}"
-                        ),
+                        )
+                        for f in self.cfg.image_names
+                    ]
+                normal_maps = [
+                    self.load_normal_image(
+                        n,
                         height=self.cfg.height,
                         width=self.cfg.width,
                         background_color=background_color,
                         camera_space=self.cfg.use_camera_space_normal,
                         c2w=c,
                     )
-                    for c, f in zip(c2w, self.cfg.image_names)
+                    for c, n in zip(c2w, normal_inputs)
                 ]
                 source_images.append(torch.stack(normal_maps, dim=0))
             elif modality == "plucker":
@@ -398,7 +517,12 @@ class MultiviewDataset(Dataset):
             else:
                 raise NotImplementedError
         source_images = torch.cat(source_images, dim=-1).permute(0, 3, 1, 2)
-        rv = {"rgb": images, "c2w": c2w, "source_rgb": source_images}
+        rv = {"c2w": c2w, "source_rgb": source_images}
+        if self.latent_records is not None:
+            rv["latent_mean"] = torch.from_numpy(latents["mean"])
+            rv["latent_std"] = torch.from_numpy(latents["std"])
+        else:
+            rv["rgb"] = images
 
         num_images = len(self.cfg.image_names)
         # prompt
@@ -423,7 +547,25 @@ class MultiviewDataset(Dataset):
                 rv.update({"prompts": prompts})
 
         # reference image
-        if self.reference_scenes is not None:
+        if self.reference_scenes is not None and self.latent_records is not None:
+            i = random.randrange(len(self.cfg.reference_image_names))
+            rv["reference_latent_mean"] = torch.from_numpy(latents["reference_mean"][i])
+            rv["reference_latent_std"] = torch.from_numpy(latents["reference_std"][i])
+        elif (
+            self.reference_scenes is not None
+            and record is not None
+            and "reference_rgba" in record
+            and self.cfg.reference_augment_resolutions is None
+        ):
+            reference_image = self.load_image(
+                random.choice(record["reference_rgba"]),
+                height=self.cfg.height,
+                width=self.cfg.width,
+                background_color=background_color,
+                mask_aug=self.cfg.reference_mask_aug,
+            ).permute(2, 0, 1)
+            rv.update({"reference_rgb": reference_image})
+        elif self.reference_scenes is not None:
             reference_scene_dir = self.reference_scenes[scene_dir]
             reference_image_paths = [
                 os.path.join(
@@ -471,9 +613,12 @@ class MultiviewDataset(Dataset):
             indices = list(range(self.cfg.num_views))
         num_views = len(indices)
 
+        is_identity = indices == list(range(num_views))
         for k in batch.keys():
-            if k in ["rgb", "source_rgb", "c2w"]:
-                batch[k] = batch[k][:, indices]
+            if k in ["rgb", "source_rgb", "c2w", "latent_mean", "latent_std"]:
+                # indexing copies, skip it when every view is kept in order
+                if not is_identity or batch[k].shape[1] != num_views:
+                    batch[k] = batch[k][:, indices]
                 batch[k] = pack(batch[k])
         for k in ["prompts"]:
             if not self.cfg.return_one_prompt:
@@ -509,31 +654,32 @@ class MultiviewDataModule(pl.LightningDataModule):
     def prepare_data(self):
         pass
 
-    def train_dataloader(self) -> DataLoader:
-        return DataLoader(
-            self.train_dataset,
-            batch_size=self.cfg.batch_size,
+    def general_loader(self, dataset, batch_size, shuffle=False) -> DataLoader:
+        return build_dataloader(
+            dataset,
+            batch_size=batch_size,
             num_workers=self.cfg.num_workers,
-            shuffle=True,
-            collate_fn=self.train_dataset.collate,
+            shuffle=shuffle,
+            collate_fn=dataset.collate,
+            pin_memory=self.cfg.pin_memory,
+            persistent_workers=self.cfg.persistent_workers,
+            prefetch_factor=self.cfg.prefetch_factor,
+            seed=self.cfg.seed,
+        )
+
+    def train_dataloader(self) -> DataLoader:
+        return self.general_loader(
+            self.train_dataset, batch_size=self.cfg.batch_size, shuffle=True
         )
 
     def val_dataloader(self) -> DataLoader:
-        return DataLoader(
-            self.val_dataset,
-            batch_size=self.cfg.eval_batch_size,
-            num_workers=self.cfg.num_workers,
-            shuffle=False,
-            collate_fn=self.val_dataset.collate,
+        return self.general_loader(
+            self.val_dataset, batch_size=self.cfg.eval_batch_size, shuffle=False
         )
 
     def test_dataloader(self) -> DataLoader:
-        return DataLoader(
-            self.test_dataset,
-            batch_size=self.cfg.eval_batch_size,
-            num_workers=self.cfg.num_workers,
-            shuffle=False,
-            collate_fn=self.test_dataset.collate,
+        return self.general_loader(
+            self.test_dataset, batch_size=self.cfg.eval_batch_size, shuffle=False
         )
 
     def predict_dataloader(self) -> DataLoader:
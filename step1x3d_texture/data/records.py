@@ -0,0 +1,137 @@
+import json
+import os
+
+import numpy as np
+
+from ..utils.typing import *
+
+ARRAY_ALIGNMENT = 64
+RECORD_ALIGNMENT = 4096
+
+
+class RecordWriter:
+    """
+    Writes records made of identically shaped arrays into shard files of
+    records_per_shard fixed-size slots, with an index.json holding the record
+    layout and the slot of every key. The layout is taken from the first record.
+    An existing index is extended, so a store can be filled in several runs.
+    """
+
+    def __init__(self, record_dir: str, records_per_shard: int = 1024) -> None:
+        self.record_dir = record_dir
+        os.makedirs(record_dir, exist_ok=True)
+        self.index_path = os.path.join(record_dir, "index.json")
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                self.index = json.load(f)
+        else:
+            self.index = {
+                "layout": None,
+                "record_bytes": 0,
+                "records_per_shard": records_per_shard,
+                "shards": [],
+                "keys": {},
+                "meta": {},
+            }
+        self.shard_file, self.shard = None, None
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index["keys"]
+
+    @property
+    def meta(self) -> Dict[str, Any]:
+        return self.index["meta"]
+
+    def _set_layout(self, arrays: Dict[str, np.ndarray]) -> None:
+        layout, offset = {}, 0
+        for name, array in arrays.items():
+            layout[name] = [offset, list(array.shape), array.dtype.str]
+            offset += -(-array.nbytes // ARRAY_ALIGNMENT) * ARRAY_ALIGNMENT
+        self.index["layout"] = layout
+        self.index["record_bytes"] = -(-offset // RECORD_ALIGNMENT) * RECORD_ALIGNMENT
+
+    def add(self, key: str, arrays: Dict[str, np.ndarray]) -> None:
+        if self.index["layout"] is None:
+            self._set_layout(arrays)
+        layout = self.index["layout"]
+        if set(arrays.keys()) != set(layout.keys()):
+            raise ValueError(f"Record {key} has arrays {list(arrays.keys())}")
+
+        record = bytearray(self.index["record_bytes"])
+        for name, (offset, shape, dtype) in layout.items():
+            array = np.ascontiguousarray(arrays[name], dtype=np.dtype(dtype))
+            if list(array.shape) != shape:
+                raise ValueError(
+                    f"Record {key} has {name} of shape {array.shape}, expected {shape}"
+                )
+            record[offset : offset + array.nbytes] = array.tobytes()
+
+        slot = self.index["keys"].get(key, len(self.index["keys"]))
+        shard, slot_in_shard = divmod(slot, self.index["records_per_shard"])
+        if shard != self.shard:
+            if self.shard_file is not None:
+                self.shard_file.close()
+            if shard == len(self.index["shards"]):
+                self.index["shards"].append(f"shard_{shard:05d}.bin")
+            path = os.path.join(self.record_dir, self.index["shards"][shard])
+            self.shard_file = open(path, "r+b" if os.path.exists(path) else "wb")
+            self.shard = shard
+        self.shard_file.seek(slot_in_shard * self.index["record_bytes"])
+        self.shard_file.write(record)
+        self.index["keys"][key] = slot
+
+    def close(self) -> None:
+        if self.shard_file is not None:
+            self.shard_file.close()
+            self.shard_file, self.shard = None, None
+        with open(self.index_path, "w") as f:
+            json.dump(self.index, f)
+
+
+class RecordReader:
+    """
+    Read-only view of the records written by RecordWriter. Loading a record is
+    a single contiguous read into a fresh buffer, so the returned arrays are
+    writable and can be passed to torch.from_numpy without a copy.
+    """
+
+    def __init__(self, record_dir: str) -> None:
+        self.record_dir = record_dir
+        with open(os.path.join(record_dir, "index.json"), "r") as f:
+            index = json.load(f)
+        self.layout = index["layout"]
+        self.record_bytes = index["record_bytes"]
+        self.records_per_shard = index["records_per_shard"]
+        self.shards = index["shards"]
+        self.keys = index["keys"]
+        self.meta = index.get("meta", {})
+        self._files = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _get_file(self, shard: int):
+        # opened lazily, so every dataloader worker opens the files itself
+        if shard not in self._files:
+            self._files[shard] = open(
+                os.path.join(self.record_dir, self.shards[shard]), "rb", buffering=0
+            )
+        return self._files[shard]
+
+    def load(self, key: str) -> Dict[str, np.ndarray]:
+        shard, slot_in_shard = divmod(self.keys[key], self.records_per_shard)
+        f = self._get_file(shard)
+        f.seek(slot_in_shard * self.record_bytes)
+        record = bytearray(self.record_bytes)
+        f.readinto(record)
+        arrays = {}
+        for name, (offset, shape, dtype) in self.layout.items():
+            dtype = np.dtype(dtype)
+            count = int(np.prod(shape))
+            arrays[name] = np.frombuffer(
+                record, dtype=dtype, count=count, offset=offset
+            ).reshape(shape)
+        return arrays
@@ -0,0 +1,177 @@
+import argparse
+import os
+
+import numpy as np
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset
+
+from ..utils.config import load_config, parse_structured
+from ..utils.typing import *
+from .multiview import MultiviewDataModuleConfig, MultiviewDataset
+from .records import RecordWriter
+
+
+def read_scene_arrays(dataset: MultiviewDataset, scene_dir: str):
+    """
+    Everything MultiviewDataset.__getitem__ reads from the files of a scene,
+    resized to the dataset resolution but not yet composited or normalized.
+    """
+    cfg = dataset.cfg
+    size = (cfg.height, cfg.width)
+    c2w, camera_angle_x, ortho_scale = dataset.load_cameras(scene_dir)
+    # the camera value of the other projection may be missing, stored as NaN
+    if cfg.projection_type == "PERSP" and camera_angle_x is None:
+        raise ValueError(f"No camera_angle_x for PERSP projection in {scene_dir}")
+    if cfg.projection_type == "ORTHO" and ortho_scale is None:
+        raise ValueError(f"No ortho_scale for ORTHO projection in {scene_dir}")
+    arrays = {
+        "rgba": np.stack(
+            [
+                dataset.read_image(
+                    os.path.join(
+                        scene_dir, f"{cfg.image_modality}_{f}.{cfg.image_suffix}"
+                    ),
+                    *size,
+                )
+                for f in cfg.image_names
+            ]
+        ),
+        "c2w": c2w.numpy().astype(np.float32),
+        "camera": np.array(
+            [
+                np.nan if camera_angle_x is None else camera_angle_x,
+                np.nan if ortho_scale is None else ortho_scale,
+            ],
+            dtype=np.float64,
+        ),
+    }
+
+    source_image_modality = cfg.source_image_modality
+    if isinstance(source_image_modality, str):
+        source_image_modality = [source_image_modality]
+    if "position" in source_image_modality:
+        arrays["depth"] = np.stack(
+            [
+                dataset.read_depth(os.path.join(scene_dir, f"depth_{f}.exr"), *size)
+                for f in cfg.image_names
+            ]
+        ).astype(np.float32)
+    if "normal" in source_image_modality:
+        arrays["normal"] = np.stack(
+            [
+                dataset.read_image(
+                    os.path.join(scene_dir, f"normal_{f}.{cfg.image_suffix}"),
+                    *size,
+                    resample=Image.NEAREST,
+                )
+                for f in cfg.image_names
+            ]
+        )
+
+    # references resized to random resolutions keep being loaded from the files
+    if dataset.reference_scenes is not None and not cfg.reference_augment_resolutions:
+        reference_scene_dir = dataset.reference_scenes[scene_dir]
+        arrays["reference_rgba"] = np.stack(
+            [
+                dataset.read_image(
+                    os.path.join(
+                        reference_scene_dir,
+                        f"{cfg.reference_image_modality}_{f}.{cfg.image_suffix}",
+                    ),
+                    *size,
+                )
+                for f in cfg.reference_image_names
+            ]
+        )
+    return arrays
+
+
+class SceneArrayDataset(Dataset):
+    def __init__(self, dataset: MultiviewDataset, scene_dirs: List[str]) -> None:
+        self.dataset = dataset
+        self.scene_dirs = scene_dirs
+
+    def __len__(self):
+        return len(self.scene_dirs)
+
+    def __getitem__(self, index):
+        scene_dir = self.scene_dirs[index]
+        try:
+            arrays = read_scene_arrays(self.dataset, scene_dir)
+        except Exception as e:
+            print(f"Error in {scene_dir}: {e}")
+            return None
+        return {"key": os.path.basename(scene_dir), "arrays": arrays}
+
+
+def pack_scene_records(
+    dataset: MultiviewDataset,
+    record_dir: str,
+    records_per_shard: int = 64,
+    num_workers: int = 8,
+) -> None:
+    """
+    Pack the scenes of a MultiviewDataset into fixed-size records, keyed by
+    scene id, that MultiviewDataset reads with data.scene_record_dir.
+    """
+    cfg = dataset.cfg
+    writer = RecordWriter(record_dir, records_per_shard)
+    writer.meta.update(
+        image_modality=cfg.image_modality,
+        image_names=list(cfg.image_names),
+        height=cfg.height,
+        width=cfg.width,
+        projection_type=cfg.projection_type,
+    )
+    if dataset.reference_scenes is not None and not cfg.reference_augment_resolutions:
+        writer.meta.update(
+            reference_image_modality=cfg.reference_image_modality,
+            reference_image_names=list(cfg.reference_image_names),
+        )
+
+    scene_dirs = list(
+        dict.fromkeys(
+            scene_dir
+            for scene_dir in dataset.all_scenes
+            if os.path.basename(scene_dir) not in writer
+        )
+    )
+    loader = DataLoader(
+        SceneArrayDataset(dataset, scene_dirs),
+        batch_size=None,
+        num_workers=num_workers,
+    )
+    for i, item in enumerate(loader):
+        if item is not None:
+            arrays = {name: array.numpy() for name, array in item["arrays"].items()}
+            writer.add(item["key"], arrays)
+        if (i + 1) % 1000 == 0:
+            print(f"Packed {i + 1}/{len(scene_dirs)} scenes")
+            writer.close()  # save progress
+    writer.close()
+
+
+if __name__ == "__main__":
+    # python -m <package>.step1x3d_texture.data.scene_records \
+    #     --config <ig2mv config>.yaml --record_dir <data>/scene_records
+    # then train with data.scene_record_dir=<data>/scene_records
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, required=True)
+    parser.add_argument("--record_dir", type=str, required=True)
+    parser.add_argument("--splits", type=str, nargs="+", default=["train", "val"])
+    parser.add_argument("--records_per_shard", type=int, default=64)
+    args, extras = parser.parse_known_args()
+
+    cfg = load_config(args.config, cli_args=extras, makedirs=False)
+    data_cfg = parse_structured(MultiviewDataModuleConfig, cfg.data)
+    data_cfg.scene_record_dir = None
+    data_cfg.latent_record_dir = None
+    for split in args.splits:
+        dataset = MultiviewDataset(data_cfg, split)
+        print(f"Packing {len(dataset)} {split} scenes into {args.record_dir}")
+        pack_scene_records(
+            dataset,
+            args.record_dir,
+            records_per_shard=args.records_per_shard,
+            num_workers=data_cfg.num_workers,
+        )
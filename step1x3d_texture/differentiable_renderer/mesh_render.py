@@ -12,6 +12,9 @@
 # fine-tuning enabling code and other elements of the foregoing made publicly available
 # by Tencent in accordance with TENCENT HUNYUAN COMMUNITY LICENSE AGREEMENT.
 
+import argparse
+import time
+
 import cv2
 import numpy as np
 import torch
@@ -197,6 +200,11 @@ class MeshRender:
         else:
             raise f"No camera type {camera_type}"
 
+        self._vtx_nrm = None
+        self.bake_sample_mode = "bilinear"
+        self.bake_depth_tolerance = 1e-2
+        self._uv_rast = None
+
     def raster_rasterize(self, pos, tri, resolution, ranges=None, grad_db=True):
 
         if self.raster_mode == "cr":
@@ -211,6 +219,30 @@ class MeshRender:
 
         return rast_out, rast_out_db
 
+    def raster_rasterize_views(
+        self, elevs, azims, resolution, camera_distance=None, center=None
+    ):
+        # all views share the triangle buffer, rasterize them in one call
+        if isinstance(resolution, (int, float)):
+            resolution = [resolution, resolution]
+        pos_clip = torch.cat(
+            [
+                self.get_pos_from_mvp(elev, azim, camera_distance, center)[1]
+                for elev, azim in zip(elevs, azims)
+            ],
+            dim=0,
+        )
+
+        if self.raster_mode == "cr":
+            findices, barycentric = self.raster.rasterize_batch(
+                pos_clip.contiguous(), self.pos_idx, resolution
+            )
+            rast_out = torch.cat((barycentric, findices.unsqueeze(-1)), dim=-1)
+        else:
+            raise f"No raster named {self.raster_mode}"
+
+        return rast_out
+
     def raster_interpolate(self, uv, rast_out, uv_idx, rast_db=None, diff_attrs=None):
 
         if self.raster_mode == "cr":
@@ -275,6 +307,23 @@ class MeshRender:
         if texture_data is not None:
             self.set_texture(texture_data)
 
+    def load_prepared_mesh(
+        self,
+        prepared_mesh,
+        scale_factor=1.15,
+        auto_center=True,
+    ):
+        # geometry is already on the device, see utils.render.prepare_mesh
+        self.mesh_copy = prepared_mesh.mesh_bp
+        self.set_mesh(
+            prepared_mesh.v_pos,
+            prepared_mesh.t_pos_idx,
+            vtx_uv=prepared_mesh.v_tex,
+            uv_idx=prepared_mesh.t_pos_idx,
+            scale_factor=scale_factor,
+            auto_center=auto_center,
+        )
+
     def save_mesh(self):
         texture_data = self.get_texture()
         texture_data = Image.fromarray((texture_data * 255).astype(np.uint8))
@@ -290,11 +339,12 @@ class MeshRender:
         auto_center=True,
     ):
 
-        self.vtx_pos = torch.from_numpy(vtx_pos).to(self.device).float()
-        self.pos_idx = torch.from_numpy(pos_idx).to(self.device).to(torch.int)
+        # clone since the axes are flipped in place below
+        self.vtx_pos = torch.as_tensor(vtx_pos, device=self.device).float().clone()
+        self.pos_idx = torch.as_tensor(pos_idx, device=self.device).to(torch.int)
         if (vtx_uv is not None) and (uv_idx is not None):
-            self.vtx_uv = torch.from_numpy(vtx_uv).to(self.device).float()
-            self.uv_idx = torch.from_numpy(uv_idx).to(self.device).to(torch.int)
+            self.vtx_uv = torch.as_tensor(vtx_uv, device=self.device).float().clone()
+            self.uv_idx = torch.as_tensor(uv_idx, device=self.device).to(torch.int)
         else:
             self.vtx_uv = None
             self.uv_idx = None
@@ -304,6 +354,9 @@ class MeshRender:
         if (vtx_uv is not None) and (uv_idx is not None):
             self.vtx_uv[:, 1] = 1.0 - self.vtx_uv[:, 1]
 
+        self._uv_rast = None
+        self._vtx_nrm = None
+
         if auto_center:
             max_bb = (self.vtx_pos - 0).max(0)[0]
             min_bb = (self.vtx_pos - 0).min(0)[0]
@@ -350,6 +403,25 @@ class MeshRender:
     def get_texture(self):
         return self.tex.cpu().numpy()
 
+    def get_vertex_normals(self, mv=None):
+        # mean of the adjacent face normals, computed once per mesh on the device
+        # and rotated into the camera frame when a view matrix is given
+        if self._vtx_nrm is None:
+            pos_idx = self.pos_idx.long()
+            v0 = self.vtx_pos[pos_idx[:, 0], :]
+            v1 = self.vtx_pos[pos_idx[:, 1], :]
+            v2 = self.vtx_pos[pos_idx[:, 2], :]
+            face_normals = F.normalize(torch.cross(v1 - v0, v2 - v0, dim=-1), dim=-1)
+            vtx_nrm = torch.zeros_like(self.vtx_pos)
+            for i in range(3):
+                vtx_nrm.index_add_(0, pos_idx[:, i], face_normals)
+            self._vtx_nrm = F.normalize(vtx_nrm, dim=-1)
+
+        if mv is None:
+            return self._vtx_nrm
+        rot = torch.as_tensor(mv[:3, :3], device=self.device)
+        return torch.matmul(self._vtx_nrm, rot.t()).contiguous()
+
     def to(self, device):
         self.device = device
 
@@ -510,27 +582,17 @@ class MeshRender:
         )
 
         if use_abs_coor:
-            mesh_triangles = self.vtx_pos[self.pos_idx[:, :3], :]
+            vertex_normals = self.get_vertex_normals()
         else:
-            pos_camera = pos_camera[:, :3] / pos_camera[:, 3:4]
-            mesh_triangles = pos_camera[self.pos_idx[:, :3], :]
-        face_normals = F.normalize(
-            torch.cross(
-                mesh_triangles[:, 1, :] - mesh_triangles[:, 0, :],
-                mesh_triangles[:, 2, :] - mesh_triangles[:, 0, :],
-                dim=-1,
-            ),
-            dim=-1,
-        )
-
-        vertex_normals = trimesh.geometry.mean_vertex_normals(
-            vertex_count=self.vtx_pos.shape[0],
-            faces=self.pos_idx.cpu(),
-            face_normals=face_normals.cpu(),
-        )
-        vertex_normals = (
-            torch.from_numpy(vertex_normals).float().to(self.device).contiguous()
-        )
+            r_mv = get_mv_matrix(
+                elev=elev,
+                azim=azim,
+                camera_distance=(
+                    self.camera_distance if camera_distance is None else camera_distance
+                ),
+                center=center,
+            )
+            vertex_normals = self.get_vertex_normals(r_mv)
 
         # Interpolate normal values across the rasterized pixels
         normal, _ = self.raster_interpolate(
@@ -692,14 +754,22 @@ class MeshRender:
             image = Image.fromarray(image.astype(np.uint8))
         return image
 
+    def get_uv_rast(self):
+        # The UV layout does not depend on the camera, rasterize it once per mesh
+        if self._uv_rast is None:
+            vtx_uv = self.vtx_uv * 2 - 1.0
+            vtx_uv = torch.cat(
+                [vtx_uv, torch.zeros_like(self.vtx_uv)], dim=1
+            ).unsqueeze(0)
+            vtx_uv[..., -1] = 1
+            self._uv_rast, _ = self.raster_rasterize(
+                vtx_uv, self.uv_idx, resolution=self.texture_size
+            )
+        return self._uv_rast
+
     def uv_feature_map(self, vert_feat, bg=None):
-        vtx_uv = self.vtx_uv * 2 - 1.0
-        vtx_uv = torch.cat([vtx_uv, torch.zeros_like(self.vtx_uv)], dim=1).unsqueeze(0)
-        vtx_uv[..., -1] = 1
         uv_idx = self.uv_idx
-        rast_out, rast_out_db = self.raster_rasterize(
-            vtx_uv, uv_idx, resolution=self.texture_size
-        )
+        rast_out = self.get_uv_rast()
         feat_map, _ = self.raster_interpolate(vert_feat[None, ...], rast_out, uv_idx)
         feat_map = feat_map[0, ...]
         if bg is not None:
@@ -739,7 +809,14 @@ class MeshRender:
         return sketch_image
 
     def back_project(
-        self, image, elev, azim, camera_distance=None, center=None, method=None
+        self,
+        image,
+        elev,
+        azim,
+        camera_distance=None,
+        center=None,
+        method=None,
+        rast_out=None,
     ):
         if isinstance(image, Image.Image):
             image = torch.tensor(np.array(image) / 255.0)
@@ -765,22 +842,12 @@ class MeshRender:
         pos_camera = transform_pos(r_mv, self.vtx_pos, keepdim=True)
         pos_clip = transform_pos(proj, pos_camera)
         pos_camera = pos_camera[:, :3] / pos_camera[:, 3:4]
-        v0 = pos_camera[self.pos_idx[:, 0], :]
-        v1 = pos_camera[self.pos_idx[:, 1], :]
-        v2 = pos_camera[self.pos_idx[:, 2], :]
-        face_normals = F.normalize(torch.cross(v1 - v0, v2 - v0, dim=-1), dim=-1)
-        vertex_normals = trimesh.geometry.mean_vertex_normals(
-            vertex_count=self.vtx_pos.shape[0],
-            faces=self.pos_idx.cpu(),
-            face_normals=face_normals.cpu(),
-        )
-        vertex_normals = (
-            torch.from_numpy(vertex_normals).float().to(self.device).contiguous()
-        )
+        vertex_normals = self.get_vertex_normals(r_mv)
         tex_depth = pos_camera[:, 2].reshape(1, -1, 1).contiguous()
-        rast_out, rast_out_db = self.raster_rasterize(
-            pos_clip, self.pos_idx, resolution=resolution
-        )
+        if rast_out is None:
+            rast_out, rast_out_db = self.raster_rasterize(
+                pos_clip, self.pos_idx, resolution=resolution
+            )
         visible_mask = torch.clamp(rast_out[..., -1:], 0, 1)[0, ...]
 
         normal, _ = self.raster_interpolate(
@@ -807,8 +874,14 @@ class MeshRender:
         cos_thres = np.cos(self.bake_angle_thres / 180 * np.pi)
         cos_image[cos_image < cos_thres] = 0
 
+        method = self.bake_mode if method is None else method
+
         # shrink
-        kernel_size = self.bake_unreliable_kernel_size * 2 + 1
+        if method == "sample":
+            # views are kept at their native resolution, scale the kernel with them
+            kernel_size = int((2 / 512) * max(resolution[0], resolution[1])) * 2 + 1
+        else:
+            kernel_size = self.bake_unreliable_kernel_size * 2 + 1
         kernel = torch.ones((1, 1, kernel_size, kernel_size), dtype=torch.float32).to(
             sketch_image.device
         )
@@ -826,8 +899,6 @@ class MeshRender:
 
         cos_image[visible_mask == 0] = 0
 
-        method = self.bake_mode if method is None else method
-
         if method == "linear":
             proj_mask = (visible_mask != 0).view(-1)
             uv = uv.squeeze(0).contiguous().view(-1, 2)[proj_mask]
@@ -847,11 +918,81 @@ class MeshRender:
                 uv[..., [1, 0]],
                 sketch_image,
             )
+        elif method == "sample":
+            texture, cos_map, boundary_map = self.sample_back_project(
+                image,
+                pos_clip,
+                tex_depth,
+                vertex_normals,
+                depth,
+                visible_mask,
+                sketch_image,
+                cos_thres,
+            )
         else:
             raise f"No bake mode {method}"
 
         return texture, cos_map, boundary_map
 
+    def sample_back_project(
+        self,
+        image,
+        pos_clip,
+        tex_depth,
+        vertex_normals,
+        depth,
+        visible_mask,
+        sketch_image,
+        cos_thres,
+    ):
+        # Gather from the view into UV space instead of scattering view pixels into
+        # the texture: every texel is projected into the view and looked up there, so
+        # the view can stay at its native resolution while the texture keeps its size.
+        uv_rast = self.get_uv_rast()
+        texel_mask = torch.clamp(uv_rast[..., -1:], 0, 1)[0, ...]
+
+        texel_clip, _ = self.raster_interpolate(pos_clip, uv_rast, self.pos_idx)
+        texel_depth, _ = self.raster_interpolate(tex_depth, uv_rast, self.pos_idx)
+        texel_normal, _ = self.raster_interpolate(
+            vertex_normals[None, ...], uv_rast, self.pos_idx
+        )
+        # the rasterizer maps ndc -1/1 to the first/last pixel centers, which is
+        # exactly grid_sample with align_corners=True
+        grid = texel_clip[..., :2] / texel_clip[..., 3:4]
+        # texels outside the UV islands interpolate to 0 / 0, send them out of the
+        # view instead so that grid_sample reads zeros rather than NaN
+        grid = torch.where(texel_mask > 0, grid, 2.0)
+
+        def lookup(view_map, mode):
+            return F.grid_sample(
+                view_map.permute(2, 0, 1).unsqueeze(0),
+                grid,
+                mode=mode,
+                padding_mode="zeros",
+                align_corners=True,
+            )[0].permute(1, 2, 0)
+
+        texture = lookup(image, self.bake_sample_mode).clamp(0, 1)
+        view_depth = lookup(depth, "nearest")
+        view_mask = lookup(visible_mask, "nearest")
+        boundary_map = lookup(sketch_image, "nearest")
+
+        lookat = torch.tensor([[0, 0, -1]], dtype=torch.float32, device=self.device)
+        cos_map = F.cosine_similarity(lookat, texel_normal.view(-1, 3))
+        cos_map = cos_map.view(*texel_normal.shape[1:3], 1)
+        cos_map[cos_map < cos_thres] = 0
+
+        visible = (
+            (texel_mask > 0)
+            & (view_mask > 0)
+            & ((texel_depth[0] - view_depth).abs() < self.bake_depth_tolerance)
+        )
+        cos_map = cos_map * visible
+        texture = texture * visible
+        boundary_map = boundary_map * visible
+
+        return texture, cos_map, boundary_map
+
     def bake_texture(
         self,
         colors,
@@ -871,9 +1012,16 @@ class MeshRender:
             weights = [1.0 for _ in range(colors)]
         textures = []
         cos_maps = []
-        for color, elev, azim, weight in zip(colors, elevs, azims, weights):
+        rast_outs = [None] * len(colors)
+        if len(set(tuple(color.shape[:2]) for color in colors)) == 1:
+            rast_outs = self.raster_rasterize_views(
+                elevs, azims, colors[0].shape[:2], camera_distance, center
+            ).split(1)
+        for color, elev, azim, weight, rast_out in zip(
+            colors, elevs, azims, weights, rast_outs
+        ):
             texture, cos_map, _ = self.back_project(
-                color, elev, azim, camera_distance, center
+                color, elev, azim, camera_distance, center, rast_out=rast_out
             )
             cos_map = weight * (cos_map**exp)
             textures.append(texture)
@@ -919,3 +1067,104 @@ class MeshRender:
         )
 
         return texture_np
+
+
+def render_vertex_colors(render, vtx_color, elev, azim, resolution):
+    # per-vertex colors seen from a camera, black outside of the mesh
+    _, pos_clip = render.get_pos_from_mvp(elev, azim, None, None)
+    rast_out, _ = render.raster_rasterize(
+        pos_clip, render.pos_idx, resolution=[resolution, resolution]
+    )
+    image, _ = render.raster_interpolate(vtx_color[None, ...], rast_out, render.pos_idx)
+    return image[0] * torch.clamp(rast_out[0, ..., -1:], 0, 1)
+
+
+if __name__ == "__main__":
+    # python -m <package>.step1x3d_texture.differentiable_renderer.mesh_render \
+    #     --mesh <mesh>.glb
+    # quality and time of baking views generated at view_size, LANCZOS-upscaled to
+    # render_size and scattered ("linear"), against sampled at their native
+    # resolution ("sample"), with the cameras of Step1X3DTextureConfig
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mesh", type=str, required=True)
+    parser.add_argument("--view_size", type=int, default=768)
+    parser.add_argument("--render_size", type=int, default=2048)
+    parser.add_argument("--texture_size", type=int, default=2048)
+    parser.add_argument("--frequency", type=float, default=40.0)
+    parser.add_argument("--bake_exp", type=int, default=4)
+    parser.add_argument("--device", type=str, default="cuda")
+    args = parser.parse_args()
+
+    camera_elevs = [0, 0, 0, 0, 90, -90]
+    camera_azims = [0, 90, 180, 270, 180, 180]
+    view_weights = [1, 0.1, 0.5, 0.1, 0.05, 0.05]
+
+    mesh = trimesh.load(args.mesh, force="mesh")
+    if getattr(mesh.visual, "uv", None) is None:
+        import xatlas
+
+        vmapping, indices, uvs = xatlas.parametrize(mesh.vertices, mesh.faces)
+        mesh = trimesh.Trimesh(
+            mesh.vertices[vmapping],
+            indices,
+            visual=trimesh.visual.TextureVisuals(uv=uvs),
+            process=False,
+        )
+
+    for bake_mode in ["linear", "sample"]:
+        render = MeshRender(
+            default_resolution=args.render_size,
+            texture_size=args.texture_size,
+            bake_mode=bake_mode,
+            device=args.device,
+        )
+        render.load_mesh(mesh)
+        # the ground truth texture, with details at the scale of the views
+        vtx_color = 0.5 + 0.5 * torch.sin(args.frequency * render.vtx_pos)
+        expected = render.uv_feature_map(vtx_color)
+        texel_mask = render.get_uv_rast()[0, ..., -1:] > 0
+        # views as the multi-view diffusion returns them
+        views = [
+            Image.fromarray(
+                (
+                    render_vertex_colors(
+                        render, vtx_color, elev, azim, args.view_size
+                    ).cpu().numpy()
+                    * 255
+                )
+                .round()
+                .astype(np.uint8)
+            )
+            for elev, azim in zip(camera_elevs, camera_azims)
+        ]
+
+        if args.device.startswith("cuda"):
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        if bake_mode != "sample":
+            views = [
+                view.resize(
+                    (args.render_size, args.render_size), Image.Resampling.LANCZOS
+                )
+                for view in views
+            ]
+        textures, cos_maps = [], []
+        for view, elev, azim, weight in zip(
+            views, camera_elevs, camera_azims, view_weights
+        ):
+            texture, cos_map, _ = render.back_project(view, elev, azim)
+            textures.append(texture)
+            cos_maps.append(weight * cos_map**args.bake_exp)
+        texture, trust_map = render.fast_bake_texture(textures, cos_maps)
+        if args.device.startswith("cuda"):
+            torch.cuda.synchronize()
+        seconds = time.perf_counter() - start
+
+        assert torch.isfinite(texture).all(), f"NaN in the {bake_mode} texture"
+        covered = (texel_mask & trust_map).expand_as(texture)
+        mse = ((texture - expected) ** 2)[covered].mean().item()
+        print(
+            f"{bake_mode}: {seconds:.2f}s, PSNR {-10 * np.log10(mse):.2f} dB over "
+            f"{covered[..., 0].float().mean().item():.1%} of the texture"
+        )
+
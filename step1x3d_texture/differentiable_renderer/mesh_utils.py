@@ -12,8 +12,18 @@
 # fine-tuning enabling code and other elements of the foregoing made publicly available
 # by Tencent in accordance with TENCENT HUNYUAN COMMUNITY LICENSE AGREEMENT.
 
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import trimesh
 
+from ...step1x3d_geometry.models.pipelines.glb import (
+    GL_ARRAY_BUFFER,
+    GL_ELEMENT_ARRAY_BUFFER,
+    GLBBuilder,
+)
+
 
 def load_mesh(mesh):
     vtx_pos = mesh.vertices if hasattr(mesh, "vertices") else None
@@ -36,3 +46,121 @@ def save_mesh(mesh, texture_data):
     )
     mesh.visual = texture_visuals
     return mesh
+
+
+TEXTURE_FORMATS = {
+    "png": ("PNG", "image/png"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+}
+
+_texture_encoder = None
+
+
+def get_texture_encoder():
+    # a single background thread, PIL releases the GIL while compressing
+    global _texture_encoder
+    if _texture_encoder is None:
+        _texture_encoder = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="texture_encoder"
+        )
+    return _texture_encoder
+
+
+def encode_texture(image, texture_format="png", quality=95, compress_level=6):
+    if texture_format not in TEXTURE_FORMATS:
+        raise ValueError(
+            f"Unknown texture format {texture_format}, expected one of {list(TEXTURE_FORMATS)}."
+        )
+    pil_format, _ = TEXTURE_FORMATS[texture_format]
+    buffer = io.BytesIO()
+    if pil_format == "PNG":
+        image.save(buffer, format="PNG", compress_level=compress_level)
+    else:
+        if image.mode not in ("RGB", "RGBA") or pil_format == "JPEG":
+            image = image.convert("RGB")
+        image.save(buffer, format=pil_format, quality=quality)
+    return buffer.getvalue()
+
+
+def get_texture_image(mesh):
+    material = getattr(mesh.visual, "material", None)
+    if material is None:
+        return None
+    image = getattr(material, "image", None)
+    if image is None:
+        image = getattr(material, "baseColorTexture", None)
+    return image
+
+
+def export_textured_glb(
+    mesh,
+    path,
+    texture_format="png",
+    quality=95,
+    compress_level=6,
+    include_normals=True,
+):
+    """
+    Write a textured trimesh as GLB, encoding the texture on a worker thread
+    while the geometry buffers are packed.
+    """
+    image = get_texture_image(mesh)
+    texture_future = None
+    if image is not None:
+        texture_future = get_texture_encoder().submit(
+            encode_texture, image, texture_format, quality, compress_level
+        )
+
+    builder = GLBBuilder()
+    attributes = {
+        "POSITION": builder.add_accessor(
+            mesh.vertices.astype(np.float32),
+            target=GL_ARRAY_BUFFER,
+            with_bounds=True,
+        )
+    }
+    if include_normals:
+        attributes["NORMAL"] = builder.add_accessor(
+            mesh.vertex_normals.astype(np.float32), target=GL_ARRAY_BUFFER
+        )
+    uv = getattr(mesh.visual, "uv", None)
+    if uv is not None:
+        # glTF puts the uv origin at the top left
+        uv = uv.astype(np.float32)
+        uv[:, 1] = 1.0 - uv[:, 1]
+        attributes["TEXCOORD_0"] = builder.add_accessor(uv, target=GL_ARRAY_BUFFER)
+    primitive = {
+        "attributes": attributes,
+        "indices": builder.add_accessor(
+            mesh.faces.astype(np.uint32).reshape(-1),
+            target=GL_ELEMENT_ARRAY_BUFFER,
+        ),
+        "mode": 4,
+    }
+
+    if texture_future is not None:
+        _, mime_type = TEXTURE_FORMATS[texture_format]
+        image_view = builder.add_buffer_view(texture_future.result())
+        texture = {"sampler": 0, "source": 0}
+        if texture_format == "webp":
+            texture = {"sampler": 0, "extensions": {"EXT_texture_webp": {"source": 0}}}
+            builder.add_extension("EXT_texture_webp", required=True)
+        builder.gltf["images"] = [{"bufferView": image_view, "mimeType": mime_type}]
+        builder.gltf["samplers"] = [{"magFilter": 9729, "minFilter": 9987}]
+        builder.gltf["textures"] = [texture]
+        builder.gltf["materials"] = [
+            {
+                "pbrMetallicRoughness": {
+                    "baseColorTexture": {"index": 0},
+                    "baseColorFactor": [1.0, 1.0, 1.0, 1.0],
+                    "metallicFactor": 0.0,
+                    "roughnessFactor": 1.0,
+                },
+                "doubleSided": False,
+            }
+        ]
+        primitive["material"] = 0
+
+    builder.gltf["meshes"] = [{"primitives": [primitive]}]
+    return builder.write(path)
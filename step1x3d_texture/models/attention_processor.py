@@ -1,5 +1,7 @@
+import argparse
 import math
-from typing import Callable, List, Optional, Union
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
 import torch
 import torch.nn.functional as F
@@ -86,6 +88,52 @@ def set_unet_2d_condition_attn_processor(
     unet.set_attn_processor(attn_procs)
 
 
+def ref_cross_attention(
+    query_ref: torch.FloatTensor,
+    key_ref: torch.FloatTensor,
+    value_ref: torch.FloatTensor,
+    heads: int,
+    head_dim: int,
+    zero_uncond: bool = False,
+) -> torch.FloatTensor:
+    r"""
+    Image cross-attention against reference keys/values shared by consecutive views.
+
+    Args:
+        query_ref (torch.FloatTensor): `(b nv) l (h c)` queries of all views.
+        key_ref (torch.FloatTensor): `b' l' (h c)` reference keys, `b'` must divide
+            the (conditional) query batch; each reference serves `b * nv / b'`
+            consecutive samples without being repeated.
+        value_ref (torch.FloatTensor): `b' l' (h c)` reference values.
+        zero_uncond (bool): the first half of the batch attends all-zero reference
+            states (classifier-free guidance). Zero keys give uniform weights over
+            zero values, so that half is filled with zeros instead of attending.
+    """
+    batch_size, sequence_length, _ = query_ref.shape
+    if zero_uncond:
+        query_ref = query_ref[batch_size // 2 :]
+    ref_batch_size = key_ref.shape[0]
+
+    # fold the samples sharing a reference into the query sequence
+    query_ref = query_ref.reshape(ref_batch_size, -1, heads, head_dim).transpose(1, 2)
+    key_ref = key_ref.view(ref_batch_size, -1, heads, head_dim).transpose(1, 2)
+    value_ref = value_ref.view(ref_batch_size, -1, heads, head_dim).transpose(1, 2)
+
+    hidden_states_ref = F.scaled_dot_product_attention(
+        query_ref, key_ref, value_ref, dropout_p=0.0, is_causal=False
+    )
+    hidden_states_ref = hidden_states_ref.transpose(1, 2).reshape(
+        -1, sequence_length, heads * head_dim
+    )
+
+    if zero_uncond:
+        hidden_states_ref = torch.cat(
+            [torch.zeros_like(hidden_states_ref), hidden_states_ref], dim=0
+        )
+
+    return hidden_states_ref
+
+
 class DecoupledMVRowSelfAttnProcessor2_0(torch.nn.Module):
     r"""
     Attention processor for Decoupled Row-wise Self-Attention and Image Cross-Attention for PyTorch 2.0.
@@ -160,6 +208,8 @@ class DecoupledMVRowSelfAttnProcessor2_0(torch.nn.Module):
         use_mv: bool = True,
         use_ref: bool = True,
         num_views: Optional[int] = None,
+        ref_key_values: Optional[Dict[str, Tuple[torch.FloatTensor]]] = None,
+        ref_zero_uncond: bool = False,
         *args,
         **kwargs,
     ) -> torch.FloatTensor:
@@ -169,6 +219,10 @@ class DecoupledMVRowSelfAttnProcessor2_0(torch.nn.Module):
             ref_hidden_states (torch.FloatTensor): reference encoder hidden states for image cross-attention.
             ref_scale (float): scale for image cross-attention.
             cache_hidden_states (List[torch.FloatTensor]): cache hidden states from reference unet.
+            ref_key_values (Dict[str, Tuple[torch.FloatTensor]]): precomputed reference keys/values
+                (see `get_ref_key_value`), used instead of `ref_hidden_states`.
+            ref_zero_uncond (bool): the first half of the batch is the all-zero unconditional
+                reference branch of classifier-free guidance.
 
         """
         if len(args) > 0 or kwargs.get("scale", None) is not None:
@@ -323,25 +377,20 @@ class DecoupledMVRowSelfAttnProcessor2_0(torch.nn.Module):
             hidden_states_mv = self.to_out_mv[1](hidden_states_mv)
 
         if use_ref:
-            reference_hidden_states = ref_hidden_states[self.name]
-
-            key_ref = self.to_k_ref(reference_hidden_states)
-            value_ref = self.to_v_ref(reference_hidden_states)
-
-            query_ref = query_ref.view(batch_size, -1, attn.heads, head_dim).transpose(
-                1, 2
-            )
-            key_ref = key_ref.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
-            value_ref = value_ref.view(batch_size, -1, attn.heads, head_dim).transpose(
-                1, 2
-            )
-
-            hidden_states_ref = F.scaled_dot_product_attention(
-                query_ref, key_ref, value_ref, dropout_p=0.0, is_causal=False
-            )
+            if ref_key_values is not None:
+                key_ref, value_ref = ref_key_values[self.name]
+            else:
+                key_ref, value_ref = self.get_ref_key_value(
+                    ref_hidden_states[self.name]
+                )
 
-            hidden_states_ref = hidden_states_ref.transpose(1, 2).reshape(
-                batch_size, -1, attn.heads * head_dim
+            hidden_states_ref = ref_cross_attention(
+                query_ref,
+                key_ref,
+                value_ref,
+                attn.heads,
+                head_dim,
+                zero_uncond=ref_zero_uncond,
             )
             hidden_states_ref = hidden_states_ref.to(query.dtype)
 
@@ -373,6 +422,13 @@ class DecoupledMVRowSelfAttnProcessor2_0(torch.nn.Module):
 
         return hidden_states
 
+    def get_ref_key_value(
+        self, reference_hidden_states: torch.FloatTensor
+    ) -> Tuple[torch.FloatTensor]:
+        return self.to_k_ref(reference_hidden_states), self.to_v_ref(
+            reference_hidden_states
+        )
+
     def set_num_views(self, num_views: int) -> None:
         self.num_views = num_views
 
@@ -402,6 +458,7 @@ class DecoupledMVRowColSelfAttnProcessor2_0(torch.nn.Module):
         self.name = name  # NOTE: need for image cross-attention
         self.use_mv = use_mv
         self.use_ref = use_ref
+        self._mv_index_cache = {}
 
         if self.use_mv:
             self.to_q_mv = nn.Linear(
@@ -451,6 +508,8 @@ class DecoupledMVRowColSelfAttnProcessor2_0(torch.nn.Module):
         use_mv: bool = True,
         use_ref: bool = True,
         num_views: Optional[int] = None,
+        ref_key_values: Optional[Dict[str, Tuple[torch.FloatTensor]]] = None,
+        ref_zero_uncond: bool = False,
         *args,
         **kwargs,
     ) -> torch.FloatTensor:
@@ -460,6 +519,10 @@ class DecoupledMVRowColSelfAttnProcessor2_0(torch.nn.Module):
             ref_hidden_states (torch.FloatTensor): reference encoder hidden states for image cross-attention.
             ref_scale (float): scale for image cross-attention.
             cache_hidden_states (List[torch.FloatTensor]): cache hidden states from reference unet.
+            ref_key_values (Dict[str, Tuple[torch.FloatTensor]]): precomputed reference keys/values
+                (see `get_ref_key_value`), used instead of `ref_hidden_states`.
+            ref_zero_uncond (bool): the first half of the batch is the all-zero unconditional
+                reference branch of classifier-free guidance.
 
         """
         if len(args) > 0 or kwargs.get("scale", None) is not None:
@@ -554,132 +617,8 @@ class DecoupledMVRowColSelfAttnProcessor2_0(torch.nn.Module):
             key_mv = self.to_k_mv(encoder_hidden_states)
             value_mv = self.to_v_mv(encoder_hidden_states)
 
-            query_mv = query_mv.view(batch_size, -1, attn.heads, head_dim)
-            key_mv = key_mv.view(batch_size, -1, attn.heads, head_dim)
-            value_mv = value_mv.view(batch_size, -1, attn.heads, head_dim)
-
-            height = width = math.isqrt(sequence_length)
-
-            query_mv = rearrange(
-                query_mv,
-                "(b nv) (ih iw) h c -> b nv ih iw h c",
-                nv=self.num_views,
-                ih=height,
-                iw=width,
-            )
-            key_mv = rearrange(
-                key_mv,
-                "(b nv) (ih iw) h c -> b nv ih iw h c",
-                nv=self.num_views,
-                ih=height,
-                iw=width,
-            )
-            value_mv = rearrange(
-                value_mv,
-                "(b nv) (ih iw) h c -> b nv ih iw h c",
-                nv=self.num_views,
-                ih=height,
-                iw=width,
-            )
-
-            # row-wise attention for view 0123 (front, right, back, left)
-            query_mv_0123 = rearrange(
-                query_mv[:, 0:4], "b nv ih iw h c -> (b ih) h (nv iw) c"
-            )
-            key_mv_0123 = rearrange(
-                key_mv[:, 0:4], "b nv ih iw h c -> (b ih) h (nv iw) c"
-            )
-            value_mv_0123 = rearrange(
-                value_mv[:, 0:4], "b nv ih iw h c -> (b ih) h (nv iw) c"
-            )
-            hidden_states_mv_0123 = F.scaled_dot_product_attention(
-                query_mv_0123,
-                key_mv_0123,
-                value_mv_0123,
-                dropout_p=0.0,
-                is_causal=False,
-            )
-            hidden_states_mv_0123 = rearrange(
-                hidden_states_mv_0123,
-                "(b ih) h (nv iw) c -> b nv (ih iw) (h c)",
-                ih=height,
-                iw=height,
-            )
-
-            # col-wise attention for view 0245 (front, back, top, bottom)
-            # flip first
-            query_mv_0245 = torch.cat(
-                [
-                    torch.flip(query_mv[:, [0]], [3]),  # horizontal flip
-                    query_mv[:, [2, 4, 5]],
-                ],
-                dim=1,
-            )
-            key_mv_0245 = torch.cat(
-                [
-                    torch.flip(key_mv[:, [0]], [3]),  # horizontal flip
-                    key_mv[:, [2, 4, 5]],
-                ],
-                dim=1,
-            )
-            value_mv_0245 = torch.cat(
-                [
-                    torch.flip(value_mv[:, [0]], [3]),  # horizontal flip
-                    value_mv[:, [2, 4, 5]],
-                ],
-                dim=1,
-            )
-            # attention
-            query_mv_0245 = rearrange(
-                query_mv_0245, "b nv ih iw h c -> (b iw) h (nv ih) c"
-            )
-            key_mv_0245 = rearrange(key_mv_0245, "b nv ih iw h c -> (b iw) h (nv ih) c")
-            value_mv_0245 = rearrange(
-                value_mv_0245, "b nv ih iw h c -> (b iw) h (nv ih) c"
-            )
-            hidden_states_mv_0245 = F.scaled_dot_product_attention(
-                query_mv_0245,
-                key_mv_0245,
-                value_mv_0245,
-                dropout_p=0.0,
-                is_causal=False,
-            )
-            # flip back
-            hidden_states_mv_0245 = rearrange(
-                hidden_states_mv_0245,
-                "(b iw) h (nv ih) c -> b nv ih iw (h c)",
-                ih=height,
-                iw=height,
-            )
-            hidden_states_mv_0245 = torch.cat(
-                [
-                    torch.flip(hidden_states_mv_0245[:, [0]], [3]),  # horizontal flip
-                    hidden_states_mv_0245[:, [1, 2, 3]],
-                ],
-                dim=1,
-            )
-            hidden_states_mv_0245 = hidden_states_mv_0245.view(
-                hidden_states_mv_0245.shape[0],
-                hidden_states_mv_0245.shape[1],
-                -1,
-                hidden_states_mv_0245.shape[-1],
-            )
-
-            # combine row and col
-            hidden_states_mv = torch.stack(
-                [
-                    (hidden_states_mv_0123[:, 0] + hidden_states_mv_0245[:, 0]) / 2,
-                    hidden_states_mv_0123[:, 1],
-                    (hidden_states_mv_0123[:, 2] + hidden_states_mv_0245[:, 1]) / 2,
-                    hidden_states_mv_0123[:, 3],
-                    hidden_states_mv_0245[:, 2],
-                    hidden_states_mv_0245[:, 3],
-                ],
-                dim=1,
-            )
-
-            hidden_states_mv = hidden_states_mv.view(
-                -1, hidden_states_mv.shape[-2], hidden_states_mv.shape[-1]
+            hidden_states_mv = self.row_col_attention(
+                query_mv, key_mv, value_mv, attn.heads
             )
             hidden_states_mv = hidden_states_mv.to(query.dtype)
 
@@ -689,25 +628,20 @@ class DecoupledMVRowColSelfAttnProcessor2_0(torch.nn.Module):
             hidden_states_mv = self.to_out_mv[1](hidden_states_mv)
 
         if use_ref:
-            reference_hidden_states = ref_hidden_states[self.name]
-
-            key_ref = self.to_k_ref(reference_hidden_states)
-            value_ref = self.to_v_ref(reference_hidden_states)
-
-            query_ref = query_ref.view(batch_size, -1, attn.heads, head_dim).transpose(
-                1, 2
-            )
-            key_ref = key_ref.view(batch_size, -1, attn.heads, head_dim).transpose(1, 2)
-            value_ref = value_ref.view(batch_size, -1, attn.heads, head_dim).transpose(
-                1, 2
-            )
-
-            hidden_states_ref = F.scaled_dot_product_attention(
-                query_ref, key_ref, value_ref, dropout_p=0.0, is_causal=False
-            )
+            if ref_key_values is not None:
+                key_ref, value_ref = ref_key_values[self.name]
+            else:
+                key_ref, value_ref = self.get_ref_key_value(
+                    ref_hidden_states[self.name]
+                )
 
-            hidden_states_ref = hidden_states_ref.transpose(1, 2).reshape(
-                batch_size, -1, attn.heads * head_dim
+            hidden_states_ref = ref_cross_attention(
+                query_ref,
+                key_ref,
+                value_ref,
+                attn.heads,
+                head_dim,
+                zero_uncond=ref_zero_uncond,
             )
             hidden_states_ref = hidden_states_ref.to(query.dtype)
 
@@ -739,5 +673,231 @@ class DecoupledMVRowColSelfAttnProcessor2_0(torch.nn.Module):
 
         return hidden_states
 
+    def row_col_attention(
+        self,
+        query_mv: torch.FloatTensor,
+        key_mv: torch.FloatTensor,
+        value_mv: torch.FloatTensor,
+        heads: int,
+    ) -> torch.FloatTensor:
+        r"""
+        Row-wise attention for view 0123 (front, right, back, left) and col-wise
+        attention for view 0245 (front, back, top, bottom) of `(b nv) (ih iw) c`
+        projections. Both groups share the sequence length, so they are gathered
+        for all views and run at once.
+        """
+        batch_size, sequence_length, inner_dim = query_mv.shape
+        head_dim = inner_dim // heads
+        height = width = math.isqrt(sequence_length)
+        mv_index, mv_weight = self.get_mv_index(height, width, query_mv.device)
+
+        num_groups = (height + width) * (batch_size // self.num_views)
+        query_mv = query_mv.reshape(batch_size // self.num_views, -1, inner_dim)
+        key_mv = key_mv.reshape(batch_size // self.num_views, -1, inner_dim)
+        value_mv = value_mv.reshape(batch_size // self.num_views, -1, inner_dim)
+
+        query_mv = (
+            query_mv.index_select(1, mv_index)
+            .view(num_groups, -1, heads, head_dim)
+            .transpose(1, 2)
+        )
+        key_mv = (
+            key_mv.index_select(1, mv_index)
+            .view(num_groups, -1, heads, head_dim)
+            .transpose(1, 2)
+        )
+        value_mv = (
+            value_mv.index_select(1, mv_index)
+            .view(num_groups, -1, heads, head_dim)
+            .transpose(1, 2)
+        )
+        hidden_states_mv = F.scaled_dot_product_attention(
+            query_mv,
+            key_mv,
+            value_mv,
+            dropout_p=0.0,
+            is_causal=False,
+        )
+        hidden_states_mv = hidden_states_mv.transpose(1, 2).reshape(
+            batch_size // self.num_views, -1, inner_dim
+        )
+
+        # scatter back to the views, front and back average their row and col
+        hidden_states_mv = torch.zeros(
+            batch_size // self.num_views,
+            self.num_views * sequence_length,
+            inner_dim,
+            dtype=hidden_states_mv.dtype,
+            device=hidden_states_mv.device,
+        ).index_add_(1, mv_index, hidden_states_mv)
+        hidden_states_mv.mul_(mv_weight.to(hidden_states_mv.dtype))
+        return hidden_states_mv.view(batch_size, sequence_length, inner_dim)
+
+    def get_mv_index(
+        self, height: int, width: int, device: torch.device
+    ) -> Tuple[torch.LongTensor, torch.FloatTensor]:
+        r"""
+        Token indices of the row groups of view 0123 followed by the col groups of
+        view 0245 (front flipped horizontally) within the `(nv ih iw)` tokens of a
+        sample, and the inverse number of groups each token belongs to.
+        """
+        key = (self.num_views, height, width, device)
+        if key not in self._mv_index_cache:
+            token = torch.arange(
+                self.num_views * height * width, device=device
+            ).view(self.num_views, height, width)
+            row_index = rearrange(token[0:4], "nv ih iw -> ih (nv iw)")
+            col_index = torch.cat(
+                [
+                    torch.flip(token[[0]], [2]),  # horizontal flip
+                    token[[2, 4, 5]],
+                ],
+                dim=0,
+            )
+            col_index = rearrange(col_index, "nv ih iw -> iw (nv ih)")
+            mv_index = torch.cat([row_index, col_index], dim=0).flatten()
+            mv_weight = 1.0 / torch.bincount(mv_index, minlength=token.numel())
+            self._mv_index_cache[key] = (mv_index, mv_weight[None, :, None])
+        return self._mv_index_cache[key]
+
+    def get_ref_key_value(
+        self, reference_hidden_states: torch.FloatTensor
+    ) -> Tuple[torch.FloatTensor]:
+        return self.to_k_ref(reference_hidden_states), self.to_v_ref(
+            reference_hidden_states
+        )
+
     def set_num_views(self, num_views: int) -> None:
         self.num_views = num_views
+
+
+def _row_col_attention_rearrange(
+    query_mv: torch.FloatTensor,
+    key_mv: torch.FloatTensor,
+    value_mv: torch.FloatTensor,
+    heads: int,
+    num_views: int = 6,
+) -> torch.FloatTensor:
+    # the rearrange/cat version of DecoupledMVRowColSelfAttnProcessor2_0
+    # .row_col_attention, kept as the reference of the benchmark below
+    batch_size, sequence_length, inner_dim = query_mv.shape
+    head_dim = inner_dim // heads
+    height = width = math.isqrt(sequence_length)
+
+    qkv = []
+    for x in [query_mv, key_mv, value_mv]:
+        x = x.view(batch_size, -1, heads, head_dim)
+        qkv.append(
+            rearrange(
+                x,
+                "(b nv) (ih iw) h c -> b nv ih iw h c",
+                nv=num_views,
+                ih=height,
+                iw=width,
+            )
+        )
+
+    # row-wise attention for view 0123 (front, right, back, left)
+    hidden_states_mv_0123 = F.scaled_dot_product_attention(
+        *[rearrange(x[:, 0:4], "b nv ih iw h c -> (b ih) h (nv iw) c") for x in qkv],
+        dropout_p=0.0,
+        is_causal=False,
+    )
+    hidden_states_mv_0123 = rearrange(
+        hidden_states_mv_0123,
+        "(b ih) h (nv iw) c -> b nv (ih iw) (h c)",
+        ih=height,
+        iw=width,
+    )
+
+    # col-wise attention for view 0245 (front, back, top, bottom), flip first
+    qkv_0245 = [
+        torch.cat([torch.flip(x[:, [0]], [3]), x[:, [2, 4, 5]]], dim=1)
+        for x in qkv
+    ]
+    hidden_states_mv_0245 = F.scaled_dot_product_attention(
+        *[rearrange(x, "b nv ih iw h c -> (b iw) h (nv ih) c") for x in qkv_0245],
+        dropout_p=0.0,
+        is_causal=False,
+    )
+    # flip back
+    hidden_states_mv_0245 = rearrange(
+        hidden_states_mv_0245,
+        "(b iw) h (nv ih) c -> b nv ih iw (h c)",
+        ih=height,
+        iw=width,
+    )
+    hidden_states_mv_0245 = torch.cat(
+        [
+            torch.flip(hidden_states_mv_0245[:, [0]], [3]),
+            hidden_states_mv_0245[:, [1, 2, 3]],
+        ],
+        dim=1,
+    )
+    hidden_states_mv_0245 = hidden_states_mv_0245.flatten(2, 3)
+
+    # combine row and col
+    hidden_states_mv = torch.stack(
+        [
+            (hidden_states_mv_0123[:, 0] + hidden_states_mv_0245[:, 0]) / 2,
+            hidden_states_mv_0123[:, 1],
+            (hidden_states_mv_0123[:, 2] + hidden_states_mv_0245[:, 1]) / 2,
+            hidden_states_mv_0123[:, 3],
+            hidden_states_mv_0245[:, 2],
+            hidden_states_mv_0245[:, 3],
+        ],
+        dim=1,
+    )
+    return hidden_states_mv.view(-1, sequence_length, inner_dim)
+
+
+if __name__ == "__main__":
+    # python -m <package>.step1x3d_texture.models.attention_processor
+    # equivalence on the CPU, then time and peak memory on the GPU, of the
+    # gathered row/col attention against the rearrange/cat version
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch_size", type=int, default=2)
+    parser.add_argument("--resolutions", type=int, nargs="+", default=[32, 64])
+    parser.add_argument("--inner_dim", type=int, default=640)
+    parser.add_argument("--heads", type=int, default=10)
+    parser.add_argument("--num_iters", type=int, default=20)
+    args = parser.parse_args()
+
+    num_views = 6
+    processor = DecoupledMVRowColSelfAttnProcessor2_0(
+        args.inner_dim, args.inner_dim, num_views=num_views, use_mv=False
+    )
+    paths = {
+        "rearrange": lambda q, k, v: _row_col_attention_rearrange(
+            q, k, v, args.heads, num_views
+        ),
+        "gathered": lambda q, k, v: processor.row_col_attention(q, k, v, args.heads),
+    }
+
+    torch.manual_seed(0)
+    for resolution in args.resolutions:
+        shape = (args.batch_size * num_views, resolution**2, args.inner_dim)
+        qkv = [torch.randn(shape) for _ in range(3)]
+        expected = paths["rearrange"](*qkv)
+        diff = (paths["gathered"](*qkv) - expected).abs().max().item()
+        print(f"{resolution}x{resolution} cpu: max abs diff {diff:.2e}")
+        assert diff < 1e-5, "Gathered row/col attention differs from the reference"
+
+        if not torch.cuda.is_available():
+            continue
+        qkv = [x.to("cuda", torch.float16) for x in qkv]
+        for name, fn in paths.items():
+            fn(*qkv)  # warmup, builds the index of the gathered path
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+            baseline = torch.cuda.memory_allocated()
+            start = time.perf_counter()
+            for _ in range(args.num_iters):
+                fn(*qkv)
+            torch.cuda.synchronize()
+            seconds = (time.perf_counter() - start) / args.num_iters
+            peak = (torch.cuda.max_memory_allocated() - baseline) / (1 << 20)
+            print(
+                f"{resolution}x{resolution} {name}: {seconds * 1000:.2f} ms, "
+                f"peak {peak:.1f} MiB above the inputs"
+            )
@@ -638,19 +638,20 @@ class IG2MVSDXLPipeline(StableDiffusionXLPipeline, CustomAdapterMixin):
                 },
                 return_dict=False,
             )
-            ref_hidden_states = {
-                k: v.repeat_interleave(num_images_per_prompt, dim=0)
-                for k, v in ref_hidden_states.items()
-            }
-        if self.do_classifier_free_guidance:
-            ref_hidden_states = {
-                k: torch.cat([torch.zeros_like(v), v], dim=0)
-                for k, v in ref_hidden_states.items()
+
+            # reference keys/values do not change across denoising steps, project them
+            # once per layer; they are shared by all views and the all-zero
+            # unconditional branch is handled inside the processors
+            ref_key_values = {
+                name: processor.get_ref_key_value(ref_hidden_states[name])
+                for name, processor in self.unet.attn_processors.items()
+                if getattr(processor, "use_ref", False) and name in ref_hidden_states
             }
 
         cross_attention_kwargs = {
             "mv_scale": mv_scale,
-            "ref_hidden_states": {k: v.clone() for k, v in ref_hidden_states.items()},
+            "ref_key_values": ref_key_values,
+            "ref_zero_uncond": self.do_classifier_free_guidance,
             "ref_scale": reference_conditioning_scale,
             "num_views": num_images_per_prompt,
             **(self.cross_attention_kwargs or {}),
@@ -18,13 +18,21 @@ from ..utils import (
     make_image_grid,
     tensor_to_image,
 )
-from ..utils.render import NVDiffRastContextWrapper, load_mesh, render
+from ..utils.render import (
+    NVDiffRastContextWrapper,
+    PreparedMesh,
+    prepare_mesh,
+    render,
+)
 from ..differentiable_renderer.mesh_render import MeshRender
 import trimesh
 import xatlas
 import scipy.sparse
 from scipy.sparse.linalg import spsolve
-from ...step1x3d_geometry.models.pipelines.pipeline_utils import smart_load_model
+from ...step1x3d_geometry.models.pipelines.pipeline_utils import (
+    flatten_scene,
+    smart_load_model,
+)
 
 
 class Step1X3DTextureConfig:
@@ -59,6 +67,10 @@ class Step1X3DTextureConfig:
         self.texture_size = 2048
         self.bake_exp = 4
         self.merge_method = "fast"
+        # "linear" upsamples the views to render_size and scatters them into the
+        # texture, "sample" looks the native views up from UV space
+        self.bake_mode = "linear"
+        self.bake_sample_mode = "bilinear"
 
 
 class Step1X3DTexturePipeline:
@@ -68,7 +80,10 @@ class Step1X3DTexturePipeline:
             default_resolution=self.config.render_size,
             texture_size=self.config.texture_size,
             camera_distance=self.config.camera_distance,
+            bake_mode=self.config.bake_mode,
         )
+        self.mesh_render.bake_sample_mode = self.config.bake_sample_mode
+        self.raster_ctx = None
 
         self.ig2mv_pipe = self.prepare_ig2mv_pipeline(
             base_model=self.config.base_model,
@@ -90,9 +105,20 @@ class Step1X3DTexturePipeline:
         config.adapter_path = local_model_path
         return cls(config)
 
+    def get_raster_ctx(self, device):
+        # creating a rasterization context is expensive, keep one for the pipeline
+        if self.raster_ctx is None:
+            self.raster_ctx = NVDiffRastContextWrapper(device=device, context_type="cuda")
+        return self.raster_ctx
+
+    def prepare_mesh(self, mesh, device):
+        if isinstance(mesh, trimesh.Scene):
+            mesh = flatten_scene(mesh)
+        return prepare_mesh(mesh, rescale=True, device=device)
+
     def mesh_uv_wrap(self, mesh):
         if isinstance(mesh, trimesh.Scene):
-            mesh = mesh.to_geometry()
+            mesh = flatten_scene(mesh)
         vmapping, indices, uvs = xatlas.parametrize(mesh.vertices, mesh.faces)
         mesh.vertices = mesh.vertices[vmapping]
         mesh.faces = indices
@@ -220,9 +246,12 @@ class Step1X3DTexturePipeline:
             azimuth_deg=[x - 90 for x in [0, 90, 180, 270, 180, 180]],
             device=device,
         )
-        ctx = NVDiffRastContextWrapper(device=device, context_type="cuda")
+        ctx = self.get_raster_ctx(device)
 
-        mesh, mesh_bp = load_mesh(mesh, rescale=True, device=device)
+        if not isinstance(mesh, PreparedMesh):
+            mesh = self.prepare_mesh(mesh, device)
+        prepared_mesh = mesh
+        mesh, mesh_bp = prepared_mesh.mesh, prepared_mesh.mesh_bp
         render_out = render(
             ctx,
             mesh,
@@ -293,11 +322,15 @@ class Step1X3DTexturePipeline:
     ):
         project_textures, project_weighted_cos_maps = [], []
         project_boundary_maps = []
-        for view, camera_elev, camera_azim, weight in zip(
-            views, camera_elevs, camera_azims, view_weights
+        # the views share one resolution, rasterize all cameras at once
+        rast_outs = render.raster_rasterize_views(
+            camera_elevs, camera_azims, (views[0].height, views[0].width)
+        ).split(1)
+        for view, camera_elev, camera_azim, weight, rast_out in zip(
+            views, camera_elevs, camera_azims, view_weights, rast_outs
         ):
             project_texture, project_cos_map, project_boundary_map = (
-                render.back_project(view, camera_elev, camera_azim)
+                render.back_project(view, camera_elev, camera_azim, rast_out=rast_out)
             )
             project_cos_map = weight * (project_cos_map**bake_exp)
             project_textures.append(project_texture)
@@ -338,14 +371,14 @@ class Step1X3DTexturePipeline:
         else:
             remove_bg_fn = None
 
-        if isinstance(mesh, trimesh.Scene):
-            mesh = mesh.to_geometry()
+        # geometry is normalized, uv-wrapped and uploaded once for the whole job
+        prepared_mesh = self.prepare_mesh(mesh, self.config.device)
 
         # multi-view generation pipeline
         images, pos_images, normal_images, reference_image, textured_mesh, mesh_bp = (
             self.run_ig2mv_pipeline(
                 self.ig2mv_pipe,
-                mesh=mesh,
+                mesh=prepared_mesh,
                 num_views=self.config.num_views,
                 text=self.config.text,
                 image=image,
@@ -362,14 +395,16 @@ class Step1X3DTexturePipeline:
             )
         )
 
-        for i in range(len(images)):
-            images[i] = images[i].resize(
-                (self.config.render_size, self.config.render_size),
-                Image.Resampling.LANCZOS,
-            )
+        if self.config.bake_mode != "sample":
+            for i in range(len(images)):
+                images[i] = images[i].resize(
+                    (self.config.render_size, self.config.render_size),
+                    Image.Resampling.LANCZOS,
+                )
 
-        mesh = self.mesh_uv_wrap(mesh_bp)
-        self.mesh_render.load_mesh(mesh, auto_center=False, scale_factor=1.0)
+        self.mesh_render.load_prepared_mesh(
+            prepared_mesh, auto_center=False, scale_factor=1.0
+        )
 
         # texture baker
         texture, mask = self.bake_from_multiview(
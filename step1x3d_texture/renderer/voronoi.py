@@ -5,7 +5,11 @@ Program to compute Voronoi diagram using JFA.
 @version September 2022
 """
 
-import cupy as cp
+try:
+    import cupy as cp
+except ImportError:
+    # texture filling falls back to the torch implementation of the passes
+    cp = None
 from random import sample
 
 # global variables
@@ -15,7 +19,7 @@ noSeeds = 1024
 
 # diagram is represented as a 2d array where each element is
 # x coord of source * y_dim + y coord of source
-ping = cp.full((x_dim, y_dim), -1, dtype=int)
+ping = cp.full((x_dim, y_dim), -1, dtype=int) if cp is not None else None
 pong = None
 
 
@@ -46,7 +50,7 @@ def test_performance():
         process_tensors(tensor1, tensor2)
 
 
-def voronoi_solve(texture, mask, device="cuda"):
+def voronoi_solve(texture, mask, device="cuda", backend=None):
     """
     This is a warpper of the original cupy voronoi implementation
     The texture color where mask value is 1 will propagate to its
@@ -54,9 +58,14 @@ def voronoi_solve(texture, mask, device="cuda"):
     args:
         texture - A multi-channel tensor, (H, W, C)
         mask - A single-channel tensor, (H, W)
+        backend - "cupy" or "torch", by default cupy is used for cuda
+            devices when it is installed
     return:
         texture - Propagated tensor
     """
+    if backend is None:
+        use_cupy = cp is not None and torch.device(device).type == "cuda"
+        backend = "cupy" if use_cupy else "torch"
     h, w, c = texture.shape
     # hwc_texture = texture.permute(1,2,0)
     valid_pix_coord = torch.where(mask > 0)
@@ -65,11 +74,16 @@ def voronoi_solve(texture, mask, device="cuda"):
     idx_map = -1 * torch.ones((h, w), dtype=torch.int64).to(device)
     idx_map[valid_pix_coord] = indices[valid_pix_coord]
 
-    ping = cp.asarray(idx_map)
-    pong = cp.copy(ping)
-    ping = JFAVoronoiDiagram(ping, pong)
+    if backend == "cupy":
+        ping = cp.asarray(idx_map)
+        pong = cp.copy(ping)
+        ping = JFAVoronoiDiagram(ping, pong)
+        voronoi_map = torch.as_tensor(ping, device=device)
+    elif backend == "torch":
+        voronoi_map = TorchJFAVoronoiDiagram(idx_map, idx_map.clone())
+    else:
+        raise ValueError(f"Unknown voronoi backend {backend}")
 
-    voronoi_map = torch.as_tensor(ping, device=device)
     nc_voronoi_texture = torch.index_select(
         texture.reshape(h * w, c), 0, voronoi_map.reshape(h * w)
     )
@@ -99,50 +113,50 @@ def generateRandomSeeds(n):
     pong = cp.copy(ping)
 
 
-displayKernel = cp.ElementwiseKernel(
-    "int64 x", "int64 y", f"y = (x < 0) ? x : x % 103", "displayTransform"
-)
-
-
-voronoiKernel = cp.RawKernel(
-    r"""
-    extern "C" __global__
-    void voronoiPass(const long long step, const long long xDim, const long long yDim, const long long *ping, long long *pong) {
-        long long idx = blockIdx.x * blockDim.x + threadIdx.x;
-        long long stp = blockDim.x * gridDim.x;
-
-        for (long long k = idx; k < xDim * yDim; k += stp) {
-            long long dydx[] = {-1, 0, 1};
-            for (int i = 0; i < 3; ++i) {
-                for (int j = 0; j < 3; ++j) {
-                    long long dx = (step * dydx[i]) * yDim;
-                    long long dy = step * dydx[j];
-                    long long src = k + dx + dy;
-                    if (src < 0 || src >= xDim * yDim) 
-                        continue;
-                    if (ping[src] == -1)
-                        continue;
-                    if (pong[k] == -1) {
-                        pong[k] = ping[src];
-                        continue;
+if cp is not None:
+    displayKernel = cp.ElementwiseKernel(
+        "int64 x", "int64 y", f"y = (x < 0) ? x : x % 103", "displayTransform"
+    )
+
+    voronoiKernel = cp.RawKernel(
+        r"""
+        extern "C" __global__
+        void voronoiPass(const long long step, const long long xDim, const long long yDim, const long long *ping, long long *pong) {
+            long long idx = blockIdx.x * blockDim.x + threadIdx.x;
+            long long stp = blockDim.x * gridDim.x;
+
+            for (long long k = idx; k < xDim * yDim; k += stp) {
+                long long dydx[] = {-1, 0, 1};
+                for (int i = 0; i < 3; ++i) {
+                    for (int j = 0; j < 3; ++j) {
+                        long long dx = (step * dydx[i]) * yDim;
+                        long long dy = step * dydx[j];
+                        long long src = k + dx + dy;
+                        if (src < 0 || src >= xDim * yDim) 
+                            continue;
+                        if (ping[src] == -1)
+                            continue;
+                        if (pong[k] == -1) {
+                            pong[k] = ping[src];
+                            continue;
+                        }
+                        long long x1 = k / yDim;
+                        long long y1 = k % yDim;
+                        long long x2 = pong[k] / yDim;
+                        long long y2 = pong[k] % yDim;
+                        long long x3 = ping[src] / yDim;
+                        long long y3 = ping[src] % yDim;
+                        long long curr_dist = (x1 - x2) * (x1 - x2) + (y1 - y2) * (y1 - y2);
+                        long long jump_dist = (x1 - x3) * (x1 - x3) + (y1 - y3) * (y1 - y3);
+                        if (jump_dist < curr_dist)
+                            pong[k] = ping[src];
                     }
-                    long long x1 = k / yDim;
-                    long long y1 = k % yDim;
-                    long long x2 = pong[k] / yDim;
-                    long long y2 = pong[k] % yDim;
-                    long long x3 = ping[src] / yDim;
-                    long long y3 = ping[src] % yDim;
-                    long long curr_dist = (x1 - x2) * (x1 - x2) + (y1 - y2) * (y1 - y2);
-                    long long jump_dist = (x1 - x3) * (x1 - x3) + (y1 - y3) * (y1 - y3);
-                    if (jump_dist < curr_dist)
-                        pong[k] = ping[src];
                 }
             }
         }
-    }
-    """,
-    "voronoiPass",
-)
+        """,
+        "voronoiPass",
+    )
 
 
 """
@@ -170,3 +184,42 @@ def JFAVoronoiDiagram(ping, pong):
         step //= 2
         # displayDiagram(frame, ping)
     return ping
+
+
+def TorchJFAVoronoiDiagram(ping, pong):
+    """
+    Backend-agnostic version of JFAVoronoiDiagram running the passes of
+    voronoiKernel with vectorized torch ops, so it works on cpu and gpu.
+    The neighbours are visited in the kernel's order with the same strict
+    comparison and flat index offsets, so the seed assignment is identical.
+    """
+    x_dim, y_dim = ping.shape
+    num_pixels = x_dim * y_dim
+    ping = ping.reshape(-1)
+    pong = pong.reshape(-1)
+    k = torch.arange(num_pixels, device=ping.device)
+    x1 = k // y_dim
+    y1 = k % y_dim
+
+    def sq_dist(src):
+        return (x1 - src // y_dim) ** 2 + (y1 - src % y_dim) ** 2
+
+    step = max(x_dim, y_dim) // 2
+    while step:
+        curr = pong.clone()
+        curr_dist = sq_dist(curr)
+        for i in (-1, 0, 1):
+            for j in (-1, 0, 1):
+                offset = step * i * y_dim + step * j
+                jump = torch.full_like(ping, -1)
+                if offset >= 0:
+                    jump[: num_pixels - offset] = ping[offset:]
+                else:
+                    jump[-offset:] = ping[: num_pixels + offset]
+                jump_dist = sq_dist(jump)
+                update = (jump != -1) & ((curr == -1) | (jump_dist < curr_dist))
+                curr = torch.where(update, jump, curr)
+                curr_dist = torch.where(update, jump_dist, curr_dist)
+        ping, pong = curr, ping
+        step //= 2
+    return ping.reshape(x_dim, y_dim)
@@ -16,7 +16,12 @@ from ..schedulers.scheduling_shift_snr import ShiftSNRScheduler
 from ..utils.core import find
 from ..utils.typing import *
 from .base import BaseSystem
-from .utils import encode_prompt, vae_encode
+from .utils import (
+    PromptEmbeddingCache,
+    encode_prompt,
+    sample_vae_latents,
+    vae_encode,
+)
 
 
 def compute_embeddings(
@@ -25,6 +30,7 @@ def compute_embeddings(
     text_encoders,
     tokenizers,
     is_train=True,
+    prompt_embeds_cache: Optional[PromptEmbeddingCache] = None,
     **kwargs,
 ):
     original_size = kwargs["original_size"]
@@ -35,9 +41,14 @@ def compute_embeddings(
         if empty_prompt_indices[i]:
             prompt_batch[i] = ""
 
-    prompt_embeds, pooled_prompt_embeds = encode_prompt(
-        prompt_batch, text_encoders, tokenizers, 0, is_train
-    )
+    if prompt_embeds_cache is not None:
+        prompt_embeds, pooled_prompt_embeds = prompt_embeds_cache.encode(
+            prompt_batch, device=empty_prompt_indices.device, is_train=is_train
+        )
+    else:
+        prompt_embeds, pooled_prompt_embeds = encode_prompt(
+            prompt_batch, text_encoders, tokenizers, 0, is_train
+        )
     add_text_embeds = pooled_prompt_embeds.to(
         device=prompt_embeds.device, dtype=prompt_embeds.dtype
     )
@@ -69,6 +80,11 @@ class IG2MVSDXLSystem(BaseSystem):
         use_fp16_vae: bool = True
         use_fp16_clip: bool = True
 
+        # Prompt embeddings
+        cache_prompt_embeds: bool = False
+        prompt_embeds_path: Optional[str] = None  # built by systems/prompt_cache.py
+        drop_text_encoders: bool = False  # needs every prompt in prompt_embeds_path
+
         # Training
         trainable_modules: List[str] = field(default_factory=list)
         train_cond_encoder: bool = True
@@ -184,6 +200,23 @@ class IG2MVSDXLSystem(BaseSystem):
         self.text_encoder.requires_grad_(False)
         self.text_encoder_2.requires_grad_(False)
 
+        # Prepare prompt embedding cache
+        self.prompt_embeds_cache: Optional[PromptEmbeddingCache] = None
+        if self.cfg.cache_prompt_embeds or self.cfg.prompt_embeds_path is not None:
+            self.prompt_embeds_cache = PromptEmbeddingCache(
+                [self.tokenizer, self.tokenizer_2],
+                [self.text_encoder, self.text_encoder_2],
+            )
+            if self.cfg.prompt_embeds_path is not None:
+                self.prompt_embeds_cache.load(self.cfg.prompt_embeds_path)
+        if self.cfg.drop_text_encoders:
+            assert (
+                self.cfg.prompt_embeds_path is not None
+            ), "drop_text_encoders requires prompt_embeds_path"
+            self.prompt_embeds_cache.text_encoders = None
+            self.text_encoder, self.text_encoder_2 = None, None
+            self.pipeline.text_encoder, self.pipeline.text_encoder_2 = None, None
+
         # Others
         # Prepare gradient checkpointing
         if self.cfg.gradient_checkpointing:
@@ -225,6 +258,7 @@ class IG2MVSDXLSystem(BaseSystem):
                 prompt_drop_mask,
                 [self.text_encoder, self.text_encoder_2],
                 [self.tokenizer, self.tokenizer_2],
+                prompt_embeds_cache=self.prompt_embeds_cache,
                 **kwargs,
             )
 
@@ -282,25 +316,38 @@ class IG2MVSDXLSystem(BaseSystem):
 
         vae_max_slice = 8
         with torch.no_grad(), torch.cuda.amp.autocast(enabled=False):
-            latents = []
-            for i in range(0, batch["rgb"].shape[0], vae_max_slice):
-                latents.append(
-                    vae_encode(
-                        self.vae,
-                        batch["rgb"][i : i + vae_max_slice].to(self.vae.dtype) * 2 - 1,
-                        sample=True,
-                        apply_scale=True,
-                    ).float()
+            if "latent_mean" in batch:
+                latents = sample_vae_latents(
+                    self.vae, batch["latent_mean"], batch["latent_std"]
                 )
-            latents = torch.cat(latents, dim=0)
+            else:
+                latents = []
+                for i in range(0, batch["rgb"].shape[0], vae_max_slice):
+                    pixel_values = batch["rgb"][i : i + vae_max_slice]
+                    latents.append(
+                        vae_encode(
+                            self.vae,
+                            pixel_values.to(self.vae.dtype) * 2 - 1,
+                            sample=True,
+                            apply_scale=True,
+                        ).float()
+                    )
+                latents = torch.cat(latents, dim=0)
 
         with torch.no_grad(), torch.cuda.amp.autocast(enabled=False):
-            ref_latents = vae_encode(
-                self.vae,
-                batch["reference_rgb"].to(self.vae.dtype) * 2 - 1,
-                sample=True,
-                apply_scale=True,
-            ).float()
+            if "reference_latent_mean" in batch:
+                ref_latents = sample_vae_latents(
+                    self.vae,
+                    batch["reference_latent_mean"],
+                    batch["reference_latent_std"],
+                )
+            else:
+                ref_latents = vae_encode(
+                    self.vae,
+                    batch["reference_rgb"].to(self.vae.dtype) * 2 - 1,
+                    sample=True,
+                    apply_scale=True,
+                ).float()
 
         bsz = latents.shape[0]
         b_samples = bsz // num_views
@@ -385,7 +432,7 @@ class IG2MVSDXLSystem(BaseSystem):
         pass
 
     def get_input_visualizations(self, batch):
-        return [
+        images = [
             {
                 "type": "rgb",
                 "img": rearrange(
@@ -394,20 +441,30 @@ class IG2MVSDXLSystem(BaseSystem):
                     N=batch["num_views"],
                 ),
                 "kwargs": {"data_format": "HWC"},
-            },
-            {
-                "type": "rgb",
-                "img": rearrange(batch["reference_rgb"], "B C H W -> (B H) W C"),
-                "kwargs": {"data_format": "HWC"},
-            },
-            {
-                "type": "rgb",
-                "img": rearrange(
-                    batch["rgb"], "(B N) C H W -> (B H) (N W) C", N=batch["num_views"]
-                ),
-                "kwargs": {"data_format": "HWC"},
-            },
+            }
         ]
+        # images are not loaded when training from precomputed latents
+        if "reference_rgb" in batch:
+            images.append(
+                {
+                    "type": "rgb",
+                    "img": rearrange(batch["reference_rgb"], "B C H W -> (B H) W C"),
+                    "kwargs": {"data_format": "HWC"},
+                }
+            )
+        if "rgb" in batch:
+            images.append(
+                {
+                    "type": "rgb",
+                    "img": rearrange(
+                        batch["rgb"],
+                        "(B N) C H W -> (B H) (N W) C",
+                        N=batch["num_views"],
+                    ),
+                    "kwargs": {"data_format": "HWC"},
+                }
+            )
+        return images
 
     def get_output_visualizations(self, batch, outputs):
         images = [
@@ -442,9 +499,31 @@ class IG2MVSDXLSystem(BaseSystem):
         ]
         return images
 
+    def get_prompt_kwargs(self, prompts):
+        if self.prompt_embeds_cache is None:
+            return {"prompt": prompts}
+        prompt_embeds, pooled_prompt_embeds = self.prompt_embeds_cache.encode(
+            prompts, device=self.device, is_train=False
+        )
+        prompt_kwargs = {
+            "prompt_embeds": prompt_embeds,
+            "pooled_prompt_embeds": pooled_prompt_embeds,
+        }
+        if not self.pipeline.config.force_zeros_for_empty_prompt:
+            negative_prompt_embeds, negative_pooled_prompt_embeds = (
+                self.prompt_embeds_cache.encode(
+                    [""] * len(prompts), device=self.device, is_train=False
+                )
+            )
+            prompt_kwargs.update(
+                negative_prompt_embeds=negative_prompt_embeds,
+                negative_pooled_prompt_embeds=negative_pooled_prompt_embeds,
+            )
+        return prompt_kwargs
+
     def generate_images(self, batch, **kwargs):
         return self.pipeline(
-            prompt=batch["prompts"],
+            **self.get_prompt_kwargs(batch["prompts"]),
             control_image=batch["source_rgb"],
             num_images_per_prompt=batch["num_views"],
             generator=torch.Generator(device=self.device).manual_seed(
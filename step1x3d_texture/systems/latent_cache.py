@@ -0,0 +1,158 @@
+import argparse
+import os
+
+import numpy as np
+import torch
+from diffusers.models import AutoencoderKL
+from torch.utils.data import DataLoader, Dataset
+from tqdm import tqdm
+
+from ..data.multiview import MultiviewDataModuleConfig, MultiviewDataset
+from ..data.records import RecordWriter
+from ..utils.config import load_config, parse_structured
+from ..utils.typing import *
+
+
+class MultiviewImageDataset(Dataset):
+    """
+    All target views and all reference views of every scene of a
+    MultiviewDataset, loaded as MultiviewDataset does without augmentations.
+    """
+
+    def __init__(self, dataset: MultiviewDataset, skip_keys=()) -> None:
+        self.dataset = dataset
+        self.skip_keys = skip_keys
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def load_images(self, scene_dir, image_modality, image_names):
+        cfg = self.dataset.cfg
+        background_color = torch.as_tensor(
+            self.dataset.get_bg_color(cfg.background_color)
+        )
+        images = [
+            self.dataset.load_image(
+                os.path.join(scene_dir, f"{image_modality}_{f}.{cfg.image_suffix}"),
+                height=cfg.height,
+                width=cfg.width,
+                background_color=background_color,
+            )
+            for f in image_names
+        ]
+        return torch.stack(images, dim=0).permute(0, 3, 1, 2)
+
+    def __getitem__(self, index):
+        cfg = self.dataset.cfg
+        scene_dir = self.dataset.all_scenes[index]
+        key = os.path.basename(scene_dir)
+        if key in self.skip_keys:
+            return None
+        ret = {"key": key}
+        try:
+            ret["rgb"] = self.load_images(
+                scene_dir, cfg.image_modality, cfg.image_names
+            )
+            if self.dataset.reference_scenes is not None:
+                ret["reference_rgb"] = self.load_images(
+                    self.dataset.reference_scenes[scene_dir],
+                    cfg.reference_image_modality,
+                    cfg.reference_image_names,
+                )
+        except Exception as e:
+            print(f"Error in {scene_dir}: {e}")
+            return None
+        return ret
+
+
+@torch.no_grad()
+def precompute_multiview_latents(
+    vae: AutoencoderKL,
+    dataset: MultiviewDataset,
+    record_dir: str,
+    vae_max_slice: int = 8,
+    num_workers: int = 8,
+) -> None:
+    """
+    Store the mean and std of the VAE posterior of every target view and every
+    reference view of the dataset scenes, keyed by scene id.
+    """
+    cfg = dataset.cfg
+    writer = RecordWriter(record_dir)
+    writer.meta.update(
+        image_modality=cfg.image_modality,
+        image_names=list(cfg.image_names),
+        reference_image_names=(
+            list(cfg.reference_image_names)
+            if dataset.reference_scenes is not None
+            else []
+        ),
+        height=cfg.height,
+        width=cfg.width,
+        background_color=dataset.get_bg_color(cfg.background_color).tolist(),
+    )
+    loader = DataLoader(
+        MultiviewImageDataset(dataset, skip_keys=set(writer.index["keys"])),
+        batch_size=None,
+        num_workers=num_workers,
+    )
+
+    def encode(images):
+        means, stds = [], []
+        for i in range(0, images.shape[0], vae_max_slice):
+            pixel_values = images[i : i + vae_max_slice].to(vae.device, vae.dtype)
+            latent_dist = vae.encode(pixel_values * 2 - 1).latent_dist
+            means.append(latent_dist.mean.cpu().numpy().astype(np.float16))
+            stds.append(latent_dist.std.cpu().numpy().astype(np.float16))
+        return np.concatenate(means), np.concatenate(stds)
+
+    for i, item in enumerate(tqdm(loader, desc="Encoding latents")):
+        if item is None or item["key"] in writer:
+            continue
+        arrays = {}
+        arrays["mean"], arrays["std"] = encode(item["rgb"])
+        if "reference_rgb" in item:
+            arrays["reference_mean"], arrays["reference_std"] = encode(
+                item["reference_rgb"]
+            )
+        writer.add(item["key"], arrays)
+        if (i + 1) % 1000 == 0:
+            writer.close()  # save progress
+    writer.close()
+
+
+if __name__ == "__main__":
+    # python -m <package>.step1x3d_texture.systems.latent_cache \
+    #     --config <ig2mv config>.yaml --record_dir <data>/latent_records
+    # then train with data.latent_record_dir=<data>/latent_records
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, required=True)
+    parser.add_argument("--record_dir", type=str, required=True)
+    parser.add_argument("--device", type=str, default="cuda")
+    args, extras = parser.parse_known_args()
+
+    cfg = load_config(args.config, cli_args=extras, makedirs=False)
+    data_cfg = parse_structured(MultiviewDataModuleConfig, cfg.data)
+    data_cfg.latent_record_dir = None
+    vae_path = cfg.system.get(
+        "pretrained_vae_name_or_path", "madebyollin/sdxl-vae-fp16-fix"
+    )
+    if vae_path is not None:
+        vae = AutoencoderKL.from_pretrained(vae_path)
+    else:
+        vae = AutoencoderKL.from_pretrained(
+            cfg.system.get(
+                "pretrained_model_name_or_path",
+                "stabilityai/stable-diffusion-xl-base-1.0",
+            ),
+            subfolder="vae",
+        )
+    vae_dtype = torch.float16 if cfg.system.get("use_fp16_vae", True) else torch.float32
+    vae.to(args.device, dtype=vae_dtype).eval().requires_grad_(False)
+
+    precompute_multiview_latents(
+        vae,
+        MultiviewDataset(data_cfg, "train"),
+        args.record_dir,
+        num_workers=data_cfg.num_workers,
+    )
@@ -0,0 +1,94 @@
+import argparse
+import json
+import os
+
+import torch
+from transformers import CLIPTextModel, CLIPTextModelWithProjection, CLIPTokenizer
+
+from ..data.multiview import MultiviewDataModuleConfig
+from ..utils.config import load_config, parse_structured
+from ..utils.typing import *
+from .utils import PromptEmbeddingCache
+
+
+def collect_prompts(cfg: MultiviewDataModuleConfig) -> List[str]:
+    """
+    Every prompt MultiviewDataset can return, plus the empty prompt used for
+    prompt dropping.
+    """
+    prompts = [""]
+    if cfg.prompt_db_path is not None and not cfg.use_empty_prompt:
+        with open(cfg.prompt_db_path) as f:
+            for prompt in json.load(f).values():
+                prompts += prompt if isinstance(prompt, list) else [prompt]
+    if cfg.prompt_prefix is not None:
+        prefixes = cfg.prompt_prefix
+        if isinstance(prefixes, str):
+            prefixes = [prefixes]
+        prompts = [""] + [f"{prefix} {p}" for prefix in prefixes for p in prompts]
+    return list(dict.fromkeys(prompts))
+
+
+def load_text_encoders(pretrained_model_name_or_path: str, dtype: torch.dtype):
+    # resolve the snapshot like DiffusionPipeline.from_pretrained does, so that
+    # the encoder revision matches the one seen by IG2MVSDXLSystem
+    if os.path.isdir(pretrained_model_name_or_path):
+        model_dir = pretrained_model_name_or_path
+    else:
+        from huggingface_hub import snapshot_download
+
+        model_dir = snapshot_download(
+            pretrained_model_name_or_path,
+            allow_patterns=[
+                "tokenizer/*",
+                "tokenizer_2/*",
+                "text_encoder/*",
+                "text_encoder_2/*",
+            ],
+        )
+    tokenizers = [
+        CLIPTokenizer.from_pretrained(os.path.join(model_dir, "tokenizer")),
+        CLIPTokenizer.from_pretrained(os.path.join(model_dir, "tokenizer_2")),
+    ]
+    text_encoders = [
+        CLIPTextModel.from_pretrained(os.path.join(model_dir, "text_encoder")),
+        CLIPTextModelWithProjection.from_pretrained(
+            os.path.join(model_dir, "text_encoder_2")
+        ),
+    ]
+    text_encoders = [
+        text_encoder.to(dtype=dtype).requires_grad_(False).eval()
+        for text_encoder in text_encoders
+    ]
+    return tokenizers, text_encoders
+
+
+if __name__ == "__main__":
+    # python -m <package>.step1x3d_texture.systems.prompt_cache \
+    #     --config <ig2mv config>.yaml --output <data>/prompt_embeds.safetensors
+    # then train with system.prompt_embeds_path=<data>/prompt_embeds.safetensors
+    # and system.drop_text_encoders=true
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", type=str, required=True)
+    parser.add_argument("--output", type=str, required=True)
+    parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument("--device", type=str, default="cuda")
+    args, extras = parser.parse_known_args()
+
+    cfg = load_config(args.config, cli_args=extras, makedirs=False)
+    data_cfg = parse_structured(MultiviewDataModuleConfig, cfg.data)
+    tokenizers, text_encoders = load_text_encoders(
+        cfg.system.get(
+            "pretrained_model_name_or_path", "stabilityai/stable-diffusion-xl-base-1.0"
+        ),
+        torch.float16 if cfg.system.get("use_fp16_clip", True) else torch.float32,
+    )
+    cache = PromptEmbeddingCache(tokenizers, text_encoders)
+    for text_encoder in text_encoders:
+        text_encoder.to(args.device)
+
+    prompts = collect_prompts(data_cfg)
+    print(f"Encoding {len(prompts)} prompts")
+    cache.add(prompts, batch_size=args.batch_size)
+    cache.save(args.output)
+    print(f"Saved {len(cache)} prompt embeddings to {args.output}")
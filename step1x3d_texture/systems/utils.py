@@ -25,12 +25,25 @@ def vae_encode(
     return latents
 
 
-# Adapted from pipelines.StableDiffusionXLPipeline.encode_prompt
-def encode_prompt(
-    prompt_batch, text_encoders, tokenizers, proportion_empty_prompts, is_train=True
+def sample_vae_latents(
+    vae: AutoencoderKL,
+    latent_mean: Float[Tensor, "B C H W"],
+    latent_std: Float[Tensor, "B C H W"],
+    sample: bool = True,
+    apply_scale: bool = True,
 ):
-    prompt_embeds_list = []
+    """
+    vae_encode from precomputed posterior moments.
+    """
+    latents = latent_mean.float()
+    if sample:
+        latents = latents + latent_std.float() * torch.randn_like(latents)
+    if apply_scale:
+        latents = latents * vae.config.scaling_factor
+    return latents
+
 
+def select_captions(prompt_batch, proportion_empty_prompts, is_train=True):
     captions = []
     for caption in prompt_batch:
         if random.random() < proportion_empty_prompts:
@@ -40,6 +53,16 @@ def encode_prompt(
         elif isinstance(caption, (list, np.ndarray)):
             # take a random caption if there are multiple
             captions.append(random.choice(caption) if is_train else caption[0])
+    return captions
+
+
+# Adapted from pipelines.StableDiffusionXLPipeline.encode_prompt
+def encode_prompt(
+    prompt_batch, text_encoders, tokenizers, proportion_empty_prompts, is_train=True
+):
+    prompt_embeds_list = []
+
+    captions = select_captions(prompt_batch, proportion_empty_prompts, is_train)
 
     with torch.no_grad():
         for tokenizer, text_encoder in zip(tokenizers, text_encoders):
@@ -68,6 +91,128 @@ def encode_prompt(
     return prompt_embeds, pooled_prompt_embeds
 
 
+def text_encoder_revision(text_encoders) -> str:
+    revisions = []
+    for text_encoder in text_encoders:
+        config = text_encoder.config
+        revision = getattr(config, "_commit_hash", None) or config._name_or_path
+        revisions.append(
+            f"{type(text_encoder).__name__}@{revision}:{text_encoder.dtype}"
+        )
+    return ";".join(revisions)
+
+
+class PromptEmbeddingCache:
+    """
+    Output of encode_prompt per caption, keyed by the token ids of all
+    tokenizers, so that every distinct prompt is encoded only once. The table
+    can be saved and loaded to train without the text encoders
+    (text_encoders=None), in which case every prompt has to be in the table.
+    Embeddings are kept on the CPU and gathered per batch.
+    """
+
+    def __init__(self, tokenizers, text_encoders=None, revision=None) -> None:
+        self.tokenizers = tokenizers
+        self.text_encoders = text_encoders
+        if revision is None and text_encoders is not None:
+            revision = text_encoder_revision(text_encoders)
+        self.revision = revision
+        self.token_keys: Dict[str, Tuple[int, ...]] = {}
+        self.embeds: Dict[Tuple[int, ...], Tuple[Tensor, Tensor]] = {}
+
+    def __len__(self):
+        return len(self.embeds)
+
+    def get_keys(self, captions: List[str]) -> List[Tuple[int, ...]]:
+        new_captions = list(
+            dict.fromkeys(c for c in captions if c not in self.token_keys)
+        )
+        if len(new_captions) > 0:
+            input_ids = torch.cat(
+                [
+                    tokenizer(
+                        new_captions,
+                        padding="max_length",
+                        max_length=tokenizer.model_max_length,
+                        truncation=True,
+                        return_tensors="pt",
+                    ).input_ids
+                    for tokenizer in self.tokenizers
+                ],
+                dim=-1,
+            )
+            for caption, ids in zip(new_captions, input_ids.tolist()):
+                self.token_keys[caption] = tuple(ids)
+        return [self.token_keys[caption] for caption in captions]
+
+    @torch.no_grad()
+    def add(self, captions: List[str], batch_size: int = 64) -> None:
+        keys = self.get_keys(captions)
+        missing = list(
+            dict.fromkeys(c for c, k in zip(captions, keys) if k not in self.embeds)
+        )
+        if len(missing) > 0 and self.text_encoders is None:
+            raise KeyError(
+                f"{len(missing)} prompts are not in the prompt embedding table, "
+                f"e.g. {missing[0]!r}"
+            )
+        for i in range(0, len(missing), batch_size):
+            chunk = missing[i : i + batch_size]
+            prompt_embeds, pooled_prompt_embeds = encode_prompt(
+                chunk, self.text_encoders, self.tokenizers, 0
+            )
+            prompt_embeds = prompt_embeds.cpu()
+            pooled_prompt_embeds = pooled_prompt_embeds.cpu()
+            for j, key in enumerate(self.get_keys(chunk)):
+                self.embeds[key] = (prompt_embeds[j], pooled_prompt_embeds[j])
+
+    def encode(self, prompt_batch, device=None, is_train=True):
+        """
+        Drop-in replacement of encode_prompt(prompt_batch, ..., 0, is_train).
+        """
+        captions = select_captions(prompt_batch, 0, is_train)
+        self.add(captions)
+        embeds = [self.embeds[key] for key in self.get_keys(captions)]
+        prompt_embeds = torch.stack([e[0] for e in embeds], dim=0)
+        pooled_prompt_embeds = torch.stack([e[1] for e in embeds], dim=0)
+        return (
+            prompt_embeds.to(device, non_blocking=True),
+            pooled_prompt_embeds.to(device, non_blocking=True),
+        )
+
+    def save(self, path: str) -> None:
+        from safetensors.torch import save_file
+
+        keys = list(self.embeds.keys())
+        embeds = [self.embeds[key] for key in keys]
+        save_file(
+            {
+                "input_ids": torch.as_tensor(keys, dtype=torch.int64),
+                "prompt_embeds": torch.stack([e[0] for e in embeds]),
+                "pooled_prompt_embeds": torch.stack([e[1] for e in embeds]),
+            },
+            path,
+            metadata={"revision": self.revision or ""},
+        )
+
+    def load(self, path: str) -> None:
+        from safetensors import safe_open
+
+        with safe_open(path, framework="pt", device="cpu") as f:
+            revision = f.metadata().get("revision", "")
+            if self.revision is not None and revision != self.revision:
+                raise ValueError(
+                    f"Prompt embedding table {path} was built with text encoders "
+                    f"{revision}, expected {self.revision}"
+                )
+            self.revision = revision
+            input_ids = f.get_tensor("input_ids").tolist()
+            prompt_embeds = f.get_tensor("prompt_embeds")
+            pooled_prompt_embeds = f.get_tensor("pooled_prompt_embeds")
+        for i, ids in enumerate(input_ids):
+            self.embeds[tuple(ids)] = (prompt_embeds[i], pooled_prompt_embeds[i])
+
+
 CLIP_INPUT_MEAN = torch.as_tensor(
     [0.48145466, 0.4578275, 0.40821073], dtype=torch.float32
 )[None, :, None, None]
@@ -0,0 +1,125 @@
+import queue
+import threading
+import time
+
+import numpy as np
+import torch
+
+from .core import logger
+from .typing import *
+
+
+class AsyncWriter:
+    """
+    Runs save jobs on a pool of worker threads fed by a bounded queue, so that
+    encoding and file writes do not block the training loop. When the queue is
+    full, submit blocks, and the time spent blocked is accumulated in
+    blocked_seconds as a measure of backpressure. Failed jobs are logged and
+    counted in num_failed.
+    """
+
+    def __init__(self, num_workers: int = 2, max_queue_size: int = 32) -> None:
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.blocked_seconds = 0.0
+        self.num_submitted = 0
+        self.num_failed = 0
+        self.lock = threading.Lock()
+        self.workers = [
+            threading.Thread(target=self._work, daemon=True)
+            for _ in range(num_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                self.queue.task_done()
+                return
+            fn, save_path, args = job
+            try:
+                fn(save_path, *args)
+            except Exception:
+                with self.lock:
+                    self.num_failed += 1
+                logger.warning(f"Failed to save {save_path}", exc_info=True)
+            finally:
+                self.queue.task_done()
+
+    def submit(self, fn, save_path, *args) -> None:
+        start = time.perf_counter()
+        self.queue.put((fn, save_path, args))
+        self.blocked_seconds += time.perf_counter() - start
+        self.num_submitted += 1
+
+    def get_stats(self) -> Dict[str, float]:
+        return {
+            "queue_size": self.queue.qsize(),
+            "blocked_seconds": self.blocked_seconds,
+            "submitted": self.num_submitted,
+            "failed": self.num_failed,
+        }
+
+    def flush(self) -> None:
+        self.queue.join()
+
+    def close(self) -> None:
+        self.flush()
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+
+class AsyncSaverMixin:
+    """
+    Background saving for SaverMixin. save_* methods hand their writer and
+    arguments to _submit_save, which runs it right away or on the AsyncWriter
+    once start_async_saving was called.
+    """
+
+    _async_writer: Optional[AsyncWriter] = None
+
+    def start_async_saving(self, num_workers: int, max_queue_size: int) -> None:
+        """
+        Run the save_* methods in the background from now on. The data to save
+        is copied to the CPU before save_* returns, so it can be modified or
+        freed right away. num_workers=0 keeps saving synchronous.
+        """
+        self.stop_async_saving()
+        if num_workers > 0:
+            self._async_writer = AsyncWriter(num_workers, max_queue_size)
+
+    def stop_async_saving(self) -> None:
+        if self._async_writer is not None:
+            self._async_writer.close()
+            self._async_writer = None
+
+    def flush_saves(self) -> None:
+        if self._async_writer is not None:
+            self._async_writer.flush()
+
+    def get_save_stats(self) -> Dict[str, float]:
+        if self._async_writer is None:
+            return {}
+        return self._async_writer.get_stats()
+
+    def snapshot_data(self, data):
+        # copy of everything that may still change after save_* returns
+        if isinstance(data, torch.Tensor):
+            return data.detach().to("cpu", copy=True)
+        elif isinstance(data, np.ndarray):
+            return data.copy()
+        elif isinstance(data, (list, tuple)):
+            return type(data)(self.snapshot_data(d) for d in data)
+        elif isinstance(data, dict):
+            return {k: self.snapshot_data(v) for k, v in data.items()}
+        return data
+
+    def _submit_save(self, fn, save_path, *args) -> None:
+        if self._async_writer is None:
+            fn(save_path, *args)
+        else:
+            self._async_writer.submit(fn, save_path, *self.snapshot_data(args))
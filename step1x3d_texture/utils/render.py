@@ -14,6 +14,7 @@ from torch import BoolTensor, FloatTensor
 
 from . import logging
 from .camera import Camera
+from ...step1x3d_geometry.models.pipelines.pipeline_utils import flatten_scene
 import xatlas
 
 logger = logging.get_logger(__name__)
@@ -122,7 +123,7 @@ class TexturedMesh:
 
 def mesh_uv_wrap(mesh):
     if isinstance(mesh, trimesh.Scene):
-        mesh = mesh.dump(concatenate=True)
+        mesh = flatten_scene(mesh)
 
     if len(mesh.faces) > 500000000:
         raise ValueError(
@@ -157,9 +158,7 @@ def load_mesh(
     if isinstance(scene, trimesh.Trimesh):
         mesh = scene
     elif isinstance(scene, trimesh.scene.Scene):
-        mesh = trimesh.Trimesh()
-        for obj in scene.geometry.values():
-            mesh = trimesh.util.concatenate([mesh, obj])
+        mesh = flatten_scene(scene)
     else:
         raise ValueError(f"Unknown mesh type at {mesh_path}.")
 
@@ -253,6 +252,34 @@ def load_mesh(
     return textured_mesh, mesh_bp
 
 
+@dataclass
+class PreparedMesh:
+    """
+    Geometry of one texturing job, normalized and uploaded to the device once
+    and shared by control rendering, back-projection and baking.
+    """
+
+    # mesh in the standard frame, used for control rendering
+    mesh: TexturedMesh
+    # uv-wrapped and rescaled mesh in its original frame, used for baking and export
+    mesh_bp: trimesh.Trimesh
+    # device copies of mesh_bp
+    v_pos: torch.FloatTensor
+    t_pos_idx: torch.LongTensor
+    v_tex: torch.FloatTensor
+
+
+def prepare_mesh(mesh, device: Optional[str] = None, **kwargs) -> PreparedMesh:
+    textured_mesh, mesh_bp = load_mesh(mesh, device=device, **kwargs)
+    return PreparedMesh(
+        mesh=textured_mesh,
+        mesh_bp=mesh_bp,
+        v_pos=torch.tensor(mesh_bp.vertices, dtype=torch.float32, device=device),
+        t_pos_idx=torch.tensor(mesh_bp.faces, dtype=torch.int64, device=device),
+        v_tex=torch.tensor(mesh_bp.visual.uv, dtype=torch.float32, device=device),
+    )
+
+
 @dataclass
 class RenderOutput:
     attr: Optional[torch.FloatTensor] = None